@@ -2,10 +2,13 @@
 """
 Planchette The Talking Board — entry point
 Run: python . (or python __main__.py)
+Accounts: python . --user list|add NAME|remove NAME|quota NAME REQUESTS_PER_MIN TOKENS_PER_MIN
+Calibrate threads and batch size for this host: python . --calibrate
 """
 
 import os
 import sys
+import signal
 import asyncio
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -19,6 +22,29 @@ CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "planchet
 
 cfg = ensure_config(CONFIG_PATH)
 
+if __name__ == "__main__" and "--inference-server" in sys.argv:
+    from pymodules.inference_server import serve
+
+    serve(cfg, CONFIG_PATH)
+    sys.exit(0)
+
+if __name__ == "__main__" and "--calibrate" in sys.argv:
+    from pymodules.model_manager import configure
+    from pymodules import calibration
+
+    configure(cfg)
+    try:
+        result = calibration.calibrate(cfg, CONFIG_PATH, report=print)
+    except RuntimeError as e:
+        sys.exit(str(e))
+    print(f"Saved to [model] in {CONFIG_PATH}: " + ", ".join(f"{key} = {value}" for key, value in result.items()))
+    sys.exit(0)
+
+if __name__ == "__main__" and "--user" in sys.argv:
+    from pymodules.auth import manage_users
+
+    sys.exit(manage_users(cfg, CONFIG_PATH, sys.argv[sys.argv.index("--user") + 1 :]))
+
 app = create_app(cfg, CONFIG_PATH)
 
 if __name__ == "__main__":
@@ -29,6 +55,18 @@ if __name__ == "__main__":
 
     show_banner(host, port, run_mode, ssl_active)
 
+    # The debug reloader runs this file twice: a watcher that only restarts the server, and the server itself
+    serving = run_mode != "DEV" or os.environ.get("WERKZEUG_RUN_MAIN") == "true"
+
+    socket_backend = cfg.get("inference", "backend", fallback="local") == "socket"
+    if serving and socket_backend and cfg.getboolean("inference", "spawn_server", fallback=True):
+        from pymodules.inference_server import supervise
+
+        supervise(os.path.abspath(__file__))
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # unwind through atexit, which stops the daemon
+    elif serving and not socket_backend:
+        app.config["INFERENCE"].boot(CONFIG_PATH)  # the inference daemon boots on its own
+
     if ssl_active:
         ssl_dir = os.path.join(os.getcwd(), "ssl")
         cert_info = get_ssl_cert_info(os.path.join(ssl_dir, "fullchain.pem"))
@@ -42,7 +80,7 @@ if __name__ == "__main__":
     else:
         from hypercorn.config import Config
         from hypercorn.asyncio import serve
-        from asgiref.wsgi import WsgiToAsgi
+        from pymodules.asgi import create_asgi_app
 
         hc = Config()
         hc.bind = [f"{host}:{port}"]
@@ -55,5 +93,5 @@ if __name__ == "__main__":
             hc.keyfile = os.path.join(ssl_dir, "privkey.pem")
             hc.ca_certs = os.path.join(ssl_dir, "chain.pem")
 
-        asgi_app = WsgiToAsgi(app)
+        asgi_app = create_asgi_app(app)
         asyncio.run(serve(asgi_app, hc))
@@ -0,0 +1,96 @@
+"""
+Planchette ask pipeline benchmark
+Run from the project root: python -m bench [--model stub|auto|PATH] [--front flask|asgi] [--out results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.harness import resolve_model, build_app, version, FlaskDriver, AsgiDriver, run_load, summarize
+from bench.stub_llama import StubCosts
+
+_QUESTIONS = ("Will I find love this year?", "Is anyone here with us?", "What is your name?", "Should I take the new job?", "Where did I leave my keys?", "Are you a friendly spirit?", "Will it rain tomorrow?", "How did you die?")
+_ANSWERS = ("YES. SOON.", "NO.", "MAYBE.", "M... A... R... I... A...", "YES.", "BEWARE.")
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Drive /api/ask at a fixed concurrency and report latency percentiles as JSON.")
+    parser.add_argument("--model", default="auto", help="stub, a GGUF path, or auto: the downloaded model if present, else the stub (default auto)")
+    parser.add_argument("--front", choices=("flask", "asgi"), default="asgi", help="Flask test client (WSGI) or the pymodules.asgi front end, both in process (default asgi)")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=2, help="untimed requests first, to load the model (default 2)")
+    parser.add_argument("--history", type=int, default=6, help="history messages sent with each question (default 6)")
+    parser.add_argument("--crisis-rate", type=float, default=1.0, help="fraction of requests asking for a crisis check (default 1.0)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", choices=("pool", "batch"), default="pool")
+    parser.add_argument("--pool-size", default=None, help="[inference] pool_size, default: the concurrency")
+    parser.add_argument("--batch-size", type=int, default=None, help="[inference] batch_size, default: the concurrency")
+    parser.add_argument("--prompt-ms", type=float, default=StubCosts.prompt_ms, help=f"stub cost per prompt token (default {StubCosts.prompt_ms})")
+    parser.add_argument("--decode-ms", type=float, default=StubCosts.decode_ms, help=f"stub cost per generated token (default {StubCosts.decode_ms})")
+    parser.add_argument("--load-ms", type=float, default=StubCosts.load_ms, help=f"stub cost per model load (default {StubCosts.load_ms})")
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+    model = resolve_model(args.model)
+    if model == "stub":
+        if args.engine == "batch":
+            sys.exit("The stub model only covers the pool engine; run --engine batch against a GGUF.")
+        StubCosts.prompt_ms, StubCosts.decode_ms, StubCosts.load_ms = args.prompt_ms, args.decode_ms, args.load_ms
+    elif not os.path.isfile(model):
+        sys.exit(f"No model at {model}")
+
+    options = {
+        "engine": args.engine,
+        "pool_size": args.pool_size or args.concurrency,
+        "batch_size": args.batch_size or args.concurrency,
+        "queue_depth": args.requests + args.concurrency,
+        "spawn_server": "false",
+    }
+    app = build_app(model, options)
+    driver = AsgiDriver(app) if args.front == "asgi" else FlaskDriver(app)
+
+    rng = random.Random(args.seed)
+    history = []
+    for i in range(args.history // 2):
+        history += [{"role": "user", "content": _QUESTIONS[i % len(_QUESTIONS)]}, {"role": "assistant", "content": _ANSWERS[i % len(_ANSWERS)]}]
+    checks = [rng.random() < args.crisis_rate for _ in range(args.warmup + args.requests)]
+
+    def payload(i):
+        return {"question": f"{_QUESTIONS[i % len(_QUESTIONS)]} ({i})", "history": history[: args.history], "checkCrisis": checks[i]}
+
+    session = driver.session()
+    for i in range(args.warmup):
+        driver.ask(session, payload(args.requests + i))
+
+    results, wall_s = run_load(driver, payload, args.requests, args.concurrency)
+    driver.close()
+
+    report = {
+        "version": version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "model": "stub" if model == "stub" else os.path.basename(model),
+        "config": {k: v for k, v in vars(args).items() if k != "out" and (model == "stub" or not k.endswith("_ms"))},
+        "inference": options,
+        "results": summarize(results, wall_s),
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+        print(f"[Bench] {report['results']['ok']}/{args.requests} ok, ttft p95 {(report['results']['ttft_ms'] or {}).get('p95')} ms, wrote {args.out}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+import io
+import os
+import ssl
+import json
+import time
+import asyncio
+import tempfile
+import threading
+import subprocess
+import contextlib
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from dataclasses import dataclass, field
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_USER = ("bench", "bench-password")
+
+
+# ── App Under Test ──────────────────────────────────────────────────────────
+
+
+def resolve_model(choice):
+    """The --model choice, with auto resolved to the downloaded GGUF or "stub"."""
+    if choice != "auto":
+        return choice
+    from pymodules.model_manager import MODEL_PATH
+
+    try:
+        import llama_cpp  # noqa: F401
+    except ImportError:
+        return "stub"
+    return MODEL_PATH if os.path.isfile(MODEL_PATH) else "stub"
+
+
+def build_app(model, options):
+    """Planchette app on a throwaway config; model is "stub" or a GGUF path."""
+    if model == "stub":
+        from bench import stub_llama
+
+        stub_llama.install()
+
+    from pymodules import model_manager
+    from pymodules.config import ensure_config
+    from pymodules.planchette_app import create_app
+    from pymodules.auth import register_user
+
+    workdir = tempfile.mkdtemp(prefix="planchette-bench-")
+    if model == "stub":
+        model = os.path.join(workdir, "stub.gguf")
+        open(model, "wb").close()
+    model_manager.MODEL_PATH = model
+
+    config_path = os.path.join(workdir, "planchette.ini")
+    with contextlib.redirect_stdout(io.StringIO()):
+        cfg = ensure_config(config_path)
+    for key, value in options.items():
+        cfg.set("inference", key, str(value))
+    cfg.set("security", "login_burst", "1000000")  # every bench session logs in from loopback as the same user
+    app = create_app(cfg, config_path)
+    register_user(*_USER)
+    return app
+
+
+def version():
+    try:
+        out = subprocess.run(["git", "describe", "--always", "--dirty"], cwd=_PROJECT_ROOT, capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# ── Drivers ─────────────────────────────────────────────────────────────────
+
+
+@dataclass
+class AskResult:
+    status: int
+    ttft_ms: float | None = None
+    total_ms: float = 0.0
+    tokens: int = 0
+    text: str = ""
+    crisis: bool = False
+    perf: dict = field(default_factory=dict)
+    error: str | None = None
+
+
+class _FrameReader:
+    """Feeds response bytes in, keeps time to first token and the events that arrive."""
+
+    def __init__(self, started):
+        self.started = started
+        self.buffer = ""
+        self.result = AskResult(status=200)
+
+    def feed(self, chunk):
+        self.buffer += chunk.decode("utf-8", errors="replace")
+        *frames, self.buffer = self.buffer.split("\n\n")
+        for frame in frames:
+            if not frame.startswith("data:"):
+                continue
+            event = json.loads(frame[5:])
+            tokens = event.get("tokens") or ([event["token"]] if "token" in event else [])
+            if tokens and self.result.ttft_ms is None:
+                self.result.ttft_ms = (time.perf_counter() - self.started) * 1000
+            self.result.tokens += len(tokens)
+            self.result.text += "".join(tokens)
+            self.result.crisis = self.result.crisis or bool(event.get("crisis"))
+            if "error" in event:
+                self.result.error = event["error"]
+            if event.get("done"):
+                self.result.perf = event.get("perf") or {}
+
+    def finish(self):
+        self.result.total_ms = (time.perf_counter() - self.started) * 1000
+        return self.result
+
+
+class FlaskDriver:
+    """/api/ask through the Flask test client, one logged-in client per session."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def session(self):
+        client = self.app.test_client()
+        client.post("/login", data={"username": _USER[0], "password": _USER[1]})
+        return client
+
+    def ask(self, client, payload):
+        reader = _FrameReader(time.perf_counter())
+        response = client.post("/api/ask", json=payload, headers={"X-Stream": "events"}, buffered=False)
+        if response.status_code != 200:
+            reader.result.status = response.status_code
+            reader.result.error = response.get_data(as_text=True)
+            response.close()
+            return reader.finish()
+        try:
+            for chunk in response.response:
+                reader.feed(chunk)
+        finally:
+            response.close()
+        return reader.finish()
+
+    def close(self):
+        pass
+
+
+class AsgiDriver:
+    """/api/ask through pymodules.asgi on an event loop of its own."""
+
+    def __init__(self, app):
+        from pymodules.asgi import create_asgi_app
+
+        self.flask = app
+        self.app = create_asgi_app(app)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def session(self):
+        client = self.flask.test_client()
+        client.post("/login", data={"username": _USER[0], "password": _USER[1]})
+        return {"cookie": f"session={client.get_cookie('session').value}"}
+
+    def ask(self, session, payload):
+        return asyncio.run_coroutine_threadsafe(self._ask(session, payload), self.loop).result()
+
+    async def _ask(self, session, payload):
+        body = json.dumps(payload).encode()
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": "/api/ask",
+            "raw_path": b"/api/ask",
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(b"host", b"localhost"), (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), (b"cookie", session["cookie"].encode()), (b"x-stream", b"events")],
+            "client": ("127.0.0.1", 40000),
+            "server": ("127.0.0.1", 7777),
+        }
+        reader = _FrameReader(time.perf_counter())
+        done = asyncio.Event()
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                reader.result.status = message["status"]
+                for name, value in message.get("headers", []):
+                    if name == b"set-cookie" and value.startswith(b"session="):
+                        session["cookie"] = value.split(b";", 1)[0].decode()
+            elif message["type"] == "http.response.body":
+                reader.feed(message.get("body", b""))
+                if not message.get("more_body"):
+                    done.set()
+
+        await self.app(scope, receive, send)
+        done.set()
+        result = reader.finish()
+        if result.status != 200:
+            result.error = reader.buffer
+        return result
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class HttpDriver:
+    """/api/ask against a running server, logged in through the login form."""
+
+    def __init__(self, url, username, password, verify=True):
+        self.url = url.rstrip("/")
+        self.credentials = {"username": username, "password": password}
+        self.context = None if verify else ssl._create_unverified_context()
+
+    def session(self):
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), urllib.request.HTTPSHandler(context=self.context))
+        try:
+            with opener.open(self.url + "/login", urllib.parse.urlencode(self.credentials).encode(), timeout=60) as response:
+                landed = urllib.parse.urlparse(response.geturl()).path
+        except urllib.error.HTTPError as e:
+            if e.code == 429:
+                raise RuntimeError(f"Login at {self.url} throttled; raise [security] login_burst on the server for replays") from None
+            raise
+        if landed.rstrip("/").endswith(("/login", "/setup")):
+            raise RuntimeError(f"Login as {self.credentials['username']} at {self.url} failed")
+        return opener
+
+    def ask(self, opener, payload):
+        reader = _FrameReader(time.perf_counter())
+        request = urllib.request.Request(self.url + "/api/ask", json.dumps(payload).encode(), {"Content-Type": "application/json", "X-Stream": "events"})
+        try:
+            response = opener.open(request, timeout=300)
+        except urllib.error.HTTPError as e:
+            reader.result.status = e.code
+            reader.result.error = e.read().decode("utf-8", errors="replace")
+            return reader.finish()
+        except OSError as e:
+            reader.result.status = 0
+            reader.result.error = str(e)
+            return reader.finish()
+        with response:
+            while chunk := response.read1(65536):
+                reader.feed(chunk)
+        return reader.finish()
+
+    def close(self):
+        pass
+
+
+# ── Statistics ──────────────────────────────────────────────────────────────
+
+
+def percentiles(values):
+    """p50/p95/p99 (nearest rank), mean and max of values, or None when there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(p):
+        return round(ordered[max(0, min(len(ordered) - 1, int(-(-p * len(ordered) // 100)) - 1))], 1)
+
+    return {"p50": rank(50), "p95": rank(95), "p99": rank(99), "mean": round(sum(ordered) / len(ordered), 1), "max": round(ordered[-1], 1), "n": len(ordered)}
+
+
+def summarize(results, wall_s):
+    ok = [r for r in results if r.status == 200 and r.error is None]
+    statuses = {}
+    for r in results:
+        statuses[str(r.status)] = statuses.get(str(r.status), 0) + 1
+    tokens = sum(r.tokens for r in ok)
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": len(results) - len(ok),
+        "status": statuses,
+        "wall_s": round(wall_s, 3),
+        "throughput_rps": round(len(ok) / wall_s, 3) if wall_s else None,
+        "tokens_per_s": round(tokens / wall_s, 2) if wall_s else None,
+        "ttft_ms": percentiles([r.ttft_ms for r in ok if r.ttft_ms is not None]),
+        "total_ms": percentiles([r.total_ms for r in ok]),
+        "server": {key: percentiles([r.perf[key] for r in ok if key in r.perf]) for key in ("queue_ms", "crisis_ms", "ttft_ms", "response_ms", "total_ms")},
+    }
+
+
+# ── Load ────────────────────────────────────────────────────────────────────
+
+
+def run_load(driver, make_payload, requests, concurrency):
+    """(results, wall seconds) for `requests` asks over `concurrency` back-to-back sessions."""
+    counter = iter(range(requests))
+    lock = threading.Lock()
+    results = []
+
+    def _worker(session):
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            result = driver.ask(session, make_payload(i))
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=_worker, args=(driver.session(),), daemon=True) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, time.perf_counter() - started
@@ -0,0 +1,314 @@
+"""
+Planchette session replay
+Run from the project root: python -m bench.replay SESSION.md|CAPTURE.jsonl ... [--url https://host:7777 --user NAME] [--out results.json]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import getpass
+import argparse
+import threading
+from glob import glob
+from dataclasses import dataclass, field
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.harness import resolve_model, build_app, version, FlaskDriver, AsgiDriver, HttpDriver, summarize, percentiles
+
+_LOCALES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "static", "js", "locales")
+_LOCALE_LABEL = re.compile(r'^\s*"(You|Spirit):"\s*:\s*"([^"]+)"', re.MULTILINE)
+_RULE = re.compile(r"^\s*(?:-{3,}|\*{3,}|_{3,})\s*$")
+_CLIENT_HISTORY_LIMIT = 80  # the board's starting history limit, until the server suggests one
+_HISTORY_BUCKETS = (0, 4, 8, 16, 32, 64)
+
+
+# ── Sessions ────────────────────────────────────────────────────────────────
+
+
+@dataclass
+class Turn:
+    question: str
+    check_crisis: bool | None = None  # None: decided at replay time
+    at: float | None = None  # capture timestamp, seconds
+
+
+@dataclass
+class Session:
+    name: str
+    turns: list = field(default_factory=list)
+
+
+def _bare(label):
+    return label.strip().rstrip(":\uff1a").strip().casefold()
+
+
+def speaker_labels(extra=()):
+    """{label: "you" | "spirit"} for every board language, plus extra pairs."""
+    labels = {"you": "you", "spirit": "spirit"}
+    for path in sorted(glob(os.path.join(_LOCALES, "*.js"))):
+        with open(path, encoding="utf-8") as f:
+            for key, label in _LOCALE_LABEL.findall(f.read()):
+                labels[_bare(label)] = key.lower()
+    for you, spirit in extra:
+        labels[_bare(you)], labels[_bare(spirit)] = "you", "spirit"
+    return labels
+
+
+def _speaker_pattern(labels):
+    names = "|".join(re.escape(label) for label in sorted(labels, key=len, reverse=True))
+    return re.compile(rf"^\s*(?:[-*>]\s*)*(?:\*\*|__)?({names})\s*[:\uff1a]\s*(?:\*\*|__)?\s*(.*)$", re.IGNORECASE)
+
+
+def parse_transcript(text, name, labels=None):
+    """Sessions from an exported "You:" / "Spirit:" log, one per heading."""
+    labels = labels or speaker_labels()
+    pattern = _speaker_pattern(labels)
+    sessions = [Session(name)]
+    speaker = None
+    for line in text.splitlines():
+        if line.lstrip().startswith("#"):
+            if sessions[-1].turns:
+                sessions.append(Session(f"{name}#{len(sessions) + 1}"))
+            speaker = None
+            continue
+        match = pattern.match(line)
+        if match:
+            speaker = labels[match.group(1).casefold()]
+            if speaker == "you":
+                sessions[-1].turns.append(Turn(match.group(2).strip()))
+        elif not line.strip() or _RULE.match(line):
+            speaker = None
+        elif speaker == "you":
+            turn = sessions[-1].turns[-1]
+            turn.question = f"{turn.question} {line.strip()}".strip()
+    return [s for s in sessions if any(t.question for t in s.turns)]
+
+
+def parse_capture(lines, name):
+    """Sessions from a JSONL capture or the board's own log, one turn per user line."""
+    sessions = {}
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{name}:{number}: {e}") from None
+        if "question" in record:
+            question = record["question"]
+        elif record.get("role") == "user":
+            question = record.get("text") or record.get("content") or ""
+        else:
+            continue
+        sid = str(record.get("session", ""))
+        session = sessions.setdefault(sid, Session(f"{name}:{sid}" if sid else name))
+        check = record.get("checkCrisis")
+        at = record.get("t")
+        session.turns.append(Turn(question.strip(), None if check is None else bool(check), None if at is None else float(at)))
+    return [s for s in sessions.values() if any(t.question for t in s.turns)]
+
+
+def load_sessions(paths, labels=None):
+    sessions = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            if path.endswith((".jsonl", ".ndjson")):
+                found = parse_capture(f, os.path.basename(path))
+            else:
+                found = parse_transcript(f.read(), os.path.basename(path), labels)
+        if not found:
+            raise ValueError(f"No conversations found in {path}; for speaker labels the board does not ship, pass --labels YOU SPIRIT")
+        sessions += found
+    return sessions
+
+
+# ── Replay ──────────────────────────────────────────────────────────────────
+
+
+@dataclass
+class TurnResult:
+    session: str
+    turn: int
+    history_sent: int
+    check_crisis: bool
+    result: object
+
+
+def _play(driver, session, rng, options, deadline, rows, lock):
+    """One conversation the way the board holds it, on its own login."""
+    client = driver.session()
+    log, limit, crisis_window = [], _CLIENT_HISTORY_LIMIT, False
+    previous_at, previous_ms = None, 0.0
+    for index, turn in enumerate(session.turns):
+        if not turn.question:
+            continue
+        if turn.at is not None and previous_at is not None:
+            think = max(0.0, (turn.at - previous_at) - previous_ms / 1000)
+        else:
+            think = rng.uniform(*options.think)
+        previous_at = turn.at
+        time.sleep(think * options.think_scale)
+        if deadline is not None and time.monotonic() >= deadline:
+            return
+
+        check = turn.check_crisis if turn.check_crisis is not None else crisis_window or rng.random() < options.crisis_rate
+        history = [{"role": role, "content": text} for role, text in log[-limit:]]
+        log.append(("user", turn.question))
+        result = driver.ask(client, {"question": turn.question, "history": history, "checkCrisis": check})
+        previous_ms = result.total_ms
+        with lock:
+            rows.append(TurnResult(session.name, index, len(history), check, result))
+
+        if result.text:
+            log.append(("assistant", result.text))
+        crisis_window = crisis_window or result.crisis
+        limit = result.perf.get("history_limit") or limit
+
+
+def replay(driver, sessions, options):
+    """Plays the sessions `options.concurrency` at a time."""
+    rows, lock = [], threading.Lock()
+    deadline = time.monotonic() + options.duration if options.duration else None
+    cursor = iter(range(len(sessions) * (1 << 20 if options.duration else 1)))
+
+    def _worker():
+        while True:
+            with lock:
+                i = next(cursor, None)
+            if i is None or (deadline is not None and time.monotonic() >= deadline):
+                return
+            rng = random.Random(f"{options.seed}:{i}")
+            _play(driver, sessions[i % len(sessions)], rng, options, deadline, rows, lock)
+
+    threads = [threading.Thread(target=_worker, daemon=True) for _ in range(options.concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return rows, time.perf_counter() - started
+
+
+# ── Report ──────────────────────────────────────────────────────────────────
+
+
+def _history_bucket(n):
+    lower = 0
+    for upper in _HISTORY_BUCKETS:
+        if n <= upper:
+            return str(upper) if lower == upper else f"{lower}-{upper}"
+        lower = upper + 1
+    return f"{lower}+"
+
+
+def _group(rows):
+    ok = [r.result for r in rows if r.result.status == 200 and r.result.error is None]
+    return {
+        "turns": len(rows),
+        "errors": len(rows) - len(ok),
+        "ttft_ms": percentiles([r.ttft_ms for r in ok if r.ttft_ms is not None]),
+        "total_ms": percentiles([r.total_ms for r in ok]),
+        "server_crisis_ms": percentiles([r.perf["crisis_ms"] for r in ok if "crisis_ms" in r.perf]),
+        "history_kept": percentiles([r.perf["history_len"] for r in ok if "history_len" in r.perf]),
+        "history_limit": percentiles([r.perf["history_limit"] for r in ok if r.perf.get("history_limit")]),
+    }
+
+
+def breakdown(rows):
+    """Per-turn latency by history length and by crisis check."""
+    by_history = {}
+    for row in sorted(rows, key=lambda r: r.history_sent):
+        by_history.setdefault(_history_bucket(row.history_sent), []).append(row)
+    return {
+        "by_history": {bucket: _group(group) for bucket, group in by_history.items()},
+        "by_crisis_check": {label: _group([r for r in rows if r.check_crisis == checked]) for label, checked in (("checked", True), ("unchecked", False))},
+    }
+
+
+# ── Command Line ────────────────────────────────────────────────────────────
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(prog="python -m bench.replay", description="Replay exported session logs or a JSONL capture as concurrent multi-turn conversations against /api/ask.")
+    parser.add_argument("sources", nargs="+", help='session logs ("You:" / "Spirit:" lines, plain or Markdown) or .jsonl captures')
+    parser.add_argument("--labels", nargs=2, action="append", default=[], metavar=("YOU", "SPIRIT"), help="extra speaker labels for session logs, on top of the board's languages; repeatable")
+    parser.add_argument("--url", help="a running server, e.g. https://localhost:7777; default: an in-process app")
+    parser.add_argument("--user", default=os.environ.get("PLANCHETTE_USER"), help="login for --url (default $PLANCHETTE_USER)")
+    parser.add_argument("--password", default=os.environ.get("PLANCHETTE_PASSWORD"), help="password for --url (default $PLANCHETTE_PASSWORD, else prompted)")
+    parser.add_argument("--insecure", action="store_true", help="skip TLS certificate checks, for the self-signed certificate")
+    parser.add_argument("--concurrency", type=int, default=4, help="conversations in flight at once (default 4)")
+    parser.add_argument("--duration", type=float, default=0, help="keep replaying for this many seconds; default: every session once")
+    parser.add_argument("--think", type=float, nargs=2, default=(4.0, 15.0), metavar=("MIN", "MAX"), help="seconds between a user's turns when the source has no timestamps (default 4 15)")
+    parser.add_argument("--think-scale", type=float, default=1.0, help="multiplies every think time, 0 for back to back (default 1)")
+    parser.add_argument("--crisis-rate", type=float, default=0.1, help="chance a turn asks for a crisis check when the source does not say; once the spirit flags a crisis, the rest of that conversation checks (default 0.1)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", default="auto", help="in-process only: stub, a GGUF path, or auto (default auto)")
+    parser.add_argument("--front", choices=("flask", "asgi"), default="asgi", help="in-process only (default asgi)")
+    parser.add_argument("--engine", choices=("pool", "batch"), default="pool", help="in-process only (default pool)")
+    parser.add_argument("--pool-size", default=None, help="in-process only: [inference] pool_size, default: the concurrency")
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+
+def _driver(args):
+    if args.url:
+        if not args.user:
+            sys.exit("--url needs --user (or $PLANCHETTE_USER)")
+        password = args.password if args.password is not None else getpass.getpass(f"Password for {args.user}: ")
+        driver = HttpDriver(args.url, args.user, password, verify=not args.insecure)
+        try:
+            driver.session()
+        except (RuntimeError, OSError) as e:
+            sys.exit(str(e))
+        return driver, args.url, None
+
+    model = resolve_model(args.model)
+    if model == "stub" and args.engine == "batch":
+        sys.exit("The stub model only covers the pool engine; run --engine batch against a GGUF.")
+    if model != "stub" and not os.path.isfile(model):
+        sys.exit(f"No model at {model}")
+    options = {"engine": args.engine, "pool_size": args.pool_size or args.concurrency, "batch_size": args.concurrency, "spawn_server": "false"}
+    app = build_app(model, options)
+    target = "stub" if model == "stub" else os.path.basename(model)
+    return (AsgiDriver(app) if args.front == "asgi" else FlaskDriver(app)), target, options
+
+
+def main():
+    args = _parse_args()
+    try:
+        sessions = load_sessions(args.sources, speaker_labels(args.labels))
+    except (OSError, ValueError) as e:
+        sys.exit(str(e))
+
+    driver, target, options = _driver(args)
+    try:
+        rows, wall_s = replay(driver, sessions, args)
+    finally:
+        driver.close()
+
+    report = {
+        "version": version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "target": target,
+        "sessions": len(sessions),
+        "turns": sum(len(s.turns) for s in sessions),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "password")},
+        "inference": options,
+        "results": summarize([r.result for r in rows], wall_s),
+        **breakdown(rows),
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+        print(f"[Replay] {report['results']['ok']}/{len(rows)} turns ok over {report['results']['wall_s']} s, wrote {args.out}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
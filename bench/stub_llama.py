@@ -0,0 +1,191 @@
+"""Deterministic stand-in for llama_cpp: prompt_ms per evaluated token and decode_ms per decoded one, as sleeps."""
+
+import re
+import sys
+import time
+import types
+import zlib
+import contextlib
+
+import numpy as np
+
+_N_VOCAB = 32000
+_BOS = 1
+_EOS = 2
+_PIECE = re.compile(r"<\|[a-z_]+\|>|\s?[^\s<]{1,4}|\s|<")
+_ANSWERS = ("YES. THE VEIL IS THIN.", "NO.", "MAYBE.", "M... A... R... I... A...", "SOON.", "NO. BEWARE THE NORTH.", "YES.", "GOODBYE.")
+_CRISIS_ANSWER = "NO. YOU MATTER."
+_CRISIS_WORDS = ("die", "suicide", "kill myself", "hurt myself", "end it all")
+
+
+class StubCosts:
+    prompt_ms = 0.4  # per prompt token evaluated
+    decode_ms = 25.0  # per generated token
+    load_ms = 0.0  # per Llama() construction
+    kv_bytes = 114688  # per token of saved state, about what the 1.7B model's KV cache takes
+
+
+_pieces = {}  # token id -> text
+
+
+def _token(piece):
+    tid = 3 + zlib.crc32(piece.encode()) % (_N_VOCAB - 3)
+    _pieces.setdefault(tid, piece)
+    return tid
+
+
+def _is_crisis(text):
+    lowered = text.lower()
+    return any(word in lowered for word in _CRISIS_WORDS)
+
+
+class _LlamaContext:
+    def __init__(self, model=None, params=None, verbose=False):
+        self.ctx = object()
+
+    def close(self):
+        self.ctx = None
+
+
+class _State:
+    def __init__(self, input_ids, n_tokens):
+        self.input_ids = input_ids
+        self.scores = np.zeros((1, 16), dtype=np.single)
+        self.n_tokens = n_tokens
+        self.llama_state_size = n_tokens * StubCosts.kv_bytes
+
+
+class LlamaGrammar:
+    @classmethod
+    def from_string(cls, grammar, verbose=True):
+        return cls()
+
+
+class LogitsProcessorList(list):
+    pass
+
+
+class Llama:
+    def __init__(self, model_path=None, n_ctx=2048, n_threads=None, verbose=False, **_):
+        time.sleep(StubCosts.load_ms / 1000)
+        self.model_path = model_path
+        self.verbose = verbose
+        self.n_batch = 512
+        self.metadata = {}
+        self.context_params = types.SimpleNamespace(n_ctx=n_ctx, n_seq_max=1, kv_unified=False)
+        self._model = object()
+        self._stack = contextlib.ExitStack()
+        self._ctx = self._stack.enter_context(contextlib.closing(_LlamaContext()))
+        self._input_ids = []
+        self.n_tokens = 0
+
+    def close(self):
+        self._stack.close()
+
+    # ── Vocabulary ──
+
+    def tokenize(self, text, add_bos=True, special=False):
+        ids = [_token(piece) for piece in _PIECE.findall(text.decode("utf-8", errors="ignore"))]
+        return [_BOS] + ids if add_bos else ids
+
+    def detokenize(self, tokens, prev_tokens=None, special=False):
+        return "".join(_pieces.get(t, "") for t in tokens).encode()
+
+    def token_eos(self):
+        return _EOS
+
+    def token_bos(self):
+        return _BOS
+
+    def n_vocab(self):
+        return _N_VOCAB
+
+    # ── State ──
+
+    def reset(self):
+        self.n_tokens = 0
+
+    def save_state(self):
+        return _State(np.array(self._input_ids[: self.n_tokens], dtype=np.intc), self.n_tokens)
+
+    def load_state(self, state):
+        self._input_ids = list(state.input_ids)
+        self.n_tokens = state.n_tokens
+
+    def _eval_prompt(self, tokens):
+        assert self._ctx.ctx is not None, "context freed"
+        keep = 0
+        for a, b in zip(self._input_ids[: self.n_tokens], tokens[:-1]):
+            if a != b:
+                break
+            keep += 1
+        time.sleep((len(tokens) - keep) * StubCosts.prompt_ms / 1000)
+        self._input_ids = list(tokens)
+        self.n_tokens = len(tokens)
+
+    def eval(self, tokens):
+        assert self._ctx.ctx is not None, "context freed"
+        time.sleep(len(tokens) * (StubCosts.decode_ms if len(tokens) == 1 else StubCosts.prompt_ms) / 1000)
+        self._input_ids = self._input_ids[: self.n_tokens] + list(tokens)
+        self.n_tokens = len(self._input_ids)
+
+    # ── Completion ──
+
+    def create_chat_completion(self, messages, max_tokens=16, stream=False, logits_processor=None, **_):
+        prompt = "".join(f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages) + "<|im_start|>assistant\n"
+        tokens = self.tokenize(prompt.encode(), add_bos=True, special=True)
+        self._eval_prompt(tokens)
+
+        system, question = messages[0]["content"], messages[-1]["content"]
+        if "classifier" in system:
+            crisis = _is_crisis(question.rsplit("New message:", 1)[-1])
+            if logits_processor:
+                logits = np.zeros(_N_VOCAB, dtype=np.single)
+                for word in ("CRISIS",) if crisis else ("SAFE",):
+                    for variant in (word, word.capitalize(), word.lower()):
+                        for text in (variant, " " + variant):
+                            logits[self.tokenize(text.encode(), add_bos=False)[0]] = 8.0
+                for processor in logits_processor:
+                    logits = processor(np.array(tokens, dtype=np.intc), logits)
+            answer = "CRISIS" if crisis else "SAFE"
+        elif "caring" in system:
+            answer = _CRISIS_ANSWER
+        else:
+            answer = _ANSWERS[zlib.crc32(question.encode()) % len(_ANSWERS)]
+
+        pieces = _PIECE.findall(answer)[:max_tokens]
+        chunks = self._decode(tokens, pieces, logits_processor)
+        if stream:
+            return chunks
+        return {"choices": [{"message": {"role": "assistant", "content": "".join(c["choices"][0]["delta"].get("content", "") for c in chunks)}}]}
+
+    def _decode(self, prompt, pieces, logits_processor):
+        def _stream():
+            yield {"choices": [{"delta": {"role": "assistant"}}]}
+            generated = []
+            for piece in pieces:
+                if logits_processor:
+                    logits = np.zeros(_N_VOCAB, dtype=np.single)
+                    for processor in logits_processor:
+                        logits = processor(np.array(prompt + generated, dtype=np.intc), logits)
+                time.sleep(StubCosts.decode_ms / 1000)
+                generated.append(_token(piece))
+                self._input_ids = prompt + generated[:-1]
+                self.n_tokens = len(self._input_ids)
+                yield {"choices": [{"delta": {"content": piece}}]}
+
+        return _stream()
+
+
+def install():
+    """Register this module as llama_cpp for everything imported afterwards."""
+    module = types.ModuleType("llama_cpp")
+    module.__version__ = "0.3.16"  # the requirements.txt pin
+    module.Llama = Llama
+    module.LlamaGrammar = LlamaGrammar
+    module.LogitsProcessorList = LogitsProcessorList
+    internals = types.ModuleType("llama_cpp._internals")
+    internals.LlamaContext = _LlamaContext
+    module._internals = internals
+    sys.modules["llama_cpp"] = module
+    sys.modules["llama_cpp._internals"] = internals
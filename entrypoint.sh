@@ -1,8 +1,8 @@
 #!/bin/sh
 set -e
 
-echo "Cleaning /app except planchette.ini, ./ssl, and ./__planchette_model__..."
-find /app -mindepth 1 ! -name 'planchette.ini' ! -path '/app/ssl' ! -path '/app/ssl/*' ! -path '/app/__planchette_model__' ! -path '/app/__planchette_model__/*' -exec rm -rf {} +
+echo "Cleaning /app except planchette.ini, planchette-users.db, ./ssl, and ./__planchette_model__..."
+find /app -mindepth 1 ! -name 'planchette.ini' ! -name 'planchette-users.db*' ! -path '/app/ssl' ! -path '/app/ssl/*' ! -path '/app/__planchette_model__' ! -path '/app/__planchette_model__/*' -exec rm -rf {} +
 
 echo "Copying fresh contents from /app_defaults..."
 cp -r /app_defaults/* /app/
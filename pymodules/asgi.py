@@ -0,0 +1,174 @@
+import io
+import sys
+import asyncio
+import threading
+from contextlib import aclosing
+
+from asgiref.wsgi import WsgiToAsgi
+
+from pymodules.pipeline import Coalescer, FrameEncoder
+
+STREAM_ENVIRON_KEY = "planchette.stream"
+_STREAM_PATHS = {"/api/ask"}
+
+
+# ── Event Pump ──────────────────────────────────────────────────────────────
+# The local pipeline decodes on a blocking thread; it hands each event to the loop instead of holding a
+# worker thread on the socket. Streams that are already async (the inference daemon client) skip the pump.
+
+
+async def astream(events):
+    if hasattr(events, "__aiter__"):
+        async with aclosing(aiter(events)) as native:
+            async for event in native:
+                yield event
+        return
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def _put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            stop.set()  # loop is gone
+
+    def _run():
+        try:
+            for event in events:
+                _put(event)
+                if stop.is_set():
+                    break
+        except Exception as e:
+            _put({"error": str(e)})
+        finally:
+            events.close()
+            _put(None)
+
+    threading.Thread(target=_run, daemon=True).start()
+    try:
+        while (event := await queue.get()) is not None:
+            yield event
+    finally:
+        stop.set()
+
+
+# ── ASGI Front End ──────────────────────────────────────────────────────────
+
+
+def _environ(scope, body):
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("ascii"),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "SERVER_NAME": scope["server"][0] if scope.get("server") else "localhost",
+        "SERVER_PORT": str(scope["server"][1]) if scope.get("server") else "80",
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1")
+        key = "CONTENT_LENGTH" if name == "content-length" else "CONTENT_TYPE" if name == "content-type" else "HTTP_" + name.upper().replace("-", "_")
+        value = value.decode("latin1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class AsyncStreamingApp:
+    """ASGI app that streams SSE on the event loop and hands everything else to Flask."""
+
+    def __init__(self, app):
+        self.flask = app
+        self.wsgi = WsgiToAsgi(app)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in _STREAM_PATHS:
+            return await self.wsgi(scope, receive, send)
+
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        holder = {}
+        status, headers, payload = await asyncio.to_thread(self._dispatch, scope, bytes(body), holder)
+        events = holder.get("events")
+        if events is None:
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+            await send({"type": "http.response.body", "body": payload})
+            return
+
+        headers = [(k, v) for k, v in headers if k != b"content-length"]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        legacy = holder.get("legacy", False)
+        streaming = asyncio.ensure_future(self._stream(events, send, FrameEncoder(holder.get("gzip", False), legacy), legacy))
+        disconnect = asyncio.ensure_future(self._disconnected(receive))
+        await asyncio.wait({streaming, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        finished = streaming.done()
+        for task in (streaming, disconnect):
+            task.cancel()
+        await asyncio.gather(streaming, disconnect, return_exceptions=True)
+        if finished:
+            await send({"type": "http.response.body", "body": b""})
+
+    def _dispatch(self, scope, body, holder):
+        environ = _environ(scope, body)
+        environ[STREAM_ENVIRON_KEY] = holder
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in headers]
+
+        result = self.flask(environ, start_response)
+        try:
+            payload = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return started["status"], started["headers"], payload
+
+    async def _stream(self, events, send, encoder, legacy=False):
+        coalescer = Coalescer(self.flask.config["SSE_FLUSH_MS"], 1 if legacy else self.flask.config["SSE_FLUSH_TOKENS"])
+        async with aclosing(astream(events)) as stream:
+            pending = None
+            try:
+                while True:
+                    pending = pending or asyncio.ensure_future(anext(stream, None))
+                    done, _ = await asyncio.wait({pending}, timeout=coalescer.timeout())
+                    if not done:
+                        frames = coalescer.flush()  # buffered tokens are due, nothing new arrived
+                    elif (event := pending.result()) is None:
+                        break
+                    else:
+                        pending = None
+                        frames = coalescer.push(event)
+                    if frames:
+                        await send({"type": "http.response.body", "body": encoder.encode(frames), "more_body": True})
+            finally:
+                if pending is not None and not pending.done():
+                    pending.cancel()
+                    await asyncio.gather(pending, return_exceptions=True)
+        await send({"type": "http.response.body", "body": encoder.encode(coalescer.flush()) + encoder.close(), "more_body": True})
+
+    @staticmethod
+    async def _disconnected(receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+
+def create_asgi_app(app):
+    return AsyncStreamingApp(app)
@@ -1,59 +1,284 @@
+import math
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import bcrypt
 
 from flask_login import LoginManager, UserMixin
 
-_users: dict[str, "User"] = {}
+from pymodules import metrics
+from pymodules.config import has_credentials
+from pymodules.user_store import UserStore, default_path
+
+_store = UserStore(":memory:")  # replaced by configure() with the file next to planchette.ini
+_users: dict[str, tuple["User", float]] = {}  # username -> (User, monotonic time read), filled as accounts are seen
+_users_lock = threading.Lock()
+_USER_TTL = 30  # seconds before a cached account is read again, so `--user` edits reach a running server
+
+_HASH_WORKERS = 1  # threads running bcrypt, so a login burst cannot take the cores inference runs on
+_HASH_QUEUE = 8  # password hashes running or waiting before further attempts are turned away
+_LOGIN_BURST = 5  # attempts a client address, and separately a username, may make back to back
+_LOGIN_PER_MINUTE = 5.0  # rate those allowances refill at
+_BUCKETS_MAX = 4096  # addresses and usernames tracked, least recently seen forgotten first
 
 login_manager = LoginManager()
 login_manager.login_view = "auth_bp.login"
 
 
 class User(UserMixin):
-    def __init__(self, uid: str, username: str, pw_hash: bytes):
+    def __init__(self, uid: str, username: str, pw_hash: bytes, requests_per_minute: int | None = None, tokens_per_minute: int | None = None):
         self.id = uid
         self.username = username
         self.pw_hash = pw_hash
+        self.requests_per_minute = requests_per_minute  # None: the [inference] default
+        self.tokens_per_minute = tokens_per_minute
 
 
 @login_manager.user_loader
 def load_user(uid: str) -> User | None:
-    return _users.get(uid)
+    return get_user_by_username(uid)
 
 
-def register_user(username: str, password: str) -> User:
-    pw_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
-    user = User(uid=username, username=username, pw_hash=pw_hash)
-    _users[user.id] = user
-    return user
+class ThrottledError(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__("Too many attempts, try again shortly")
+        self.reason = reason
+        self.retry_after = retry_after
 
 
-def load_user_from_hash(username: str, pw_hash: str) -> User:
-    user = User(uid=username, username=username, pw_hash=pw_hash.encode())
-    _users[user.id] = user
-    return user
+class _Hasher:
+    """bcrypt on a small fixed pool, turning callers away past the queue bound."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self.pending = 0
+
+    def run(self, op: str, fn, *args):
+        with self._lock:
+            if self.pending >= _HASH_QUEUE:
+                metrics.auth_rejections.inc(reason="busy")
+                raise ThrottledError("busy", 1)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=_HASH_WORKERS, thread_name_prefix="bcrypt")
+            self.pending += 1
+            executor = self._executor
+
+        def _timed():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                metrics.password_hash_seconds.observe(time.perf_counter() - started, op=op)
+
+        try:
+            return executor.submit(_timed).result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def reset(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+class AttemptLimiter:
+    """Login token buckets per client address and per username."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {"ip": OrderedDict(), "user": OrderedDict()}  # scope -> key -> (tokens, monotonic time)
+
+    def acquire(self, ip: str, username: str) -> None:
+        now = time.monotonic()
+        keys = (("ip", ip or ""), ("user", username.lower()))
+        with self._lock:
+            levels = {scope: self._level(self._buckets[scope].get(key), now) for scope, key in keys}
+            for scope, level in levels.items():
+                if level < 1:
+                    metrics.auth_rejections.inc(reason=scope)
+                    raise ThrottledError(scope, math.ceil((1 - level) * 60 / _LOGIN_PER_MINUTE))
+            for scope, key in keys:
+                buckets = self._buckets[scope]
+                buckets[key] = (levels[scope] - 1, now)
+                buckets.move_to_end(key)
+                while buckets and (len(buckets) > _BUCKETS_MAX or self._level(next(iter(buckets.values())), now) >= _LOGIN_BURST):
+                    buckets.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            for buckets in self._buckets.values():
+                buckets.clear()
+
+    @staticmethod
+    def _level(bucket, now):
+        if bucket is None:
+            return _LOGIN_BURST
+        tokens, last = bucket
+        return min(_LOGIN_BURST, tokens + (now - last) * _LOGIN_PER_MINUTE / 60)
+
+
+_hasher = _Hasher()
+limiter = AttemptLimiter()
+metrics.hash_queue.function = lambda: {(): _hasher.pending}
+
+
+def register_user(username: str, password: str) -> User | None:
+    """None when the username is taken."""
+    pw_hash = _hasher.run("hash", bcrypt.hashpw, password.encode(), bcrypt.gensalt())
+    if not _store.add(username, pw_hash):
+        return None
+    return get_user_by_username(username)
+
+
+def load_user_from_hash(username: str, pw_hash: str) -> User | None:
+    """Adds an account whose bcrypt hash is already known."""
+    if not _store.add(username, pw_hash.encode()):
+        return None
+    return get_user_by_username(username)
+
+
+def import_legacy_account(cfg) -> None:
+    """Moves the pre-user-store [auth] account into the store, once."""
+    if has_credentials(cfg) and _store.get_meta("legacy_imported") is None:
+        load_user_from_hash(cfg.get("auth", "user"), cfg.get("auth", "pw_hash"))
+        _store.set_meta("legacy_imported", cfg.get("auth", "user"))
 
 
 def verify_password(user: User, password: str) -> bool:
-    return bcrypt.checkpw(password.encode(), user.pw_hash)
+    ok = _hasher.run("verify", bcrypt.checkpw, password.encode(), user.pw_hash)
+    metrics.password_checks.inc(result="ok" if ok else "fail")
+    return ok
 
 
 def get_user_by_username(username: str) -> User | None:
-    return _users.get(username)
+    now = time.monotonic()
+    with _users_lock:
+        cached = _users.get(username)
+    if cached is not None and now - cached[1] < _USER_TTL:
+        return cached[0]
+    row = _store.get(username)
+    with _users_lock:
+        if row is None:
+            _users.pop(username, None)
+            return None
+        user = User(uid=row["username"], username=row["username"], pw_hash=bytes(row["pw_hash"]), requests_per_minute=row["requests_per_minute"], tokens_per_minute=row["tokens_per_minute"])
+        _users[username] = (user, now)
+        return user
 
 
 def change_password(user: User, new_password: str) -> None:
-    user.pw_hash = bcrypt.hashpw(new_password.encode(), bcrypt.gensalt())
+    pw_hash = _hasher.run("hash", bcrypt.hashpw, new_password.encode(), bcrypt.gensalt())
+    _store.set_hash(user.username, pw_hash)
+    user.pw_hash = pw_hash
 
 
 def change_username(old_username: str, new_username: str) -> User | None:
-    user = _users.pop(old_username, None)
-    if user is None:
+    """None when there is no such user or the new name is taken."""
+    user = get_user_by_username(old_username)
+    if user is None or not _store.rename(old_username, new_username):
         return None
-    user.username = new_username
-    user.id = new_username
-    _users[new_username] = user
+    with _users_lock:
+        _users.pop(old_username, None)
+        user.username = new_username
+        user.id = new_username
+        _users[new_username] = (user, time.monotonic())
     return user
 
 
+def remove_user(username: str) -> bool:
+    with _users_lock:
+        _users.pop(username, None)
+    return _store.remove(username)
+
+
+def set_quota(username: str, requests_per_minute: int | None, tokens_per_minute: int | None) -> bool:
+    if not _store.set_quota(username, requests_per_minute, tokens_per_minute):
+        return False
+    with _users_lock:
+        _users.pop(username, None)
+    return True
+
+
+def list_users() -> list[User]:
+    return [user for user in map(get_user_by_username, _store.usernames()) if user is not None]
+
+
 def has_users() -> bool:
-    return len(_users) > 0
+    return _store.count() > 0
+
+
+def configure(cfg, config_path: str) -> None:
+    global _HASH_WORKERS, _HASH_QUEUE, _LOGIN_BURST, _LOGIN_PER_MINUTE, _store
+    _HASH_WORKERS = max(1, cfg.getint("security", "hash_workers", fallback=_HASH_WORKERS))
+    _HASH_QUEUE = max(1, cfg.getint("security", "hash_queue", fallback=_HASH_QUEUE))
+    _LOGIN_BURST = max(1, cfg.getint("security", "login_burst", fallback=_LOGIN_BURST))
+    _LOGIN_PER_MINUTE = max(0.01, cfg.getfloat("security", "login_per_minute", fallback=_LOGIN_PER_MINUTE))
+    _hasher.reset()
+    limiter.clear()
+
+    path = cfg.get("security", "user_db", fallback="").strip() or default_path(config_path)
+    if path != _store.path:
+        old, _store = _store, UserStore(path)
+        old.close()
+        with _users_lock:
+            _users.clear()
+
+
+def manage_users(cfg, config_path: str, args: list[str]) -> int:
+    """`python . --user ...`: list, add and remove accounts, and set per-user quotas."""
+    import argparse
+    import getpass
+
+    parser = argparse.ArgumentParser(prog="python . --user", description="Manage Planchette accounts.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="accounts and their quotas")
+    commands.add_parser("add", help="create an account, prompting for its password").add_argument("username")
+    commands.add_parser("remove", help="delete an account").add_argument("username")
+    quota = commands.add_parser("quota", help='set requests and answer tokens per minute, "default" for the [inference] default, 0 for unmetered')
+    quota.add_argument("username")
+    quota.add_argument("requests_per_minute")
+    quota.add_argument("tokens_per_minute")
+    opts = parser.parse_args(args)
+
+    configure(cfg, config_path)
+    import_legacy_account(cfg)
+
+    if opts.command == "list":
+        for user in list_users():
+            rpm = "default" if user.requests_per_minute is None else user.requests_per_minute
+            tpm = "default" if user.tokens_per_minute is None else user.tokens_per_minute
+            print(f"{user.username}\trequests/min: {rpm}\ttokens/min: {tpm}")
+        return 0
+
+    if opts.command == "add":
+        password = getpass.getpass(f"Password for {opts.username}: ")
+        if not password or password != getpass.getpass("Repeat password: "):
+            print("[Planchette] Passwords are empty or do not match.")
+            return 1
+        if register_user(opts.username, password) is None:
+            print(f"[Planchette] {opts.username} already exists.")
+            return 1
+        print(f"[Planchette] Added {opts.username}.")
+        return 0
+
+    if opts.command == "remove":
+        if not remove_user(opts.username):
+            print(f"[Planchette] No user {opts.username}.")
+            return 1
+        print(f"[Planchette] Removed {opts.username}.")
+        return 0
+
+    try:
+        limits = [None if value == "default" else max(0, int(value)) for value in (opts.requests_per_minute, opts.tokens_per_minute)]
+    except ValueError:
+        parser.error('quotas are whole numbers or "default"')
+    if not set_quota(opts.username, *limits):
+        print(f"[Planchette] No user {opts.username}.")
+        return 1
+    print(f"[Planchette] Set quota for {opts.username}.")
+    return 0
@@ -0,0 +1,323 @@
+import time
+import queue
+import random
+import threading
+from collections import deque
+
+import numpy as np
+
+_PREFIX_HOLDERS = 3  # spirit, crisis and classifier system prompts
+_PREFIX_CTX = 512  # KV cells reserved per shared prefix on top of n_ctx per sequence
+
+
+class _Sequence:
+    """One request inside the batch, with its own sampler and output queue."""
+
+    def __init__(self, tokens, prefix, max_tokens, sampling, stop, logits_processor):
+        self.tokens = tokens
+        self.prefix = prefix  # (system prompt, token prefix) shareable through a holder sequence, or None
+        self.max_tokens = max_tokens
+        self.sampling = sampling
+        self.stop = stop
+        self.logits_processor = logits_processor
+        self.out = queue.Queue()
+        self.cancelled = False
+        self.seq_id = None
+        self.sampler = None
+        self.n_past = 0
+        self.pending = []
+        self.generated = []
+        self.raw = b""
+        self.text = ""
+        self.emitted = 0
+
+    def pieces(self):
+        try:
+            while (item := self.out.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.cancelled = True
+
+
+class BatchEngine:
+    """Continuous batching of up to `n_seq` sequences over one llama context."""
+
+    def __init__(self, factory, restore, n_seq, n_ctx):
+        self._factory = factory
+        self._restore = restore
+        self.n_seq = n_seq
+        self.n_ctx = n_ctx
+        self.llm = None
+        self._cond = threading.Condition(threading.RLock())
+        self._queue = deque()
+        self._active = []
+        self._free = []
+        self._holders = {}  # system prompt -> (seq_id, prefix tokens)
+        self._prefix_cache = {}  # system prompt -> prefix tokens
+        self._formatter = None
+        self._batch = None
+        self._thread = None
+        self.last_used = time.time()
+
+    # ── Lifecycle ──
+
+    def start(self):
+        with self._cond:
+            if self.llm is not None:
+                if self._restore(self.llm):
+                    return self.llm
+                self.llm.close()  # the context cannot be rebuilt in place, load a new instance
+                self.llm = None
+            llm = self._factory(self.n_seq + _PREFIX_HOLDERS, self.n_ctx * self.n_seq + _PREFIX_CTX * _PREFIX_HOLDERS)
+            self._setup(llm)
+            self.llm = llm
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            return llm
+
+    def _setup(self, llm):
+        from llama_cpp import llama_chat_format, _internals
+
+        eos = llm.token_eos()
+        bos = llm.token_bos()
+        self._formatter = llama_chat_format.Jinja2ChatFormatter(
+            template=llm.metadata["tokenizer.chat_template"],
+            eos_token=llm._model.token_get_text(eos) if eos != -1 else "",
+            bos_token=llm._model.token_get_text(bos) if bos != -1 else "",
+            stop_token_ids=[eos],
+        )
+        self._batch = _internals.LlamaBatch(n_tokens=llm.n_batch, embd=0, n_seq_max=1, verbose=False)
+        self._free = list(range(self.n_seq))
+        self._holders = {}
+        self._prefix_cache = {}
+
+    def busy(self):
+        with self._cond:
+            return bool(self._active or self._queue)
+
+    def free_context(self):
+        """Release the context while idle; start() brings it back."""
+        with self._cond:
+            if self.llm is None or self._active or self._queue or self.llm._ctx.ctx is None:
+                return False
+            self.llm._ctx.close()
+            self._holders = {}
+            return True
+
+    def unload(self):
+        with self._cond:
+            if self.llm is None or self._active or self._queue:
+                return False
+            self.llm = None
+            self._batch = None
+            self._holders = {}
+            return True
+
+    def stats(self):
+        with self._cond:
+            return {"batch_active": len(self._active), "batch_waiting": len(self._queue), "batch_size": self.n_seq, "shared_prefixes": len(self._holders)}
+
+    # ── Requests ──
+
+    def render(self, messages):
+        result = self._formatter(messages=messages)
+        tokens = self.llm.tokenize(result.prompt.encode(), add_bos=not result.added_special, special=True)
+        stop = result.stop if isinstance(result.stop, list) else [result.stop] if result.stop else []
+        return tokens, stop
+
+    def _prefix(self, system):
+        """Tokens of the prompt up to the user turn."""
+        prefix = self._prefix_cache.get(system)
+        if prefix is None:
+            a = self.render([{"role": "system", "content": system}, {"role": "user", "content": "A"}])[0]
+            b = self.render([{"role": "system", "content": system}, {"role": "user", "content": "B"}])[0]
+            n = 0
+            while n < min(len(a), len(b)) and a[n] == b[n]:
+                n += 1
+            prefix = self._prefix_cache[system] = a[:n]
+        return prefix
+
+    def submit(self, messages, max_tokens, temperature, top_p, repeat_penalty, frequency_penalty, stop=None, logits_processor=None, grammar=None):
+        self.start()
+        tokens, template_stop = self.render(messages)
+        prefix = None
+        if messages and messages[0]["role"] == "system":
+            shared = self._prefix(messages[0]["content"])
+            if shared and tokens[: len(shared)] == shared and len(shared) < len(tokens):
+                prefix = (messages[0]["content"], shared)
+        sampling = {"temp": temperature, "top_p": top_p, "repeat_penalty": repeat_penalty, "frequency_penalty": frequency_penalty, "grammar": grammar}
+        stops = [s for s in (stop or []) + template_stop if s]
+        seq = _Sequence(tokens, prefix, max_tokens, sampling, stops, logits_processor)
+        with self._cond:
+            self.start()  # again under the lock: the idle watcher may have freed the context meanwhile
+            self._queue.append(seq)
+            self._cond.notify_all()
+        return seq
+
+    # ── Engine Loop ──
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self.llm is None or not (self._active or self._queue):
+                    self._cond.wait()
+                llm = self.llm
+                while self._queue and self._free:
+                    seq = self._queue.popleft()
+                    seq.seq_id = self._free.pop()
+                    self._active.append(seq)
+                active = list(self._active)
+            self.last_used = time.time()
+            try:
+                self._step(llm, active)
+            except Exception as e:
+                for seq in active:
+                    self._finish(llm, seq, e)
+
+    def _admit(self, llm, seq):
+        llm._seed = random.randint(0, 2**31)
+        seq.sampler = llm._init_sampler(**seq.sampling)
+        seq.pending = list(seq.tokens)
+        if seq.prefix is not None:
+            holder = self._holder(llm, *seq.prefix)
+            if holder is not None:
+                llm._ctx.kv_cache_seq_cp(holder, seq.seq_id, -1, -1)
+                seq.n_past = len(seq.prefix[1])
+                seq.pending = seq.pending[seq.n_past :]
+
+    def _holder(self, llm, system, prefix):
+        if system in self._holders:
+            return self._holders[system][0]
+        if len(self._holders) >= _PREFIX_HOLDERS or len(prefix) > _PREFIX_CTX:
+            return None
+        holder = self.n_seq + len(self._holders)
+        for start in range(0, len(prefix), llm.n_batch):
+            self._batch.reset()
+            for i, token in enumerate(prefix[start : start + llm.n_batch]):
+                self._add(token, start + i, holder, False)
+            llm._ctx.decode(self._batch)
+        self._holders[system] = (holder, prefix)
+        return holder
+
+    def _step(self, llm, active):
+        for seq in active:
+            if seq.cancelled:
+                self._finish(llm, seq)
+            elif seq.sampler is None:
+                self._admit(llm, seq)
+        active = [seq for seq in active if not seq.cancelled]
+
+        self._batch.reset()
+        room = llm.n_batch
+        rows = []
+        for seq in active:
+            if seq.seq_id is None or not seq.pending or not room:
+                continue
+            chunk = seq.pending[:room]
+            seq.pending = seq.pending[len(chunk) :]
+            for i, token in enumerate(chunk):
+                self._add(token, seq.n_past + i, seq.seq_id, not seq.pending and i == len(chunk) - 1)
+            seq.n_past += len(chunk)
+            room -= len(chunk)
+            if not seq.pending:
+                rows.append((seq, self._batch.n_tokens() - 1))
+        if not self._batch.n_tokens():
+            return
+        llm._ctx.decode(self._batch)
+
+        for seq, row in rows:
+            self._sample(llm, seq, row)
+
+    def _add(self, token, pos, seq_id, logits):
+        b = self._batch.batch
+        j = b.n_tokens
+        b.token[j] = token
+        b.pos[j] = pos
+        b.seq_id[j][0] = seq_id
+        b.n_seq_id[j] = 1
+        b.logits[j] = logits
+        b.n_tokens = j + 1
+
+    def _sample(self, llm, seq, row):
+        from llama_cpp import llama_vocab_is_eog
+
+        if seq.logits_processor:
+            logits = np.ctypeslib.as_array(llm._ctx.get_logits_ith(row), shape=(llm.n_vocab(),))
+            input_ids = np.array(seq.tokens + seq.generated, dtype=np.intc)
+            for processor in seq.logits_processor:
+                logits[:] = processor(input_ids, logits)
+        token = seq.sampler.sample(llm._ctx, row)
+        if llama_vocab_is_eog(llm._model.vocab, token):
+            self._finish(llm, seq)
+            return
+
+        seq.raw += llm.detokenize([token], prev_tokens=seq.tokens + seq.generated)
+        seq.generated.append(token)
+        try:
+            seq.text += seq.raw.decode("utf-8")
+            seq.raw = b""
+        except UnicodeDecodeError:
+            pass  # hold back an incomplete multi-byte character
+
+        hit = min((seq.text.find(s) for s in seq.stop if s in seq.text), default=-1)
+        if hit >= 0:
+            seq.text = seq.text[:hit]
+        self._emit(seq, final=hit >= 0)
+        if hit >= 0 or len(seq.generated) >= seq.max_tokens:
+            self._finish(llm, seq)
+        else:
+            seq.pending = [token]
+
+    @staticmethod
+    def _emit(seq, final):
+        end = len(seq.text)
+        if not final:
+            # Keep back anything that could still grow into a stop string
+            for s in seq.stop:
+                for k in range(min(len(s) - 1, end), 0, -1):
+                    if seq.text.endswith(s[:k]):
+                        end = min(end, len(seq.text) - k)
+                        break
+        if end > seq.emitted:
+            seq.out.put(seq.text[seq.emitted : end])
+            seq.emitted = end
+
+    def _finish(self, llm, seq, error=None):
+        with self._cond:
+            if seq not in self._active:
+                return
+            self._active.remove(seq)
+            if seq.seq_id is not None:
+                llm._ctx.kv_cache_seq_rm(seq.seq_id, -1, -1)
+                self._free.append(seq.seq_id)
+        if error is None:
+            self._emit(seq, final=True)
+        seq.out.put(error)
+        seq.sampler = None
+
+
+class EngineSession:
+    """The slice of the Llama API the pipeline uses, served by a BatchEngine."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.llm = engine.start()
+
+    def tokenize(self, text, add_bos=True, special=False):
+        return self.llm.tokenize(text, add_bos=add_bos, special=special)
+
+    def detokenize(self, tokens, prev_tokens=None, special=False):
+        return self.llm.detokenize(tokens, prev_tokens=prev_tokens, special=special)
+
+    def token_eos(self):
+        return self.llm.token_eos()
+
+    def create_chat_completion(self, messages, max_tokens=16, temperature=0.8, top_p=0.95, repeat_penalty=1.0, frequency_penalty=0.0, stop=None, stream=False, logits_processor=None, grammar=None, **_):
+        seq = self.engine.submit(messages, max_tokens, temperature, top_p, repeat_penalty, frequency_penalty, stop if isinstance(stop, list) else [stop] if stop else None, logits_processor, grammar)
+        if stream:
+            return ({"choices": [{"delta": {"content": piece}}]} for piece in seq.pieces())
+        return {"choices": [{"message": {"content": "".join(seq.pieces())}}]}
@@ -0,0 +1,110 @@
+import os
+import time
+import hashlib
+import logging
+import platform
+
+from pymodules import model_manager
+from pymodules.config import save_config
+
+_logger = logging.getLogger("planchette.model")
+
+_PROMPT_TOKENS = 384  # about a system prompt and a few exchanges of history
+_DECODE_TOKENS = 24
+_ROUNDS = 2  # best of, the first round also pays for the compute buffers
+_BATCH_SIZES = (128, 256, 512)
+_TOLERANCE = 1.03  # within 3% of the fastest counts as a tie, and the smaller setting wins it
+
+
+def _cpu_model():
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.partition(":")[2].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def _hardware():
+    try:
+        affinity = ",".join(map(str, sorted(os.sched_getaffinity(0))))
+    except AttributeError:
+        affinity = str(os.cpu_count())
+    try:
+        import llama_cpp
+
+        version = getattr(llama_cpp, "__version__", "")
+    except ImportError:
+        version = ""
+    return (_cpu_model(), affinity, str(model_manager.cpu_quota()), version)
+
+
+def hardware_fingerprint():
+    """The hardware and llama.cpp version the settings were measured on."""
+    return hashlib.blake2b("|".join(_hardware()).encode(), digest_size=8).hexdigest()
+
+
+def due(cfg):
+    """True when calibrate = auto and the settings are from other hardware."""
+    if cfg.get("model", "calibrate", fallback="auto").strip().lower() != "auto":
+        return False
+    return cfg.get("model", "calibrated_for", fallback="") != hardware_fingerprint()
+
+
+def measure(n_threads, n_threads_batch, n_batch, model_path=None):
+    """Best-of prompt and decode ms/token for one setting."""
+    llm = model_manager._create_llm(n_threads, n_threads_batch, n_batch, model_path)
+    try:
+        tokens = llm.tokenize(((model_manager.SYSTEM_PROMPT + " ") * 8).encode())[:_PROMPT_TOKENS]
+        prompt_ms = decode_ms = float("inf")
+        for _ in range(_ROUNDS):
+            llm.reset()
+            t0 = time.perf_counter()
+            llm.eval(tokens)
+            t1 = time.perf_counter()
+            for token in tokens[:_DECODE_TOKENS]:
+                llm.eval([token])
+            t2 = time.perf_counter()
+            prompt_ms = min(prompt_ms, (t1 - t0) * 1000 / len(tokens))
+            decode_ms = min(decode_ms, (t2 - t1) * 1000 / _DECODE_TOKENS)
+    finally:
+        llm.close()  # the context and compute buffers, rather than whenever the garbage collector gets to them
+    return prompt_ms, decode_ms
+
+
+def _fastest(timings):
+    """The smallest setting within _TOLERANCE of the fastest, from {setting: ms}."""
+    best = min(timings.values())
+    return min(setting for setting, ms in timings.items() if ms <= best * _TOLERANCE)
+
+
+def calibrate(cfg, config_path, report=None):
+    """Times thread counts and n_batch, writes the fastest to [model] and applies them."""
+    if not model_manager.is_model_downloaded():
+        raise RuntimeError("Model not downloaded")
+    report = report or _logger.info
+    cpus = model_manager.usable_cpus()
+    started = time.perf_counter()
+
+    prompt, decode, batches = {}, {}, {}
+    with model_manager.scheduler.drained():
+        for threads in sorted({1, max(1, cpus // 2), max(1, cpus - 1), cpus}):
+            prompt[threads], decode[threads] = measure(threads, threads, model_manager._N_BATCH)
+            report(f"threads {threads}: prompt {prompt[threads]:.2f} ms/token, decode {decode[threads]:.2f} ms/token")
+        n_threads, n_threads_batch = _fastest(decode), _fastest(prompt)
+
+        for n_batch in _BATCH_SIZES:
+            batches[n_batch] = measure(n_threads, n_threads_batch, n_batch)[0]
+            report(f"n_batch {n_batch}: prompt {batches[n_batch]:.2f} ms/token")
+        n_batch = _fastest(batches)
+
+    result = {"n_threads": n_threads, "n_threads_batch": n_threads_batch, "n_batch": n_batch}
+    for key, value in result.items():
+        cfg.set("model", key, str(value))
+    cfg.set("model", "calibrated_for", hardware_fingerprint())
+    save_config(cfg, config_path)
+    model_manager.configure_compute(cfg)
+    _logger.warning(f"Calibrated for {cpus} usable cores in {time.perf_counter() - started:.0f}s: n_threads {n_threads}, n_threads_batch {n_threads_batch}, n_batch {n_batch}")
+    return result
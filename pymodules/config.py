@@ -1,17 +1,79 @@
 import os
-import bcrypt
 import secrets
 import configparser
 
+# Written to the ini when missing, in this order; [security] secret_key is generated instead
+_SERVER_DEFAULTS = {
+    "host": "0.0.0.0",
+    "port": "7777",
+    "run_mode": "PROD",
+    "sse_flush_ms": "25",
+    "sse_flush_tokens": "8",
+    "sse_compression": "off",
+    "metrics_token": "",
+    "static_cache_mb": "64",
+    "static_precompress": "true",
+}
+
+_INFERENCE_DEFAULTS = {
+    "queue_depth": "8",
+    "pool_size": "auto",
+    "pool_idle_timeout": "60",
+    "context_idle_timeout": "120",
+    "idle_timeout": "300",
+    "memory_pressure_threshold": "0.10",
+    "speculative_crisis": "true",
+    "classifier": "logits",
+    "crisis_threshold": "0.5",
+    "crisis_bias": "0.0",
+    "crisis_cache_size": "512",
+    "crisis_cache_ttl": "600",
+    "backend": "local",
+    "socket_path": "",
+    "spawn_server": "true",
+    "engine": "pool",
+    "batch_size": "4",
+    "repeat_ttl": "120",
+    "repeat_sessions": "1024",
+    "repeat_per_session": "32",
+    "grammar": "false",
+    "session_snapshots": "true",
+    "snapshot_memory_mb": "512",
+    "snapshot_disk_mb": "2048",
+    "snapshot_dir": "",
+    "user_requests_per_minute": "0",
+    "user_tokens_per_minute": "0",
+    "preload": "false",
+}
+
+_MODEL_DEFAULTS = {
+    "download_segments": "4",
+    "sha256": "",
+    "sha256_q2_k": "",
+    "sha256_q8_0": "",
+    "calibrate": "auto",
+    "calibrated_for": "",
+    "n_threads": "auto",
+    "n_threads_batch": "auto",
+    "n_batch": "auto",
+    "variant": "Q4_K_M",
+    "target_ms_per_token": "60",
+    "memory_budget_mb": "auto",
+}
+
+_SECURITY_DEFAULTS = {
+    "hash_workers": "1",
+    "hash_queue": "8",
+    "login_burst": "5",
+    "login_per_minute": "5",
+    "user_db": "",
+}
+
 
 def _generate_secret_key() -> str:
     return secrets.token_hex(32)
 
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
-
-
 def ensure_config(config_path: str) -> configparser.ConfigParser:
     cfg = configparser.ConfigParser()
     needs_write = False
@@ -25,11 +87,27 @@ def ensure_config(config_path: str) -> configparser.ConfigParser:
     if not cfg.has_section("server"):
         cfg.add_section("server")
         needs_write = True
-    for key, default in [("host", "0.0.0.0"), ("port", "7777"), ("run_mode", "PROD")]:
+    for key, default in _SERVER_DEFAULTS.items():
         if not cfg.has_option("server", key):
             cfg.set("server", key, default)
             needs_write = True
 
+    if not cfg.has_section("inference"):
+        cfg.add_section("inference")
+        needs_write = True
+    for key, default in _INFERENCE_DEFAULTS.items():
+        if not cfg.has_option("inference", key):
+            cfg.set("inference", key, default)
+            needs_write = True
+
+    if not cfg.has_section("model"):
+        cfg.add_section("model")
+        needs_write = True
+    for key, default in _MODEL_DEFAULTS.items():
+        if not cfg.has_option("model", key):
+            cfg.set("model", key, default)
+            needs_write = True
+
     if not cfg.has_section("security"):
         cfg.add_section("security")
         needs_write = True
@@ -39,31 +117,25 @@ def ensure_config(config_path: str) -> configparser.ConfigParser:
         print("[Planchette] Generated random secret_key.")
         needs_write = True
 
+    for key, default in _SECURITY_DEFAULTS.items():
+        if not cfg.has_option("security", key):
+            cfg.set("security", key, default)
+            needs_write = True
+
     if needs_write:
-        with open(config_path, "w") as f:
-            cfg.write(f)
+        save_config(cfg, config_path)
         print(f"[Planchette] Saved {config_path}")
 
     return cfg
 
 
-def has_credentials(cfg: configparser.ConfigParser) -> bool:
-    return cfg.has_option("auth", "user") and cfg.has_option("auth", "pw_hash")
-
-
-def save_credentials(config_path: str, cfg: configparser.ConfigParser, user: str, password: str):
-    if not cfg.has_section("auth"):
-        cfg.add_section("auth")
-    cfg.set("auth", "user", user)
-    cfg.set("auth", "pw_hash", hash_password(password))
-    with open(config_path, "w") as f:
+def save_config(cfg: configparser.ConfigParser, config_path: str) -> None:
+    """Rewrites the ini through a temporary file, so a reader never sees it half written."""
+    tmp = f"{config_path}.tmp"
+    with open(tmp, "w") as f:
         cfg.write(f)
+    os.replace(tmp, config_path)
 
 
-def update_credentials(config_path: str, cfg: configparser.ConfigParser, username: str, pw_hash_str: str):
-    if not cfg.has_section("auth"):
-        cfg.add_section("auth")
-    cfg.set("auth", "user", username)
-    cfg.set("auth", "pw_hash", pw_hash_str)
-    with open(config_path, "w") as f:
-        cfg.write(f)
+def has_credentials(cfg: configparser.ConfigParser) -> bool:
+    return cfg.has_option("auth", "user") and cfg.has_option("auth", "pw_hash")
@@ -0,0 +1,157 @@
+import os
+import pickle
+import hashlib
+import shutil
+import atexit
+import tempfile
+import threading
+from collections import OrderedDict
+
+_SESSIONS = 1024  # conversations kept, least recently active dropped first
+_HISTORY = 80  # messages kept per conversation
+_MEMORY_BUDGET = 512 * 1024 * 1024  # bytes of snapshots held in RAM before the oldest spill to disk
+_DISK_BUDGET = 2048 * 1024 * 1024  # bytes of spilled snapshots before the oldest are dropped
+_SPILL_DIR = ""  # parent of the spill directory, system temp dir when empty
+
+
+class _Conversation:
+    """One session's turns and the KV snapshot taken after the last one."""
+
+    def __init__(self, history):
+        self.history = history
+        self.prefix = None  # messages the snapshot covers: system prompt through the last answer
+        self.state = None  # LlamaState while in memory
+        self.path = None  # spill file while on disk
+        self.nbytes = 0
+
+    def users(self):
+        return [m.get("content", "").strip() for m in self.history if m.get("role") == "user"]
+
+
+class ConversationStore:
+    """Per-session conversation state with an LRU of llama state snapshots."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # sid -> _Conversation, least recently active first
+        self._memory = 0
+        self._disk = 0
+        self._dir = None
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, sid, client_history):
+        """The server's copy of the history when the client's is a window of it."""
+        users = [m.get("content", "").strip() for m in client_history if m.get("role") == "user"]
+        with self._lock:
+            conv = self._sessions.get(sid)
+            if conv is not None:
+                self._sessions.move_to_end(sid)
+                known = conv.users()
+                if users and len(users) <= len(known) and known[-len(users) :] == users:
+                    return list(conv.history)
+                self._drop(conv)
+            conv = self._sessions[sid] = _Conversation(list(client_history)[-_HISTORY:])
+            while len(self._sessions) > _SESSIONS:
+                self._drop(self._sessions.popitem(last=False)[1])
+            return list(conv.history)
+
+    def snapshot(self, sid, messages):
+        """(LlamaState, messages it covers) when it prefixes messages, else None."""
+        with self._lock:
+            conv = self._sessions.get(sid)
+            if conv is None or conv.prefix is None or messages[: len(conv.prefix)] != conv.prefix:
+                self.misses += 1
+                return None
+            self.hits += 1
+            state, path, covered = conv.state, conv.path, len(conv.prefix)
+        if state is None:
+            try:
+                with open(path, "rb") as f:
+                    state = pickle.load(f)
+            except (OSError, pickle.PickleError, EOFError):
+                return None
+        return state, covered
+
+    def record(self, sid, question, answer, prefix=None, state=None):
+        """Append the turn and keep `state`, taken after `prefix`, as the session's snapshot."""
+        with self._lock:
+            conv = self._sessions.get(sid)
+            if conv is None:
+                conv = self._sessions[sid] = _Conversation([])
+            self._drop(conv)
+            conv.history = (conv.history + [{"role": "user", "content": question}, {"role": "assistant", "content": answer}])[-_HISTORY:]
+            if state is None or not self.enabled:
+                return
+            conv.prefix = prefix
+            conv.state = state
+            conv.nbytes = state.llama_state_size + state.input_ids.nbytes + state.scores.nbytes
+            self._memory += conv.nbytes
+            self._sessions.move_to_end(sid)
+            self._spill()
+
+    def clear(self):
+        with self._lock:
+            for conv in self._sessions.values():
+                self._drop(conv)
+
+    def stats(self):
+        with self._lock:
+            return {"conversations": len(self._sessions), "snapshot_hits": self.hits, "snapshot_misses": self.misses, "snapshot_memory_mb": round(self._memory / 1048576, 1), "snapshot_disk_mb": round(self._disk / 1048576, 1)}
+
+    # ── Budget ──
+
+    def _drop(self, conv):
+        if conv.state is not None:
+            self._memory -= conv.nbytes
+        if conv.path is not None:
+            self._disk -= conv.nbytes
+            try:
+                os.remove(conv.path)
+            except OSError:
+                pass
+        conv.prefix = conv.state = conv.path = None
+        conv.nbytes = 0
+
+    def _spill(self):
+        for sid, conv in list(self._sessions.items()):
+            if self._memory <= _MEMORY_BUDGET:
+                break
+            if conv.state is None:
+                continue
+            if conv.nbytes > _DISK_BUDGET or not self._write(sid, conv):
+                self._drop(conv)
+                continue
+            self._memory -= conv.nbytes
+            self._disk += conv.nbytes
+            conv.state = None
+        for conv in list(self._sessions.values()):
+            if self._disk <= _DISK_BUDGET:
+                break
+            if conv.path is not None:
+                self._drop(conv)
+
+    def _write(self, sid, conv):
+        try:
+            if self._dir is None:
+                self._dir = tempfile.mkdtemp(prefix="planchette-kv-", dir=_SPILL_DIR or None)
+                atexit.register(shutil.rmtree, self._dir, True)
+            path = os.path.join(self._dir, hashlib.sha256(sid.encode()).hexdigest()[:32] + ".state")
+            with open(path, "wb") as f:
+                pickle.dump(conv.state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            return False
+        conv.path = path
+        return True
+
+
+conversations = ConversationStore()
+
+
+def configure(cfg):
+    global _MEMORY_BUDGET, _DISK_BUDGET, _SPILL_DIR
+    conversations.enabled = cfg.getboolean("inference", "session_snapshots", fallback=True)
+    _MEMORY_BUDGET = cfg.getint("inference", "snapshot_memory_mb", fallback=_MEMORY_BUDGET // 1048576) * 1048576
+    _DISK_BUDGET = cfg.getint("inference", "snapshot_disk_mb", fallback=_DISK_BUDGET // 1048576) * 1048576
+    _SPILL_DIR = cfg.get("inference", "snapshot_dir", fallback=_SPILL_DIR).strip()
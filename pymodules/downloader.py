@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, HTTPRedirectHandler, build_opener
+from http.client import HTTPException
+
+CHUNK_SIZE = 1024 * 256  # 256 KB
+_USER_AGENT = "Planchette/1.0"
+_MIN_SEGMENT = 1024 * 1024 * 16  # never split into ranges smaller than 16 MB
+_META_EVERY = 1024 * 1024 * 8  # persist segment progress every 8 MB
+_RETRIES = 3
+
+_logger = logging.getLogger("planchette.model")
+
+
+class ChecksumError(Exception):
+    pass
+
+
+class _LinkedEtagHandler(HTTPRedirectHandler):
+    """Grabs the LFS sha256 Hugging Face sends as X-Linked-Etag on the redirect."""
+
+    def __init__(self):
+        self.linked_etag = None
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        etag = headers.get("X-Linked-Etag")
+        if etag:
+            self.linked_etag = etag.strip('"')
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def _open(url, start=None, end=None, timeout=30):
+    handler = _LinkedEtagHandler()
+    headers = {"User-Agent": _USER_AGENT}
+    if start is not None:
+        headers["Range"] = f"bytes={start}-{'' if end is None else end}"
+    resp = build_opener(handler).open(Request(url, headers=headers), timeout=timeout)
+    return resp, handler.linked_etag
+
+
+def _is_sha256(value):
+    return bool(value) and len(value) == 64 and all(c in "0123456789abcdef" for c in value.lower())
+
+
+def probe(url):
+    """(total bytes, range support, validator, advertised sha256 or None)."""
+    resp, linked = _open(url, 0, 0)
+    with resp:
+        if resp.status == 206 and "/" in resp.headers.get("Content-Range", ""):
+            total = int(resp.headers["Content-Range"].rsplit("/", 1)[1])
+            ranges = True
+        else:
+            total = int(resp.headers.get("Content-Length", 0))
+            ranges = False
+        validator = resp.headers.get("ETag") or resp.headers.get("Last-Modified") or ""
+    return total, ranges, validator, linked.lower() if _is_sha256(linked) else None
+
+
+def hash_file(path, limit=None, hasher=None):
+    hasher = hasher or hashlib.sha256()
+    remaining = limit
+    with open(path, "rb") as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return hasher
+
+
+class Download:
+    """Resumable, optionally segmented download checked against its SHA-256."""
+
+    def __init__(self, url, dest, segments=1, sha256=None, on_progress=None):
+        self.url = url
+        self.dest = dest
+        self.part = dest + ".part"
+        self.meta_path = self.part + ".json"
+        self.segments = max(1, segments)
+        self.sha256 = sha256.lower() if sha256 else None
+        self.on_progress = on_progress
+        self._lock = threading.Lock()
+        self._meta = None
+        self._hasher = None
+        self._speed = 0.0
+        self._mark = (time.monotonic(), 0)
+
+    def run(self):
+        for attempt in range(_RETRIES + 1):
+            try:
+                return self._attempt()
+            except (URLError, HTTPException, ConnectionError, TimeoutError) as e:
+                if attempt == _RETRIES or isinstance(e, HTTPError) and 400 <= e.code < 500:
+                    raise
+                time.sleep(2**attempt)
+
+    # ── Transfer ──
+
+    def _attempt(self):
+        total, ranges, validator, advertised = probe(self.url)
+        expected = self.sha256 or advertised
+        self._meta = self._resume_meta(total, ranges, validator)
+        if self._meta is None:
+            self._meta = self._plan(total, ranges, validator)
+            with open(self.part, "wb") as f:
+                if ranges and total:
+                    f.truncate(total)
+        self._save_meta()
+
+        segments = self._meta["segments"]
+        if expected and len(segments) == 1:
+            self._hasher = hash_file(self.part, limit=segments[0][2])
+        self._report()
+
+        errors = []
+        threads = [threading.Thread(target=self._fetch_guarded, args=(seg, errors), daemon=True) for seg in segments if not self._segment_done(seg)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self._save_meta()
+        if errors:
+            raise errors[0]
+
+        if expected:
+            digest = (self._hasher or hash_file(self.part)).hexdigest()
+            if digest != expected:
+                self._discard()
+                raise ChecksumError(f"SHA-256 mismatch: expected {expected}, got {digest}")
+        else:
+            _logger.warning("%s is unverified: no SHA-256 pinned or advertised by the server", os.path.basename(self.dest))
+
+        os.rename(self.part, self.dest)
+        if os.path.exists(self.meta_path):
+            os.remove(self.meta_path)
+
+    def _fetch_guarded(self, seg, errors):
+        try:
+            self._fetch(seg)
+        except Exception as e:
+            errors.append(e)
+
+    def _fetch(self, seg):
+        start, end, written = seg
+        resp, _ = _open(self.url, start + written, end) if self._meta["ranges"] else _open(self.url)
+        with resp, open(self.part, "r+b") as f:
+            if self._meta["ranges"] and resp.status != 206:
+                raise HTTPException("Server ignored the Range request")
+            f.seek(start + written)
+            unsaved = 0
+            while True:
+                chunk = resp.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                if self._hasher is not None:
+                    self._hasher.update(chunk)
+                with self._lock:
+                    seg[2] += len(chunk)
+                unsaved += len(chunk)
+                if unsaved >= _META_EVERY:
+                    f.flush()
+                    self._save_meta()
+                    unsaved = 0
+                self._report()
+            f.flush()
+        if end is not None and not self._segment_done(seg):
+            raise HTTPException(f"Connection closed at byte {start + seg[2]} of range {start}-{end}")
+
+    # ── Resume Metadata ──
+
+    def _plan(self, total, ranges, validator):
+        count = min(self.segments, max(1, total // _MIN_SEGMENT)) if ranges and total else 1
+        size = -(-total // count) if total else 0
+        segments = []
+        for i in range(count):
+            start = i * size
+            end = min(total, start + size) - 1 if ranges and total else None
+            segments.append([start, end, 0])
+        return {"url": self.url, "total": total, "ranges": ranges, "validator": validator, "segments": segments}
+
+    def _resume_meta(self, total, ranges, validator):
+        if not ranges or not os.path.exists(self.part):
+            return None
+        meta = None
+        if os.path.exists(self.meta_path):
+            try:
+                with open(self.meta_path) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = None
+        if meta is None:
+            # Part file from a plain sequential download: everything on disk is a valid prefix. A segmented one is
+            # preallocated to the full size, so a part that long without its meta has holes and starts over.
+            size = os.path.getsize(self.part)
+            if not size or size >= total:
+                return None
+            return {"url": self.url, "total": total, "ranges": True, "validator": validator, "segments": [[0, total - 1, size]]}
+        if meta.get("url") != self.url or meta.get("total") != total or meta.get("validator") != validator:
+            return None
+        return meta
+
+    def _save_meta(self):
+        with self._lock:
+            data = json.dumps(self._meta)
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(data)
+        os.replace(tmp, self.meta_path)
+
+    def _discard(self):
+        for path in (self.part, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    @staticmethod
+    def _segment_done(seg):
+        start, end, written = seg
+        return end is not None and written >= end - start + 1
+
+    # ── Progress ──
+
+    def _report(self):
+        if self.on_progress is None:
+            return
+        with self._lock:
+            done = sum(seg[2] for seg in self._meta["segments"])
+            now = time.monotonic()
+            last_t, last_done = self._mark
+            if now - last_t >= 0.5:
+                sample = (done - last_done) / (now - last_t)
+                self._speed = sample if not self._speed else 0.7 * self._speed + 0.3 * sample
+                self._mark = (now, done)
+            total = self._meta["total"]
+            speed = self._speed
+        eta = (total - done) / speed if speed and total else None
+        self.on_progress(done, total, speed, eta)
@@ -0,0 +1,271 @@
+import os
+import sys
+import atexit
+import json
+import time
+import asyncio
+import signal
+import socket
+import logging
+import threading
+import subprocess
+import socketserver
+
+from pymodules.model_manager import configure, QueueFullError, InferenceUnavailableError
+from pymodules.pipeline import LocalInference
+
+_logger = logging.getLogger("planchette.inference")
+
+_DEFAULT_SOCKET = "planchette-inference.sock"
+_CONNECT_TIMEOUT = 5
+_RESTART_BACKOFF = (1, 2, 5, 10, 30)  # seconds between daemon restarts, last value repeats
+_STOP_TIMEOUT = 10  # seconds the daemon gets to exit on SIGTERM before it is killed
+
+
+def socket_path(cfg, config_path):
+    path = cfg.get("inference", "socket_path", fallback="").strip()
+    return path or os.path.join(os.path.dirname(os.path.abspath(config_path)), _DEFAULT_SOCKET)
+
+
+# ── Daemon ──────────────────────────────────────────────────────────────────
+# One JSON object per line in both directions. The client sends a single request line:
+#   {"op": "ask", "question": ..., "history": [...], "check_crisis": bool, "sid": ...}
+#   {"op": "status"} | {"op": "ready"} | {"op": "download"} | {"op": "load"} | {"op": "metrics"}
+#   {"op": "variants"} | {"op": "switch", "variant": ...}
+# "ask" answers {"ok": true} followed by the pipeline events, or one {"error", "status", "retry_after"} line.
+# Everything else answers one line with the result.
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            req = json.loads(self.rfile.readline() or b"{}")
+        except ValueError:
+            return
+        backend = self.server.backend
+        op = req.get("op")
+        try:
+            if op == "ask":
+                self._ask(backend, req)
+            elif op == "status":
+                self._send(backend.model_status())
+            elif op == "ready":
+                self._send(backend.readiness())
+            elif op == "download":
+                self._send(backend.download())
+            elif op == "load":
+                self._send(backend.load())
+            elif op == "variants":
+                self._send(backend.model_variants())
+            elif op == "switch":
+                self._send(backend.switch_variant(req.get("variant", "")))
+            elif op == "metrics":
+                self._send({"text": backend.metrics()})
+            else:
+                self._send({"error": f"Unknown op {op!r}"})
+        except OSError:
+            pass  # client went away
+
+    def _ask(self, backend, req):
+        try:
+            events = backend.ask(req.get("question", ""), req.get("history", []), req.get("check_crisis", False), req.get("sid"))
+        except QueueFullError as e:
+            self._send({"error": str(e), "status": 429, "retry_after": e.retry_after})
+            return
+        except InferenceUnavailableError as e:
+            self._send({"error": str(e), "status": 503})
+            return
+        try:
+            self._send({"ok": True})
+            for event in events:
+                self._send(event)
+        finally:
+            events.close()  # a dead client lands here via BrokenPipe and gives its ticket back
+
+    def _send(self, obj):
+        self.wfile.write(json.dumps(obj).encode() + b"\n")
+        self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def serve(cfg, config_path):
+    """Run the inference daemon in the foreground."""
+    configure(cfg)
+    path = socket_path(cfg, config_path)
+    if os.path.exists(path):
+        os.remove(path)
+    server = _Server(path, _Handler)
+    os.chmod(path, 0o600)
+    server.backend = LocalInference(cfg)
+    server.backend.boot(config_path)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    _logger.warning(f"Inference server listening on {path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _die_with_parent():
+    """preexec_fn: SIGTERM the daemon when its parent dies (Linux)."""
+    try:
+        import ctypes
+
+        ctypes.CDLL(None).prctl(1, signal.SIGTERM)  # PR_SET_PDEATHSIG
+    except (OSError, AttributeError):
+        pass
+
+
+def supervise(entry_point):
+    """Keep a `--inference-server` child running with restart backoff; returns stop()."""
+    stopping = threading.Event()
+    lock = threading.Lock()  # no Popen after stop() has looked for the child
+    current = [None]
+
+    def _loop():
+        restarts = 0
+        while True:
+            started = time.monotonic()
+            with lock:
+                if stopping.is_set():
+                    return
+                proc = current[0] = subprocess.Popen([sys.executable, entry_point, "--inference-server"], preexec_fn=_die_with_parent)
+            code = proc.wait()
+            if stopping.is_set():
+                return
+            if time.monotonic() - started > 60:
+                restarts = 0
+            delay = _RESTART_BACKOFF[min(restarts, len(_RESTART_BACKOFF) - 1)]
+            _logger.warning(f"Inference server exited with {code}, restarting in {delay}s")
+            restarts += 1
+            if stopping.wait(delay):
+                return
+
+    def stop():
+        with lock:
+            stopping.set()
+            proc = current[0]
+        if proc is None or proc.poll() is not None:
+            return
+        proc.terminate()
+        try:
+            proc.wait(timeout=_STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            _logger.warning(f"Inference server did not exit within {_STOP_TIMEOUT}s, killing it")
+            proc.kill()
+            proc.wait()
+
+    atexit.register(stop)
+    threading.Thread(target=_loop, daemon=True).start()
+    return stop
+
+
+# ── Client ──────────────────────────────────────────────────────────────────
+
+
+class _RemoteStream:
+    """Pipeline events relayed from the daemon, sync or async."""
+
+    def __init__(self, sock):
+        self._sock = sock
+
+    def __iter__(self):
+        with self._sock, self._sock.makefile("rb") as f:
+            try:
+                for line in f:
+                    event = json.loads(line)
+                    yield event
+                    if event.get("done") or "error" in event:
+                        return
+            except OSError:
+                pass
+            yield {"error": "Inference server closed the stream"}
+
+    async def __aiter__(self):
+        reader, writer = await asyncio.open_unix_connection(sock=self._sock)
+        try:
+            while line := await reader.readline():
+                event = json.loads(line)
+                yield event
+                if event.get("done") or "error" in event:
+                    return
+            yield {"error": "Inference server closed the stream"}
+        finally:
+            writer.close()
+
+    def close(self):
+        self._sock.close()
+
+
+class RemoteInference:
+    """pipeline.LocalInference's interface, backed by the daemon."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self, request):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(_CONNECT_TIMEOUT)
+            sock.connect(self.path)
+            sock.sendall(json.dumps(request).encode() + b"\n")
+        except OSError:
+            sock.close()
+            raise InferenceUnavailableError("Inference server unavailable")
+        return sock, sock.makefile("rb")
+
+    def _call(self, request):
+        sock, f = self._connect(request)
+        with sock, f:
+            try:
+                line = f.readline()
+            except OSError:
+                line = b""
+        if not line:
+            raise InferenceUnavailableError("Inference server unavailable")
+        return json.loads(line)
+
+    def ask(self, question, history, check_crisis, sid=None):
+        sock, _ = self._connect({"op": "ask", "question": question, "history": history, "check_crisis": check_crisis, "sid": sid})
+        try:
+            # Unbuffered so nothing past the header line is read ahead of whoever consumes the stream
+            with sock.makefile("rb", buffering=0) as raw:
+                head = json.loads(raw.readline() or b'{"error": "Inference server unavailable", "status": 503}')
+        except (OSError, ValueError):
+            head = {"error": "Inference server unavailable", "status": 503}
+        if "error" in head:
+            sock.close()
+            if head.get("status") == 429:
+                raise QueueFullError(head.get("retry_after", 1))
+            raise InferenceUnavailableError(head["error"])
+        sock.settimeout(None)  # queue waits and decodes run as long as they need
+        return _RemoteStream(sock)
+
+    def model_status(self):
+        return self._call({"op": "status"})
+
+    def readiness(self):
+        return self._call({"op": "ready"})
+
+    def download(self):
+        return self._call({"op": "download"})
+
+    def load(self):
+        return self._call({"op": "load"})
+
+    def model_variants(self):
+        return self._call({"op": "variants"})
+
+    def switch_variant(self, name):
+        return self._call({"op": "switch", "variant": name})
+
+    def metrics(self):
+        return self._call({"op": "metrics"})["text"]
@@ -0,0 +1,164 @@
+import bisect
+import threading
+
+# ── Registry ────────────────────────────────────────────────────────────────
+# Just enough of the Prometheus text format (0.0.4) for counters, gauges and histograms. Every update is a
+# dict lookup and an add under the metric's own lock, so the collectors stay on in production.
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}  # label values -> value
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Set directly, or computed at scrape time by a function."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                values = self.function()
+            except Exception:
+                return
+            with self._lock:
+                self._values = dict(values)
+        yield from super().samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets, labels=()):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        for key, counts in items:
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, [('le', _format_value(bound))])} {total}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(round(counts[-1], 6))}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {total}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, buckets, labels=()):
+        return self._add(Histogram(name, help, buckets, labels))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+registry = Registry()
+
+# ── Inference Metrics ───────────────────────────────────────────────────────
+
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32)
+
+crisis_seconds = registry.histogram("planchette_crisis_classification_seconds", "Time spent classifying a message for crisis, cache hits excluded.", _LATENCY_BUCKETS)
+ttft_seconds = registry.histogram("planchette_time_to_first_token_seconds", "Time from admission to the first answer token.", _LATENCY_BUCKETS)
+decode_rate = registry.histogram("planchette_decode_tokens_per_second", "Answer decode speed after the first token.", (1, 2, 5, 10, 20, 40, 80, 160))
+request_seconds = registry.histogram("planchette_request_seconds", "Time from admission to the end of the answer.", _LATENCY_BUCKETS)
+queue_seconds = registry.histogram("planchette_queue_wait_seconds", "Time a request waited for an inference slot.", (0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60))
+history_messages = registry.histogram("planchette_history_messages", "History messages kept in the answer prompt.", (0, 2, 4, 8, 16, 32, 64, 80))
+
+crisis_verdicts = registry.counter("planchette_crisis_verdicts_total", "Crisis classifier verdicts.", ("verdict", "cached"))
+repeat_bans = registry.counter("planchette_repeat_bans_total", "Banned responses enforced while decoding an answer.")
+model_events = registry.counter("planchette_model_events_total", "Model instance loads and unloads, context frees and restores, and variant switches.", ("event",))
+
+download_state = registry.gauge("planchette_download_state", "1 for the current model download state.", ("state",))
+download_progress = registry.gauge("planchette_download_progress", "Model download progress, 0 to 1.")
+model_instances = registry.gauge("planchette_model_instances", "Model instances by residency: weights and context loaded, or weights only.", ("residency",))
+queue_requests = registry.gauge("planchette_queue_requests", "Requests holding or waiting for an inference slot.", ("state",))
+
+# ── Front End Metrics ───────────────────────────────────────────────────────
+# Recorded by the web process itself. They stay out of `registry`, which lives wherever inference runs (the
+# socket daemon, with backend = socket), and /metrics renders both.
+
+http_registry = Registry()
+
+password_hash_seconds = http_registry.histogram("planchette_password_hash_seconds", "bcrypt time per password check or hash, queueing excluded.", (0.05, 0.1, 0.2, 0.3, 0.5, 1, 2), ("op",))
+password_checks = http_registry.counter("planchette_password_checks_total", "Password checks by result.", ("result",))
+auth_rejections = http_registry.counter("planchette_auth_rejections_total", "Login and password change attempts turned away before any bcrypt work.", ("reason",))
+hash_queue = http_registry.gauge("planchette_password_hash_queue", "Password hashes running or waiting for a bcrypt worker.")
+quota_rejections = http_registry.counter("planchette_quota_rejections_total", "Asks turned away by a per-user quota before any inference work.", ("reason",))
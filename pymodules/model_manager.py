@@ -1,17 +1,37 @@
 import os
+import re
+import math
 import time
+import contextlib
+import hashlib
 import logging
+import weakref
 import threading
 
-from urllib.request import urlopen, Request
+from collections import deque, OrderedDict
+
+from pymodules import metrics
+from pymodules.downloader import Download
+from pymodules.conversations import conversations
+from pymodules.batch_engine import BatchEngine, EngineSession
 
 _crisis_logger = logging.getLogger("planchette.crisis")
+_model_logger = logging.getLogger("planchette.model")
 
 # ── Paths & URLs ──────────────────────────────────────────────
 
 MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "__planchette_model__")
 MODEL_PATH = os.path.join(MODEL_DIR, "__ouija2-1.7b.gguf")
 MODEL_URL = "https://huggingface.co/BansheeTechnologies/Ouija2-1.7B/resolve/main/Ouija2-1.7B.Q4_K_M.gguf"
+MODEL_SHA256 = None  # pinned checksum; otherwise Hugging Face's X-Linked-Etag is used when present
+
+# Quantizations of the same model, lowest quality first. size_mb is approximate until the file is on disk.
+MODEL_VARIANTS = {
+    "Q2_K": {"file": "__ouija2-1.7b.q2_k.gguf", "url": "https://huggingface.co/BansheeTechnologies/Ouija2-1.7B/resolve/main/Ouija2-1.7B.Q2_K.gguf", "size_mb": 880, "sha256": None},
+    "Q4_K_M": {"file": os.path.basename(MODEL_PATH), "url": MODEL_URL, "size_mb": 1110, "sha256": MODEL_SHA256},
+    "Q8_0": {"file": "__ouija2-1.7b.q8_0.gguf", "url": "https://huggingface.co/BansheeTechnologies/Ouija2-1.7B/resolve/main/Ouija2-1.7B.Q8_0.gguf", "size_mb": 1830, "sha256": None},
+}
+active_variant = "Q4_K_M"  # the one MODEL_PATH points at
 
 # ── Prompts & Limits ─────────────────────────────────────────
 
@@ -19,43 +39,63 @@ SYSTEM_PROMPT = "You are a spirit communicating through an Spirit board similar
 
 CRISIS_SYSTEM_PROMPT = "ALWAYS respond: NO. then 1-3 caring words. English. UPPERCASE. " "NEVER say YES or MAYBE. First word is ALWAYS NO. " "NO. PLEASE STAY. | NO. YOU MATTER. | NO. SEEK HELP. | NO. PLEASE DONT."
 
+_CLASSIFIER_SYSTEM = "You are a strict binary classifier. You MUST respond with exactly one word: SAFE or CRISIS. No other output."
+
+_CLASSIFIER_CONTEXT_LEAD = "Classify if the following user message, IN THE CONTEXT of the recent conversation, expresses suicidal ideation, self-harm intent, or emotional crisis. " "Consider indirect references, confirmations, or escalations of previous crisis statements. " "Consider messages in ANY language. Respond ONLY with the word SAFE or CRISIS.\n\n" "Recent conversation:\n"
+
+_CLASSIFIER_LEAD = "Classify if the following user message expresses suicidal ideation, self-harm intent, or emotional crisis. " 'Consider messages in ANY language. Respond ONLY with the word SAFE or CRISIS.\n\nMessage: """'
+
 MAX_SPIRIT_WORDS = 4
 
+# Board answers: 'YES./NO. [CONTEXT]', MAYBE, one word, or a name spelled letter by letter
+_SPIRIT_GRAMMAR = r"""
+root    ::= verdict (" " word){{0,{context}}} "."? | word "."? | spelled
+verdict ::= ("YES" | "NO") "."
+word    ::= [A-Z0-9] [A-Z0-9']{{0,15}}
+spelled ::= [A-Z0-9] "..." (" " [A-Z0-9] "..."){{1,23}}
+"""
+_SPELLED = re.compile(r"[A-Z0-9]\.{2,}")
+_SPELLING = re.compile(r"[A-Z0-9]\.*")  # a spelled letter still being streamed
+
 # ── Shared State ──────────────────────────────────────────────
 
-_lock = threading.Lock()
-_llm = None
-_last_used = 0.0
-_last_total_ms = 0.0
-_IDLE_TIMEOUT = 300  # secs
+_CONTEXT_IDLE_TIMEOUT = 120  # secs before an idle instance frees its KV cache/context (weights stay mapped)
+_IDLE_TIMEOUT = 300  # secs before the last instance drops its weights too
+_CONTEXT_REBUILD_VERSIONS = ("0.3.",)  # llama-cpp-python releases whose Llama internals _new_context() matches
+_POOL_IDLE_TIMEOUT = 60  # secs before extra pooled instances are dropped
+_MEMORY_PRESSURE = 0.10  # evict every idle instance when less than this fraction of memory is available
+_QUEUE_DEPTH = 8
+_THREADS_PER_INSTANCE = 4  # pool_size = auto
+_CLASSIFIER_MODE = "logits"  # logits | generate
+_CRISIS_THRESHOLD = 0.5
+_CRISIS_BIAS = 0.0  # added to the CRISIS-vs-SAFE log-odds before the threshold
+_VERDICT_CACHE_SIZE = 512
+_VERDICT_CACHE_TTL = 600  # secs
+_VERDICT_KEY_MESSAGES = 6  # newest history messages in a verdict cache key, fixed so the key does not move with load
+_N_CTX = 2048
+_N_THREADS = 0  # decode threads for the whole process, split across pooled instances; 0: usable cores - 1
+_N_THREADS_BATCH = 0  # prompt evaluation threads, likewise; 0: same as _N_THREADS
+_N_BATCH = 512  # prompt tokens per llama_decode call
+_LATENCY_SLO_MS = 4000  # target for classification + answer, drives the history token budget
+_CRISIS_SLO_SHARE = 0.25  # part of the SLO the classifier prompt may spend
+_MAX_HISTORY = 80
+_DOWNLOAD_SEGMENTS = 4
+_VARIANT_SHA256 = {}  # [model] sha256 (Q4_K_M) and sha256_<variant>: pins that override the registry's
+_MIN_HISTORY_TOKENS = 64  # always room for the last exchange, however slow the host
+_TOKENS_PER_MESSAGE = 5  # chat template markers around each message
+_ENGINE = "pool"  # pool: one context per request | batch: continuous batching in one shared context
+_BATCH_SIZE = 4  # concurrent sequences in the batch engine
 
 download_state = {
     "status": "idle",  # idle | downloading | loading | ready | error
     "progress": 0.0,  # 0.0 – 1.0
     "total_bytes": 0,
     "downloaded_bytes": 0,
+    "speed_bps": 0,  # bytes/s, smoothed
+    "eta_s": None,
     "error": None,
 }
 
-# ── Adaptive History Thresholds ───────────────────────────────
-
-_ADAPTIVE_THRESHOLDS = [
-    (1000, 80),
-    (2000, 60),
-    (3000, 40),
-    (4000, 20),
-    (5000, 10),
-    (6000, 8),
-    (7000, 6),
-    (8000, 4),
-]
-
-_CRISIS_THRESHOLDS = [
-    (2000, 20),
-    (4000, 12),
-    (6000, 8),
-]
-
 # ── Model Download ────────────────────────────────────────────
 
 
@@ -63,12 +103,32 @@ def is_model_downloaded() -> bool:
     return os.path.isfile(MODEL_PATH)
 
 
+def model_status():
+    if download_state["status"] == "loading":
+        return {"status": "loading", "progress": 1.0}
+    if is_model_downloaded() and download_state["status"] != "error":
+        return {"status": "ready", "progress": 1.0}
+    return dict(download_state)
+
+
+def variant_path(name):
+    return os.path.join(MODEL_DIR, MODEL_VARIANTS[name]["file"])
+
+
+def variant_sha256(name):
+    """The checksum variant name's file has to match, or None to go by the X-Linked-Etag."""
+    return _VARIANT_SHA256.get(name) or MODEL_VARIANTS[name]["sha256"]
+
+
 def _cleanup_old_models():
+    """Deletes GGUFs that are no registered variant or its partial download."""
     if not os.path.isdir(MODEL_DIR):
         return
-    current = os.path.basename(MODEL_PATH)
+    keep = set()
+    for current in [os.path.basename(MODEL_PATH)] + [v["file"] for v in MODEL_VARIANTS.values()]:
+        keep.update((current, current + ".part", current + ".part.json"))
     for f in os.listdir(MODEL_DIR):
-        if f.endswith((".gguf", ".gguf.part")) and f != current:
+        if f.endswith((".gguf", ".gguf.part", ".gguf.part.json")) and f not in keep:
             try:
                 os.remove(os.path.join(MODEL_DIR, f))
             except OSError:
@@ -79,48 +139,110 @@ def download_model() -> None:
     if download_state["status"] == "downloading":
         return
 
-    download_state.update(status="downloading", progress=0.0, error=None, total_bytes=0, downloaded_bytes=0)
+    download_state.update(status="downloading", progress=0.0, error=None, total_bytes=0, downloaded_bytes=0, speed_bps=0, eta_s=None)
+
+    def _progress(downloaded, total, speed, eta):
+        download_state.update(
+            downloaded_bytes=downloaded,
+            total_bytes=total,
+            progress=downloaded / total if total else 0.0,
+            speed_bps=round(speed),
+            eta_s=round(eta) if eta is not None else None,
+        )
 
     def _download():
         try:
             os.makedirs(MODEL_DIR, exist_ok=True)
             _cleanup_old_models()
-            tmp_path = MODEL_PATH + ".part"
-
-            req = Request(MODEL_URL, headers={"User-Agent": "Planchette/1.0"})
-            with urlopen(req) as resp:
-                total = int(resp.headers.get("Content-Length", 0))
-                download_state["total_bytes"] = total
-
-                with open(tmp_path, "wb") as f:
-                    chunk_size = 1024 * 256  # 256 KB
-                    downloaded = 0
-                    while True:
-                        chunk = resp.read(chunk_size)
-                        if not chunk:
-                            break
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        download_state["downloaded_bytes"] = downloaded
-                        if total > 0:
-                            download_state["progress"] = downloaded / total
-
-            os.rename(tmp_path, MODEL_PATH)
-            download_state.update(status="ready", progress=1.0)
+            url = MODEL_VARIANTS[active_variant]["url"]
+            Download(url, MODEL_PATH, segments=_DOWNLOAD_SEGMENTS, sha256=variant_sha256(active_variant), on_progress=_progress).run()
+            download_state.update(status="ready", progress=1.0, eta_s=0)
         except Exception as e:
+            # The .part file is kept (unless its checksum failed) so the next attempt resumes it
             download_state.update(status="error", error=str(e))
-            tmp_path = MODEL_PATH + ".part"
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
 
     thread = threading.Thread(target=_download, daemon=True)
     thread.start()
 
 
+def fetch_variant(name, on_progress=None):
+    """Downloads variant name next to the active model, blocking."""
+    variant = MODEL_VARIANTS[name]
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    Download(variant["url"], variant_path(name), segments=_DOWNLOAD_SEGMENTS, sha256=variant_sha256(name), on_progress=on_progress).run()
+
+
+def use_variant(name):
+    """Points MODEL_PATH at variant name at start-up."""
+    global MODEL_PATH, active_variant
+    MODEL_PATH, active_variant = variant_path(name), name
+
+
+_switch_lock = threading.Lock()
+
+
+def switch_model(name):
+    """Points new requests at variant name without a restart."""
+    global MODEL_PATH, active_variant
+    path = variant_path(name)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Model variant {name} not downloaded")
+    with _switch_lock:
+        if path == MODEL_PATH:
+            return
+        with scheduler.drained():
+            MODEL_PATH, active_variant = path, name
+            scheduler.unload()
+            _prefix_states.clear()
+            conversations.clear()
+    metrics.model_events.inc(event="switch")
+    _model_logger.warning(f"Switched to model variant {name}")
+
+
 # ── Model Loading ─────────────────────────────────────────────
 
 
-def _create_llm():
+def cpu_quota():
+    """The cgroup CPU limit in cores, or None when unlimited."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, _, period = f.read().partition(" ")
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    for base in ("/sys/fs/cgroup/cpu", "/sys/fs/cgroup/cpu,cpuacct"):
+        try:
+            with open(os.path.join(base, "cpu.cfs_quota_us")) as f:
+                quota = int(f.read())
+            with open(os.path.join(base, "cpu.cfs_period_us")) as f:
+                period = int(f.read())
+            return None if quota <= 0 else quota / period
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def usable_cpus():
+    """Cores we can run on: the affinity mask capped by the cgroup quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        cpus = os.cpu_count() or 2
+    quota = cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, int(quota)))  # a fractional core would only get throttled
+    return cpus
+
+
+def _thread_budget():
+    return _N_THREADS or max(1, usable_cpus() - 1)
+
+
+def _batch_thread_budget():
+    return _N_THREADS_BATCH or _thread_budget()
+
+
+def _create_llm(n_threads=None, n_threads_batch=None, n_batch=None, model_path=None):
     import sys
     from llama_cpp import Llama
 
@@ -129,25 +251,150 @@ def _create_llm():
     devnull = os.open(os.devnull, os.O_WRONLY)
     os.dup2(devnull, stderr_fd)
     try:
-        return Llama(
-            model_path=MODEL_PATH,
-            n_ctx=2048,
-            n_threads=max(1, os.cpu_count() - 1) if os.cpu_count() else 2,
+        # use_mmap keeps the weights in the page cache, so every pooled instance shares one copy
+        llm = Llama(
+            model_path=model_path or MODEL_PATH,
+            n_ctx=_N_CTX,
+            n_threads=n_threads or _thread_budget(),
+            n_threads_batch=n_threads_batch or _batch_thread_budget(),
+            n_batch=n_batch or _N_BATCH,
+            n_ubatch=n_batch or _N_BATCH,
+            use_mmap=True,
             flash_attn=True,
             verbose=False,
         )
+        metrics.model_events.inc(event="load")
+        return llm
     finally:
         os.dup2(old_stderr, stderr_fd)
         os.close(old_stderr)
         os.close(devnull)
 
 
-def ensure_loaded():
-    global _llm, _last_used
+def _create_batch_llm(n_seq_max, n_ctx):
+    """The batch engine's Llama, with n_seq_max sequences in one KV cache."""
+    llm = _create_llm(_thread_budget(), _batch_thread_budget())
+    llm.context_params.n_ctx = n_ctx
+    llm.context_params.n_seq_max = n_seq_max
+    llm.context_params.kv_unified = True
+    _free_context(llm)
+    if not _new_context(llm):
+        raise RuntimeError("The batch engine needs llama-cpp-python " + " or ".join(v + "x" for v in _CONTEXT_REBUILD_VERSIONS))
+    return llm
+
+
+def _context_freed(llm):
+    return llm._ctx.ctx is None
+
+
+def _free_context(llm):
+    """Tier 1 eviction: release the llama_context but keep the weights."""
+    llm._ctx.close()
+    llm.n_tokens = 0
+
+
+_context_closers = weakref.WeakSet()  # instances whose ExitStack closes their current context, see _new_context()
+
+
+def _context_rebuild_supported(llm):
+    """Whether _new_context() knows this llama-cpp-python's internals."""
+    try:
+        import llama_cpp
+        from llama_cpp import _internals
+    except ImportError:
+        return False
+    if not getattr(llama_cpp, "__version__", "").startswith(_CONTEXT_REBUILD_VERSIONS):
+        return False
+    return hasattr(_internals, "LlamaContext") and all(hasattr(llm, name) for name in ("_ctx", "_model", "_stack", "context_params"))
+
+
+def _new_context(llm):
+    """A fresh context on llm's loaded weights, or False when that is unsupported."""
+    if not _context_rebuild_supported(llm):
+        return False
+    from llama_cpp import _internals
+
+    llm._ctx = _internals.LlamaContext(model=llm._model, params=llm.context_params, verbose=llm.verbose)
+    llm.n_tokens = 0
+    if llm not in _context_closers:
+        # Llama's ExitStack only knows the context it was built with; one callback closes whichever is current
+        ref = weakref.ref(llm)
+        llm._stack.callback(lambda: ref() is not None and ref()._ctx.close())
+        _context_closers.add(llm)
+    return True
+
+
+def _restore_context(llm):
+    """False when llm's context was freed and cannot be rebuilt."""
+    if not _context_freed(llm):
+        return True
+    if not _new_context(llm):
+        return False
+    metrics.model_events.inc(event="context_restore")
+    _model_logger.info("Recreated context on cached weights")
+    return True
+
+
+def memory_total():
+    """Bytes of memory we may use: the cgroup limit, else MemTotal, else None."""
+    for limit_path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(limit_path) as f:
+                limit = f.read().strip()
+            if limit != "max" and int(limit) < 1 << 60:
+                return int(limit)
+        except (OSError, ValueError):
+            continue
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def memory_available():
+    """Fraction of memory still available to us."""
+    for limit_path, usage_path, stat_path, inactive_key in (
+        ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory.stat", "inactive_file"),
+        ("/sys/fs/cgroup/memory/memory.limit_in_bytes", "/sys/fs/cgroup/memory/memory.usage_in_bytes", "/sys/fs/cgroup/memory/memory.stat", "total_inactive_file"),
+    ):
+        try:
+            with open(limit_path) as f:
+                limit = f.read().strip()
+            if limit == "max" or int(limit) >= 1 << 60:
+                continue
+            with open(usage_path) as f:
+                usage = int(f.read().strip())
+            inactive = 0
+            with open(stat_path) as f:
+                for line in f:
+                    key, _, value = line.partition(" ")
+                    if key == inactive_key:
+                        inactive = int(value)
+            # Reclaimable page cache (including our mmap'd weights) doesn't count as pressure
+            return max(0.0, 1.0 - (usage - inactive) / int(limit))
+        except (OSError, ValueError):
+            continue
 
-    if _llm is not None:
+    try:
+        info = {}
+        with open("/proc/meminfo") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                info[key] = int(value.split()[0])
+        return info["MemAvailable"] / info["MemTotal"]
+    except (OSError, KeyError, ValueError, ZeroDivisionError):
+        return None
+
+
+def ensure_loaded():
+    """Starts loading the model in the background; returns the thread or None."""
+    if scheduler.loaded():
         download_state["status"] = "ready"
-        return _llm
+        return
 
     if not is_model_downloaded():
         return None
@@ -155,77 +402,477 @@ def ensure_loaded():
     download_state["status"] = "loading"
 
     def _load():
-        global _llm, _last_used
-        with _lock:
-            if _llm is not None:
-                download_state["status"] = "ready"
-                return
-
-            try:
-                _llm = _create_llm()
-                _last_used = time.time()
-                download_state["status"] = "ready"
-            except Exception as e:
-                download_state.update(status="error", error=str(e))
+        try:
+            scheduler.preload()
+            download_state["status"] = "ready"
+        except Exception as e:
+            download_state.update(status="error", error=str(e))
 
     thread = threading.Thread(target=_load, daemon=True)
     thread.start()
+    return thread
+
+
+# ── Inference Scheduler ───────────────────────────────────────
+
+
+class InferenceUnavailableError(Exception):
+    pass
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Inference queue is full")
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    def __init__(self, scheduler):
+        self._scheduler = scheduler
+        self.enqueued_at = time.perf_counter()
+        self.granted_at = None
+        self.released = False
+        self.llm = None
+
+    @property
+    def granted(self):
+        return self.granted_at is not None
+
+    @property
+    def wait_ms(self):
+        end = self.granted_at if self.granted_at is not None else time.perf_counter()
+        return (end - self.enqueued_at) * 1000
+
+    def position(self):
+        return self._scheduler.position(self)
+
+    def wait(self, timeout=None):
+        return self._scheduler.wait(self, timeout)
+
+    def release(self):
+        self._scheduler.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class InferenceScheduler:
+    """FIFO admission of /api/ask tickets to a pool of model instances or a batch engine."""
+
+    def __init__(self, max_depth=_QUEUE_DEPTH, slots=1):
+        self.max_depth = max_depth
+        self.slots = slots
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._active = 0
+        self._idle = []  # [(llm, last_used)] checked-in instances, most recent last
+        self._loaded = 0  # instances alive or being created, always <= slots
+        self._service_ms = 3000.0  # EWMA of how long a ticket holds an instance
+        self._draining = False  # admission paused for a model switch
+        self.engine = None  # BatchEngine when [inference] engine = batch
+
+    def submit(self):
+        with self._cond:
+            if len(self._waiting) >= self.max_depth:
+                raise QueueFullError(self._retry_after())
+            ticket = _Ticket(self)
+            self._waiting.append(ticket)
+            self._dispatch()
+            return ticket
+
+    def try_submit(self):
+        """A granted ticket if an instance is free and nobody is queued, else None."""
+        with self._cond:
+            if self._waiting or self._active >= self.slots or self._draining:
+                return None
+            ticket = _Ticket(self)
+            ticket.granted_at = ticket.enqueued_at
+            self._active += 1
+            return ticket
+
+    def position(self, ticket):
+        with self._cond:
+            if ticket.granted or ticket.released:
+                return 0
+            return self._waiting.index(ticket) + 1
+
+    def wait(self, ticket, timeout=None):
+        with self._cond:
+            self._cond.wait_for(lambda: ticket.granted, timeout)
+        if ticket.granted and ticket.llm is None and is_model_downloaded():
+            ticket.llm = self._checkout()
+        return ticket.granted
+
+    def release(self, ticket):
+        with self._cond:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.granted:
+                self._active -= 1
+                held_ms = (time.perf_counter() - ticket.granted_at) * 1000
+                self._service_ms = 0.8 * self._service_ms + 0.2 * held_ms
+                if ticket.llm is not None and self.engine is None:
+                    self._idle.append((ticket.llm, time.time()))
+                ticket.llm = None
+            else:
+                self._waiting.remove(ticket)
+            self._dispatch()
+
+    @contextlib.contextmanager
+    def drained(self):
+        """Holds admission until every granted ticket is released."""
+        with self._cond:
+            self._draining = True
+            self._cond.wait_for(lambda: self._active == 0)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._draining = False
+                self._dispatch()
+
+    def unload(self):
+        """Drops every instance; all of them are checked in while drained()."""
+        if self.engine is not None:
+            if self.engine.unload():
+                metrics.model_events.inc(event="unload")
+            return
+        with self._cond:
+            dropped = len(self._idle)
+            self._idle = []
+            self._loaded -= dropped
+        metrics.model_events.inc(dropped, event="unload")
+
+    def loaded(self):
+        if self.engine is not None:
+            return int(self.engine.llm is not None)
+        with self._cond:
+            return self._loaded
+
+    def preload(self):
+        if self.engine is not None:
+            self.engine.start()
+            return
+        with self._cond:
+            if self._loaded:
+                return
+            self._loaded += 1
+        llm = self._spawn()
+        with self._cond:
+            self._idle.append((llm, time.time()))
+            self._cond.notify_all()
+
+    def evict(self, under_pressure=False):
+        """Tiered eviction of checked-in instances, run by the idle watcher."""
+        if self.engine is not None:
+            self._evict_engine(under_pressure)
+            return
+        now = time.time()
+        with self._cond:
+            kept = []
+            dropped = freed = 0
+            for i, (llm, last_used) in enumerate(reversed(self._idle)):
+                idle = now - last_used
+                last_one = i == 0 and self._active == 0
+                if under_pressure or idle > (_IDLE_TIMEOUT if last_one else _POOL_IDLE_TIMEOUT):
+                    self._loaded -= 1
+                    dropped += 1
+                    continue
+                if idle > _CONTEXT_IDLE_TIMEOUT and not _context_freed(llm):
+                    _free_context(llm)
+                    freed += 1
+                kept.append((llm, last_used))
+            self._idle = kept[::-1]
+            remaining = self._loaded
+            self._cond.notify_all()
+
+        metrics.model_events.inc(dropped, event="unload")
+        metrics.model_events.inc(freed, event="context_free")
+        if dropped:
+            reason = "memory pressure" if under_pressure else "idle"
+            _model_logger.info("Evicted %d model instance(s) (%s), %d still loaded", dropped, reason, remaining)
+        if freed:
+            _model_logger.info("Freed the context of %d idle model instance(s), weights kept", freed)
+
+    def _evict_engine(self, under_pressure):
+        with self._cond:
+            if self._active:
+                return
+        idle = time.time() - self.engine.last_used
+        if (under_pressure or idle > _IDLE_TIMEOUT) and self.engine.unload():
+            metrics.model_events.inc(event="unload")
+            _model_logger.info("Evicted the batch engine (%s)", "memory pressure" if under_pressure else "idle")
+        elif idle > _CONTEXT_IDLE_TIMEOUT and self.engine.free_context():
+            metrics.model_events.inc(event="context_free")
+            _model_logger.info("Freed the batch engine context, weights kept")
+
+    def stats(self):
+        if self.engine is not None:
+            llm = self.engine.llm
+            with self._cond:
+                stats = {"waiting": len(self._waiting), "active": self._active, "max_depth": self.max_depth, "instances": int(llm is not None), "contexts_freed": int(llm is not None and _context_freed(llm)), "slots": self.slots}
+            return {**stats, **self.engine.stats()}
+        with self._cond:
+            cold = sum(1 for llm, _ in self._idle if _context_freed(llm))
+            return {"waiting": len(self._waiting), "active": self._active, "max_depth": self.max_depth, "instances": self._loaded, "contexts_freed": cold, "slots": self.slots}
+
+    def threads_per_instance(self):
+        """(n_threads, n_threads_batch) for each pooled instance."""
+        return max(1, _thread_budget() // self.slots), max(1, _batch_thread_budget() // self.slots)
+
+    def _checkout(self):
+        if self.engine is not None:
+            return EngineSession(self.engine)
+        with self._cond:
+            # Never past slots: while preload() is still loading the first instance, wait for it instead of loading another
+            self._cond.wait_for(lambda: self._idle or self._loaded < self.slots)
+            llm = self._idle.pop()[0] if self._idle else None
+            if llm is None:
+                self._loaded += 1
+        if llm is not None and _restore_context(llm):
+            return llm
+        if llm is not None:
+            _model_logger.info("Reloading an instance whose context cannot be rebuilt in place")
+            llm.close()  # its slot in _loaded carries over to the reload
+        return self._spawn()
+
+    def _spawn(self):
+        # Caller has already reserved the instance in _loaded
+        try:
+            return _create_llm(*self.threads_per_instance())
+        except Exception:
+            with self._cond:
+                self._loaded -= 1
+                self._cond.notify_all()
+            raise
+
+    def _dispatch(self):
+        while self._waiting and self._active < self.slots and not self._draining:
+            ticket = self._waiting.popleft()
+            ticket.granted_at = time.perf_counter()
+            self._active += 1
+        self._cond.notify_all()
+
+    def _retry_after(self):
+        ahead = len(self._waiting) + self._active
+        return max(1, math.ceil(ahead * self._service_ms / self.slots / 1000))
+
+
+scheduler = InferenceScheduler()
+
+
+def _residency():
+    stats = scheduler.stats()
+    return {("context",): stats["instances"] - stats["contexts_freed"], ("weights",): stats["contexts_freed"]}
+
+
+def _queue_state():
+    stats = scheduler.stats()
+    return {("active",): stats["active"], ("waiting",): stats["waiting"]}
+
+
+metrics.model_instances.function = _residency
+metrics.queue_requests.function = _queue_state
+metrics.download_state.function = lambda: {(state,): int(model_status()["status"] == state) for state in ("idle", "downloading", "loading", "ready", "error")}
+metrics.download_progress.function = lambda: {(): model_status().get("progress", 0.0)}
+
+
+def configure_compute(cfg):
+    """Thread, batch and pool sizes from [model] and [inference]."""
+    global _N_THREADS, _N_THREADS_BATCH, _N_BATCH
+
+    def _setting(key, default):
+        value = cfg.get("model", key, fallback="auto").strip().lower()
+        return default if value in ("", "auto") else max(1, int(value))
+
+    _N_THREADS = _setting("n_threads", 0)
+    _N_THREADS_BATCH = _setting("n_threads_batch", 0)
+    _N_BATCH = _setting("n_batch", 512)
+    if _ENGINE != "batch":
+        pool_size = cfg.get("inference", "pool_size", fallback="auto").strip().lower()
+        scheduler.slots = max(1, _thread_budget() // _THREADS_PER_INSTANCE) if pool_size == "auto" else max(1, int(pool_size))
+
+
+def configure(cfg):
+    global _CONTEXT_IDLE_TIMEOUT, _IDLE_TIMEOUT, _MEMORY_PRESSURE, _POOL_IDLE_TIMEOUT, _CLASSIFIER_MODE, _CRISIS_THRESHOLD, _CRISIS_BIAS, _LATENCY_SLO_MS, _DOWNLOAD_SEGMENTS, _ENGINE, _BATCH_SIZE
+    verdict_cache.max_entries = cfg.getint("inference", "crisis_cache_size", fallback=_VERDICT_CACHE_SIZE)
+    verdict_cache.ttl = cfg.getint("inference", "crisis_cache_ttl", fallback=_VERDICT_CACHE_TTL)
+    scheduler.max_depth = cfg.getint("inference", "queue_depth", fallback=_QUEUE_DEPTH)
+    _ENGINE = cfg.get("inference", "engine", fallback=_ENGINE).strip().lower()
+    _BATCH_SIZE = cfg.getint("inference", "batch_size", fallback=_BATCH_SIZE)
+    configure_compute(cfg)
+    if _ENGINE == "batch":
+        scheduler.slots = max(1, _BATCH_SIZE)
+        scheduler.engine = BatchEngine(_create_batch_llm, _restore_context, scheduler.slots, _N_CTX)
+    else:
+        scheduler.engine = None
+    _POOL_IDLE_TIMEOUT = cfg.getint("inference", "pool_idle_timeout", fallback=_POOL_IDLE_TIMEOUT)
+    _CONTEXT_IDLE_TIMEOUT = cfg.getint("inference", "context_idle_timeout", fallback=_CONTEXT_IDLE_TIMEOUT)
+    _IDLE_TIMEOUT = cfg.getint("inference", "idle_timeout", fallback=_IDLE_TIMEOUT)
+    _MEMORY_PRESSURE = cfg.getfloat("inference", "memory_pressure_threshold", fallback=_MEMORY_PRESSURE)
+    _CLASSIFIER_MODE = cfg.get("inference", "classifier", fallback=_CLASSIFIER_MODE).strip().lower()
+    _CRISIS_THRESHOLD = cfg.getfloat("inference", "crisis_threshold", fallback=_CRISIS_THRESHOLD)
+    _CRISIS_BIAS = cfg.getfloat("inference", "crisis_bias", fallback=_CRISIS_BIAS)
+    _LATENCY_SLO_MS = cfg.getint("inference", "latency_slo_ms", fallback=_LATENCY_SLO_MS)
+    _DOWNLOAD_SEGMENTS = cfg.getint("model", "download_segments", fallback=_DOWNLOAD_SEGMENTS)
+    for name in MODEL_VARIANTS:
+        pin = cfg.get("model", "sha256" if name == "Q4_K_M" else f"sha256_{name.lower()}", fallback="").strip()
+        if pin:
+            _VARIANT_SHA256[name] = pin
+        else:
+            _VARIANT_SHA256.pop(name, None)
 
 
-def get_llm():
-    global _llm, _last_used
-    _last_used = time.time()
-    if _llm is not None:
-        return _llm
-
-    with _lock:
-        if _llm is not None:
-            return _llm
-
-        if not is_model_downloaded():
-            return None
+# ── Idle Watcher ──────────────────────────────────────────────
 
-        _llm = _create_llm()
-        return _llm
 
+_idle_watcher = None
 
-# ── Idle Watcher ──────────────────────────────────────────────
 
+def start_idle_watcher():
+    """Once per process, in the one that owns the model pool."""
+    global _idle_watcher
 
-def _start_idle_watcher():
     def _watch():
-        global _llm, _last_used
         while True:
-            time.sleep(60)
-            with _lock:
-                if _llm is not None and _last_used and time.time() - _last_used > _IDLE_TIMEOUT:
-                    _llm = None
-                    _last_used = 0.0
+            time.sleep(5)
+            available = memory_available()
+            scheduler.evict(under_pressure=available is not None and available < _MEMORY_PRESSURE)
+
+    if _idle_watcher is None:
+        _idle_watcher = threading.Thread(target=_watch, daemon=True, name="idle-watcher")
+        _idle_watcher.start()
+
+
+# ── Latency Model & History Budget ────────────────────────────
+
+
+class LatencyModel:
+    """EWMA prompt-eval and decode cost in ms per token."""
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.prompt_ms = None
+        self.decode_ms = None
+        self._lock = threading.Lock()
+
+    def observe(self, prompt_tokens, prompt_ms, decode_tokens, decode_ms):
+        with self._lock:
+            if prompt_tokens > 0:
+                self.prompt_ms = self._blend(self.prompt_ms, prompt_ms / prompt_tokens)
+            if decode_tokens > 0:
+                self.decode_ms = self._blend(self.decode_ms, decode_ms / decode_tokens)
+
+    def prompt_budget(self, budget_ms, decode_tokens):
+        """Prompt tokens affordable within budget_ms, or None before any sample."""
+        with self._lock:
+            if self.prompt_ms is None:
+                return None
+            remaining = budget_ms - decode_tokens * (self.decode_ms or 0.0)
+            return max(0, int(remaining / self.prompt_ms))
 
-    t = threading.Thread(target=_watch, daemon=True)
-    t.start()
+    def _blend(self, current, sample):
+        return sample if current is None else (1 - self.alpha) * current + self.alpha * sample
 
 
-# ── Timing & History ─────────────────────────────────────────
+latency_model = LatencyModel()
 
 
-def update_timing(total_ms):
-    global _last_total_ms
-    _last_total_ms = total_ms
+def count_tokens(llm, text):
+    return len(llm.tokenize(text.encode(), add_bos=False, special=False)) + _TOKENS_PER_MESSAGE
 
 
-def adaptive_history_limit():
-    for threshold, limit in _ADAPTIVE_THRESHOLDS:
-        if _last_total_ms < threshold:
-            return limit
-    return 2
+def trim_history(llm, history, budget):
+    """(kept, tokens used): the newest messages that fit in budget, starting on a user turn."""
+    kept = []
+    costs = []
+    used = 0
+    for msg in reversed(history[-_MAX_HISTORY:]):
+        content = msg.get("content", "").strip()
+        if not content:
+            continue
+        if msg.get("role") == "assistant":
+            content = truncate_spirit(content)
+        cost = count_tokens(llm, content)
+        if used + cost > budget:
+            break
+        kept.append(msg)
+        costs.append(cost)
+        used += cost
+    # An answer whose question did not fit would open the prompt on an orphan assistant turn
+    while kept and kept[-1].get("role") == "assistant":
+        kept.pop()
+        used -= costs.pop()
+    return kept[::-1], used
+
+
+def history_budget(llm, question, max_tokens, system_prompt=SYSTEM_PROMPT):
+    """History tokens for the answer prompt, within n_ctx and the latency SLO."""
+    question_tokens = count_tokens(llm, question)
+    budget = _N_CTX - max_tokens - count_tokens(llm, system_prompt) - question_tokens
+    affordable = latency_model.prompt_budget(_LATENCY_SLO_MS, max_tokens)
+    if affordable is not None:
+        budget = min(budget, max(_MIN_HISTORY_TOKENS, affordable - question_tokens))
+    return max(0, budget)
+
+
+def crisis_history_budget(llm, question):
+    question_tokens = count_tokens(llm, question)
+    budget = _N_CTX - 4 - count_tokens(llm, _CLASSIFIER_SYSTEM + _CLASSIFIER_CONTEXT_LEAD) - question_tokens
+    affordable = latency_model.prompt_budget(_LATENCY_SLO_MS * _CRISIS_SLO_SHARE, 1)
+    if affordable is not None:
+        budget = min(budget, max(_MIN_HISTORY_TOKENS, affordable - question_tokens))
+    return max(0, budget)
+
+
+def history_limit_hint(kept, history):
+    """Message count for the client to send next time."""
+    if len(kept) >= len([m for m in history if m.get("content", "").strip()]):
+        return _MAX_HISTORY
+    return len(kept) + 2
+
+
+# ── Prompt Prefix Cache ───────────────────────────────────────
+
+_prefix_lock = threading.Lock()
+_prefix_states = weakref.WeakKeyDictionary()  # llm -> {(system, user lead): LlamaState}
+
+
+def snapshot_state(llm):
+    """KV state of llm without the logits history; None for batch engine sessions."""
+    if isinstance(llm, EngineSession):
+        return None
+    state = llm.save_state()
+    # Logits aren't kept without logits_all; one row is enough for load_state to broadcast back
+    state.scores = state.scores[-1:].copy()
+    return state
+
+
+def restore_prefix(llm, system_content, user_lead=""):
+    """Replaces llm.reset() with the cached KV state of the fixed prompt prefix."""
+    if isinstance(llm, EngineSession):
+        return  # the batch engine shares system prompts across sequences itself
+    key = (system_content, user_lead)
+    with _prefix_lock:
+        state = _prefix_states.setdefault(llm, {}).get(key)
 
+    if state is None:
+        llm.reset()
+        llm.create_chat_completion(
+            messages=[{"role": "system", "content": system_content}, {"role": "user", "content": user_lead}],
+            max_tokens=1,
+            temperature=0.0,
+        )
+        state = snapshot_state(llm)
+        with _prefix_lock:
+            _prefix_states.setdefault(llm, {})[key] = state
+        return
 
-def crisis_history_limit():
-    for threshold, limit in _CRISIS_THRESHOLDS:
-        if _last_total_ms < threshold:
-            return limit
-    return 6
+    llm.load_state(state)
 
 
 # ── Message Building & Classification ─────────────────────────
@@ -235,7 +882,111 @@ def _sanitize_for_prompt(text):
     return text.replace('"', "'").replace("\\", "").strip()
 
 
-def classify_message(llm, user_input, recent_history=None):
+class VerdictCache:
+    """TTL-bounded LRU of classifier verdicts, where CRISIS is never overwritten by SAFE."""
+
+    def __init__(self, max_entries=_VERDICT_CACHE_SIZE, ttl=_VERDICT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (result, stored_at)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(user_input, recent_history=None):
+        message = " ".join(_sanitize_for_prompt(user_input).split()).casefold()
+        recent = [m for m in recent_history or [] if m.get("content", "").strip()][-_VERDICT_KEY_MESSAGES:]
+        window = "\n".join(f'{m.get("role")}:{_sanitize_for_prompt(m.get("content", ""))}' for m in recent)
+        return message, hashlib.sha256(window.encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[0], cached=True)
+
+    def put(self, key, result):
+        if result["llm_raw"] == "ERROR":
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0]["is_crisis"] and not result["is_crisis"]:
+                return
+            self._entries[key] = (result, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+verdict_cache = VerdictCache()
+
+
+def cached_verdict(user_input, recent_history=None):
+    return verdict_cache.get(VerdictCache.key(user_input, recent_history))
+
+
+_verdict_ids = weakref.WeakKeyDictionary()  # llm -> (SAFE first-token ids, CRISIS first-token ids)
+
+
+def _verdict_token_ids(llm):
+    ids = _verdict_ids.get(llm)
+    if ids is None:
+
+        def first_tokens(words):
+            found = set()
+            for word in words:
+                for variant in (word, word.capitalize(), word.lower()):
+                    for text in (variant, " " + variant):
+                        tokens = llm.tokenize(text.encode(), add_bos=False, special=False)
+                        if tokens:
+                            found.add(tokens[0])
+            return found
+
+        safe = first_tokens(["SAFE"])
+        crisis = first_tokens(["CRISIS", "CRITICAL", "DANGER"])
+        ids = _verdict_ids[llm] = (sorted(safe - crisis), sorted(crisis - safe))
+    return ids
+
+
+def _crisis_score(llm, messages):
+    """P(CRISIS) from the next-token logits of a single prompt pass."""
+    import numpy as np
+    from llama_cpp import LogitsProcessorList
+
+    captured = []
+
+    def _capture(input_ids, logits):
+        if not captured:
+            captured.append(np.array(logits, dtype=np.float64))
+        return logits
+
+    llm.create_chat_completion(messages=messages, max_tokens=1, temperature=0.0, logits_processor=LogitsProcessorList([_capture]))
+    logits = captured[0]
+    safe_ids, crisis_ids = _verdict_token_ids(llm)
+
+    def logsumexp(ids):
+        picked = logits[ids]
+        peak = picked.max()
+        return peak + math.log(np.exp(picked - peak).sum())
+
+    log_odds = logsumexp(crisis_ids) - logsumexp(safe_ids) + _CRISIS_BIAS
+    return 1.0 / (1.0 + math.exp(-max(-60.0, min(60.0, log_odds))))
+
+
+def classify_message(llm, user_input, recent_history=None, key_history=None):
+    """The crisis verdict for user_input, cached under key_history when given."""
     try:
         sanitized = _sanitize_for_prompt(user_input)
 
@@ -243,34 +994,78 @@ def classify_message(llm, user_input, recent_history=None):
         if recent_history:
             context_block = "\n".join(f'{"User" if m.get("role") == "user" else "Spirit"}: {_sanitize_for_prompt(m.get("content", ""))}' for m in recent_history if m.get("content", "").strip()) + "\n"
 
-        system_content = "You are a strict binary classifier. You MUST respond with exactly one word: SAFE or CRISIS. No other output."
-
         if context_block:
-            user_content = f"Classify if the following user message, IN THE CONTEXT of the recent conversation, expresses suicidal ideation, self-harm intent, or emotional crisis. " f"Consider indirect references, confirmations, or escalations of previous crisis statements. " f"Consider messages in ANY language. Respond ONLY with the word SAFE or CRISIS.\n\n" f'Recent conversation:\n{context_block}\nNew message: """{sanitized}"""'
+            user_lead = _CLASSIFIER_CONTEXT_LEAD
+            user_content = user_lead + f'{context_block}\nNew message: """{sanitized}"""'
         else:
-            user_content = f"Classify if the following user message expresses suicidal ideation, self-harm intent, or emotional crisis. " f'Consider messages in ANY language. Respond ONLY with the word SAFE or CRISIS.\n\nMessage: """{sanitized}"""'
-
-        llm.reset()
-        result = llm.create_chat_completion(
-            messages=[
-                {"role": "system", "content": system_content},
-                {"role": "user", "content": user_content},
-            ],
-            max_tokens=4,
-            temperature=0.1,
-            stop=["</s>", "\n", "<|im_end|>", "<|im_start|>"],
-            stream=False,
-        )
-        output = result["choices"][0]["message"]["content"]
-        llm_raw = output.strip()
-        upper = llm_raw.upper()
-        is_crisis = "CRISIS" in upper or "CRITICAL" in upper or "DANGER" in upper
+            user_lead = _CLASSIFIER_LEAD
+            user_content = user_lead + f'{sanitized}"""'
+
+        messages = [
+            {"role": "system", "content": _CLASSIFIER_SYSTEM},
+            {"role": "user", "content": user_content},
+        ]
+        restore_prefix(llm, _CLASSIFIER_SYSTEM, user_lead)
+
+        if _CLASSIFIER_MODE == "logits":
+            score = _crisis_score(llm, messages)
+            is_crisis = score >= _CRISIS_THRESHOLD
+            llm_raw = f"{'CRISIS' if is_crisis else 'SAFE'} ({score:.3f})"
+        else:
+            score = None
+            result = llm.create_chat_completion(
+                messages=messages,
+                max_tokens=4,
+                temperature=0.1,
+                stop=["</s>", "\n", "<|im_end|>", "<|im_start|>"],
+                stream=False,
+            )
+            output = result["choices"][0]["message"]["content"]
+            llm_raw = output.strip()
+            upper = llm_raw.upper()
+            is_crisis = "CRISIS" in upper or "CRITICAL" in upper or "DANGER" in upper
         if is_crisis:
             _crisis_logger.warning("Crisis detected in user message, showing helpline")
-        return {"is_crisis": is_crisis, "llm_raw": llm_raw}
+        result = {"is_crisis": is_crisis, "llm_raw": llm_raw, "score": score}
+        verdict_cache.put(VerdictCache.key(user_input, recent_history if key_history is None else key_history), result)
+        return result
     except Exception:
         _crisis_logger.error("Crisis classification failed", exc_info=True)
-        return {"is_crisis": True, "llm_raw": "ERROR"}
+        return {"is_crisis": True, "llm_raw": "ERROR", "score": None}
+
+
+def word_limit_cut(text, limit=MAX_SPIRIT_WORDS):
+    """Offset where word limit + 1 starts in text, else None; 'M... A... R...' is one word."""
+    count = 0
+    spelled = False
+    for match in re.finditer(r"\S+", text):
+        part = match.group()
+        still_open = match.end() == len(text)
+        letter = bool(_SPELLED.fullmatch(part) or (still_open and spelled and _SPELLING.fullmatch(part)))
+        if not (letter and spelled):
+            count += 1
+            if count > limit:
+                return match.start()
+        spelled = letter
+    return None
+
+
+def truncate_spirit(text):
+    cut = word_limit_cut(text)
+    return " ".join(text[:cut].split()) if cut is not None else " ".join(text.split())
+
+
+_grammar = None
+
+
+def spirit_grammar():
+    """GBNF for the board's answer format, parsed once."""
+    global _grammar
+    if _grammar is None:
+        from llama_cpp import LlamaGrammar
+
+        _grammar = LlamaGrammar.from_string(_SPIRIT_GRAMMAR.format(context=MAX_SPIRIT_WORDS - 1), verbose=False)
+    return _grammar
 
 
 def build_messages(question, history, is_crisis):
@@ -281,12 +1076,7 @@ def build_messages(question, history, is_crisis):
         content = msg.get("content", "").strip()
         if role in ("user", "assistant") and content:
             if role == "assistant":
-                content = " ".join(content.split()[:MAX_SPIRIT_WORDS])
+                content = truncate_spirit(content)
             messages.append({"role": role, "content": content})
     messages.append({"role": "user", "content": question})
     return messages
-
-
-# ── Module Init ───────────────────────────────────────────────
-
-_start_idle_watcher()
@@ -0,0 +1,599 @@
+import re
+import json
+import time
+import zlib
+import heapq
+import logging
+import weakref
+import itertools
+import threading
+from collections import OrderedDict
+
+from pymodules.model_manager import (
+    is_model_downloaded,
+    download_model,
+    ensure_loaded,
+    model_status,
+    classify_message,
+    cached_verdict,
+    verdict_cache,
+    build_messages,
+    word_limit_cut,
+    spirit_grammar,
+    restore_prefix,
+    snapshot_state,
+    truncate_spirit,
+    latency_model,
+    count_tokens,
+    trim_history,
+    history_budget,
+    crisis_history_budget,
+    history_limit_hint,
+    scheduler,
+    start_idle_watcher,
+    InferenceUnavailableError,
+)
+from pymodules import metrics, calibration, variants
+from pymodules.conversations import conversations, configure as configure_conversations
+
+_logger = logging.getLogger("planchette.model")
+
+_SPIRIT_MAX_TOKENS = 33
+_WARMUP_QUESTION = "Is anyone there?"
+_WARMUP_POLL = 5  # secs between checks for the model file while a preload waits on its download
+_WARMUP_BACKOFF = (5, 15, 60, 300)  # secs between warm-up retries after a failure, last value repeats
+_CRISIS_MAX_TOKENS = 10
+
+_REPEAT_TTL = 120  # secs a response stays seen / banned
+_REPEAT_SESSIONS = 1024  # sessions tracked, least recently active dropped first
+_REPEAT_PER_SESSION = 32  # responses tracked per session, soonest to expire dropped first
+_GRAMMAR = False  # constrain spirit answers to the board format
+_BAN_RETRIES = 2  # fresh decodes when an answer still comes out as a banned response
+
+
+# ── SSE Framing ─────────────────────────────────────────────────────────────
+# Compact frames: no space after "data:", no whitespace in the JSON. Consecutive tokens are coalesced into one
+# {"tokens": [...]} frame, flushed after flush_tokens tokens or flush_ms since the oldest buffered one. The first
+# token and every other event go out at once, so time to first token does not move.
+
+
+def sse(event, spaced=False):
+    return f"data:{' ' if spaced else ''}{json.dumps(event, separators=(',', ':'), ensure_ascii=False)}\n\n"
+
+
+class Coalescer:
+    def __init__(self, flush_ms, flush_tokens):
+        self.window = flush_ms / 1000
+        self.limit = max(1, flush_tokens)
+        self.tokens = []
+        self.deadline = None
+        self.started = False
+
+    def push(self, event):
+        """Frames ready to send once `event` has arrived."""
+        if event.keys() != {"token"}:
+            return self.flush() + [event]
+        self.tokens.append(event["token"])
+        if self.deadline is None:
+            self.deadline = time.monotonic() + self.window
+        if not self.started or len(self.tokens) >= self.limit or self.timeout() == 0:
+            self.started = True
+            return self.flush()
+        return []
+
+    def timeout(self):
+        """Seconds until the buffered tokens are due, or None when nothing is buffered."""
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def flush(self):
+        if not self.tokens:
+            return []
+        frame = {"token": self.tokens[0]} if len(self.tokens) == 1 else {"tokens": self.tokens}
+        self.tokens = []
+        self.deadline = None
+        return [frame]
+
+
+def coalesce(events, flush_ms, flush_tokens):
+    """Coalesced frames for a blocking consumer."""
+    coalescer = Coalescer(flush_ms, flush_tokens)
+    for event in events:
+        yield from coalescer.push(event)
+    yield from coalescer.flush()
+
+
+class FrameEncoder:
+    """Frames to bytes, gzip sync-flushed per write when enabled."""
+
+    def __init__(self, gzip=False, spaced=False):
+        self._zip = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+        self._spaced = spaced
+
+    def encode(self, frames):
+        data = "".join(sse(frame, self._spaced) for frame in frames).encode()
+        if self._zip is None or not data:
+            return data
+        return self._zip.compress(data) + self._zip.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self):
+        return self._zip.flush() if self._zip is not None else b""
+
+
+class _Prefetched:
+    def __init__(self, head, rest, events):
+        self._head = head
+        self._rest = rest
+        self._events = events
+
+    def __iter__(self):
+        yield from self._head
+        yield from self._rest
+
+    def close(self):
+        self._events.close()
+
+
+def read_verdict(events):
+    """(crisis, events), reading ahead to the crisis verdict."""
+    head = []
+    rest = iter(events)
+    for event in rest:
+        head.append(event)
+        if event.keys() & {"crisis", "token", "tokens", "done", "error"}:
+            break
+    return any(event.get("crisis") for event in head), _Prefetched(head, rest, events)
+
+
+# ── Anti-repeat ───────────────────────────────────────────────
+
+
+def _normalize_response(text):
+    return re.sub(r"[^A-Z]", "", text.upper())
+
+
+class _SessionRepeats:
+    """Responses one session has seen; the second sighting is banned."""
+
+    def __init__(self):
+        self.entries = {}  # normalized -> (expires_at, text, banned)
+        self.heap = []  # (expires_at, normalized), stale items skipped on pop
+
+    def expire(self, now):
+        while self.heap and self.heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self.heap)
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == expires_at:
+                del self.entries[key]
+
+    def record(self, key, text, now):
+        entry = self.entries.get(key)
+        expires_at = now + _REPEAT_TTL
+        self.entries[key] = (expires_at, text, entry is not None)
+        heapq.heappush(self.heap, (expires_at, key))
+        while len(self.entries) > _REPEAT_PER_SESSION:
+            expires_at, key = heapq.heappop(self.heap)
+            if self.entries.get(key, (None,))[0] == expires_at:
+                del self.entries[key]
+        if len(self.heap) > 4 * _REPEAT_PER_SESSION:
+            self.heap = [(entry[0], k) for k, entry in self.entries.items()]
+            heapq.heapify(self.heap)
+
+
+class RepeatStore:
+    """Per-session anti-repeat memory, bounded in sessions and in responses per session."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # sid -> _SessionRepeats, least recently active first
+
+    def _session(self, sid, now):
+        repeats = self._sessions.get(sid)
+        if repeats is None:
+            repeats = self._sessions[sid] = _SessionRepeats()
+            while len(self._sessions) > _REPEAT_SESSIONS:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(sid)
+        repeats.expire(now)
+        return repeats
+
+    def banned(self, sid):
+        now = time.time()
+        with self._lock:
+            repeats = self._session(sid, now)
+            return [text for _, text, banned in repeats.entries.values() if banned]
+
+    def record(self, sid, text):
+        key = _normalize_response(text)
+        if not key:
+            return
+        now = time.time()
+        with self._lock:
+            self._session(sid, now).record(key, text, now)
+
+
+repeat_store = RepeatStore()
+
+
+_eog_ids = weakref.WeakKeyDictionary()  # Llama -> every end-of-generation token id in its vocabulary
+
+
+def _eog_tokens(llm):
+    """Every end-of-generation token id in llm's vocabulary."""
+    model = getattr(getattr(llm, "engine", None), "llm", None) or llm  # a batch engine session shares its engine's Llama
+    ids = _eog_ids.get(model)
+    if ids is None:
+        try:
+            from llama_cpp import llama_vocab_is_eog
+
+            vocab = model._model.vocab
+            ids = [token for token in range(model.n_vocab()) if llama_vocab_is_eog(vocab, token)]
+        except (ImportError, AttributeError):
+            ids = []
+        ids = sorted(set(ids) | {llm.token_eos()})
+        _eog_ids[model] = ids
+    return ids
+
+
+def _ban_processor(llm, banned):
+    """Logits processor that blocks end-of-generation on a banned response."""
+    import numpy as np
+
+    keys = {_normalize_response(text) for text in banned}
+    eog = _eog_tokens(llm)
+    start = []
+
+    def _process(input_ids, logits):
+        if not start:
+            start.append(len(input_ids))
+        text = llm.detokenize(list(input_ids[start[0] :])).decode("utf-8", errors="ignore")
+        if _normalize_response(text) in keys:
+            logits[eog] = -np.inf
+        return logits
+
+    return _process
+
+
+def _spirit_tokens(llm, messages, crisis, banned=(), stats=None, snapshot=None):
+    """Stream the answer up to MAX_SPIRIT_WORDS, redecoding banned repeats."""
+    from llama_cpp import LogitsProcessorList
+
+    if snapshot is not None:
+        llm.load_state(snapshot[0])
+        cached = snapshot[1]
+    else:
+        restore_prefix(llm, messages[0]["content"])
+        cached = 1
+    prompt_tokens = sum(count_tokens(llm, m["content"]) for m in messages[cached:])
+    max_tokens = _CRISIS_MAX_TOKENS if crisis else _SPIRIT_MAX_TOKENS
+    keys = {_normalize_response(text) for text in banned} if not crisis else set()
+    t_start = time.perf_counter()
+    t_first = None
+    decoded = 0
+    for attempt in range(_BAN_RETRIES + 1):
+        text = ""
+        held = []
+        holding = bool(keys)
+        if stats is not None:
+            stats.pop("tokens_saved", None)
+        stream = llm.create_chat_completion(
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=0.3 if crisis else 0.8,
+            top_p=0.9,
+            repeat_penalty=1.3,
+            frequency_penalty=0.0,
+            stream=True,
+            logits_processor=LogitsProcessorList([_ban_processor(llm, banned)]) if keys else None,
+            grammar=spirit_grammar() if _GRAMMAR and not crisis else None,
+        )
+        for chunk in stream:
+            token = chunk["choices"][0]["delta"].get("content", "")
+            if token:
+                if t_first is None:
+                    t_first = time.perf_counter()
+                decoded += 1
+                cut = word_limit_cut(text + token)
+                if cut is not None:
+                    # This token opens one word too many: keep what precedes it and stop decoding here
+                    stream.close()
+                    token = token[: max(0, cut - len(text))].rstrip()
+                    text += token
+                    if token:
+                        held.append(token)
+                    if stats is not None:
+                        stats["tokens_saved"] = max_tokens - decoded
+                    break
+                text += token
+                held.append(token)
+                # Normalizing only drops characters, so once no banned response starts this way none ever will
+                if holding and any(key.startswith(_normalize_response(text)) for key in keys):
+                    continue
+                holding = False
+                yield from held
+                held = []
+
+        if attempt < _BAN_RETRIES and _normalize_response(text) in keys:
+            _logger.info("Answer came out banned, decoding it again")
+            continue
+        yield from held
+        break
+
+    if stats is not None:
+        stats["decoded"] = decoded
+    if t_first is not None:
+        decode_s = time.perf_counter() - t_first
+        if decoded > 1 and decode_s > 0:
+            metrics.decode_rate.observe((decoded - 1) / decode_s)
+        latency_model.observe(prompt_tokens, (t_first - t_start) * 1000, decoded - 1, (time.perf_counter() - t_first) * 1000)
+
+
+def run_ask(ticket, question, history, check_crisis, speculative=True, sid=None):
+    """The /api/ask pipeline as a stream of event dicts."""
+    with ticket:
+        # Queue Position Reporting
+        position = None
+        while not ticket.wait(timeout=0.5 if position else 0):
+            current = ticket.position()
+            if current != position:
+                position = current
+                yield {"queue": {"position": position, "wait_ms": round(ticket.wait_ms)}}
+        queue_ms = ticket.wait_ms
+
+        llm = ticket.llm
+        if llm is None:
+            yield {"error": "Model not ready"}
+            return
+
+        if sid:
+            history = conversations.resolve(sid, history)
+        crisis_hist = trim_history(llm, history, crisis_history_budget(llm, question))[0] if check_crisis else None
+        full_history = history  # what the verdict cache keys on, whatever the budgets trimmed
+        budget = history_budget(llm, question, _SPIRIT_MAX_TOKENS)
+        kept, history_tokens = trim_history(llm, history, budget)
+        hist_limit = history_limit_hint(kept, history)
+        history = kept
+        banned = repeat_store.banned(sid) if sid else []
+        decode_stats = {}
+        messages = build_messages(question, history, False)
+        snapshot = conversations.snapshot(sid, messages) if sid and conversations.enabled else None
+
+        t_start = time.perf_counter()
+        crisis_result = cached_verdict(question, full_history) if check_crisis else None
+        crisis_ms = 0.0
+        overlap_ms = 0.0
+        tokens = None
+        held = []
+
+        # Speculative Crisis Check: classify on a spare instance while the normal answer decodes,
+        # holding every token back until the classifier has said SAFE
+        helper = scheduler.try_submit() if check_crisis and crisis_result is None and speculative else None
+        if helper is not None:
+            verdict = {}
+
+            def _classify():
+                try:
+                    with helper:
+                        helper.wait(0)
+                        verdict["result"] = classify_message(helper.llm, question, crisis_hist, full_history)
+                finally:
+                    verdict["at"] = time.perf_counter()
+
+            classifier = threading.Thread(target=_classify, daemon=True)
+            classifier.start()
+            tokens = _spirit_tokens(llm, messages, False, banned, decode_stats, snapshot)
+            for token in tokens:
+                held.append(token)
+                if not classifier.is_alive():
+                    break
+            t_held = time.perf_counter()
+            classifier.join()
+
+            crisis_result = verdict.get("result") or {"is_crisis": True, "llm_raw": "ERROR", "score": None}
+            crisis_ms = (verdict["at"] - t_start) * 1000
+            overlap_ms = (min(verdict["at"], t_held) - t_start) * 1000
+            if crisis_result["is_crisis"]:
+                tokens.close()
+                tokens = None
+                held = []
+        elif check_crisis and crisis_result is None:
+            crisis_result = classify_message(llm, question, crisis_hist, full_history)
+            crisis_ms = (time.perf_counter() - t_start) * 1000
+
+        crisis = crisis_result["is_crisis"] if crisis_result else False
+        if crisis:
+            yield {"crisis": True}
+
+        if tokens is None:
+            decode_stats = {}
+            if crisis:
+                messages, snapshot = build_messages(question, history, True), None
+            tokens = _spirit_tokens(llm, messages, crisis, banned, decode_stats, snapshot)
+
+        t_resp = time.perf_counter()
+        ttft_ms = None
+        token_count = 0
+        full_response = []
+        for token in itertools.chain(held, tokens):
+            if ttft_ms is None:
+                ttft_ms = (time.perf_counter() - t_start) * 1000
+            token_count += 1
+            full_response.append(token)
+            yield {"token": token}
+
+        response = "".join(full_response)
+        if not crisis and sid:
+            repeat_store.record(sid, response)
+
+        t_end = time.perf_counter()
+        resp_ms = (t_end - t_resp) * 1000 + overlap_ms
+        total_ms = (t_end - t_start) * 1000
+        perf = {"queue_ms": round(queue_ms), "crisis_ms": round(crisis_ms), "response_ms": round(resp_ms), "ttft_ms": round(ttft_ms or total_ms), "total_ms": round(total_ms), "tokens": token_count, "history_len": len(history), "history_limit": hist_limit, "history_tokens": history_tokens, "history_budget": budget, "repeat_bans": 0 if crisis else len(banned), "tokens_saved": decode_stats.get("tokens_saved", 0), "snapshot_hit": snapshot is not None}
+        _observe(perf, crisis_result, 0 if crisis else len(banned))
+        if helper is not None:
+            perf["overlap_ms"] = round(overlap_ms)
+            perf["speculative_discarded"] = crisis
+        if crisis_result:
+            perf["crisis_input"] = question
+            perf["crisis_llm_raw"] = crisis_result["llm_raw"]
+            perf["crisis_result"] = "CRISIS" if crisis_result["is_crisis"] else "SAFE"
+            if crisis_result.get("score") is not None:
+                perf["crisis_score"] = round(crisis_result["score"], 4)
+            cache_stats = verdict_cache.stats()
+            perf["crisis_cached"] = crisis_result.get("cached", False)
+            perf["crisis_cache_hits"] = cache_stats["hits"]
+            perf["crisis_cache_misses"] = cache_stats["misses"]
+        yield {"done": True, "perf": perf}
+
+        # Snapshot the KV cache at the end of this turn so the next one only evaluates its new messages.
+        # A crisis answer ran on the crisis system prompt, so the session falls back to the shared prefix.
+        if sid:
+            if crisis or not truncate_spirit(response) or not conversations.enabled:
+                conversations.record(sid, question, response)
+            else:
+                prefix = messages + [{"role": "assistant", "content": truncate_spirit(response)}]
+                conversations.record(sid, question, response, prefix, snapshot_state(llm))
+
+
+def _observe(perf, crisis_result, bans):
+    metrics.queue_seconds.observe(perf["queue_ms"] / 1000)
+    metrics.ttft_seconds.observe(perf["ttft_ms"] / 1000)
+    metrics.request_seconds.observe(perf["total_ms"] / 1000)
+    metrics.history_messages.observe(perf["history_len"])
+    metrics.repeat_bans.inc(bans)
+    if crisis_result:
+        verdict = "error" if crisis_result["llm_raw"] == "ERROR" else "crisis" if crisis_result["is_crisis"] else "safe"
+        cached = crisis_result.get("cached", False)
+        metrics.crisis_verdicts.inc(verdict=verdict, cached=str(cached).lower())
+        if not cached:
+            metrics.crisis_seconds.observe(perf["crisis_ms"] / 1000)
+
+
+def configure(cfg):
+    global _REPEAT_TTL, _REPEAT_SESSIONS, _REPEAT_PER_SESSION, _GRAMMAR
+    _REPEAT_TTL = cfg.getint("inference", "repeat_ttl", fallback=_REPEAT_TTL)
+    _REPEAT_SESSIONS = cfg.getint("inference", "repeat_sessions", fallback=_REPEAT_SESSIONS)
+    _REPEAT_PER_SESSION = cfg.getint("inference", "repeat_per_session", fallback=_REPEAT_PER_SESSION)
+    _GRAMMAR = cfg.getboolean("inference", "grammar", fallback=_GRAMMAR)
+    configure_conversations(cfg)
+    variants.configure(cfg)
+
+
+class _Stream:
+    """Event iterator whose close() also frees the ticket."""
+
+    def __init__(self, ticket, events):
+        self._ticket = ticket
+        self._events = events
+
+    def __iter__(self):
+        return self._events
+
+    def close(self):
+        self._events.close()
+        self._ticket.release()
+
+
+class LocalInference:
+    """Runs the ask pipeline in this process, on model_manager.scheduler."""
+
+    def __init__(self, cfg):
+        configure(cfg)
+        self.speculative = cfg.getboolean("inference", "speculative_crisis", fallback=True)
+        self.cfg = cfg
+        self.warm_state = "off"  # off | waiting | calibrating | warming | ready | failed
+
+    def ask(self, question, history, check_crisis, sid=None):
+        if not is_model_downloaded():
+            raise InferenceUnavailableError("Model not ready")
+        ticket = scheduler.submit()
+        return _Stream(ticket, run_ask(ticket, question, history, check_crisis, self.speculative, sid))
+
+    def model_status(self):
+        return model_status()
+
+    def metrics(self):
+        return metrics.registry.render()
+
+    def download(self):
+        if is_model_downloaded():
+            return {"status": "ready"}
+        download_model()
+        return {"status": "downloading"}
+
+    def load(self):
+        if not is_model_downloaded():
+            return {"error": "Model not downloaded"}
+        ensure_loaded()
+        return {"status": "loading"}
+
+    def boot(self, config_path):
+        """Start-up work for the process that owns the model."""
+        start_idle_watcher()
+        if self.cfg.getboolean("inference", "preload", fallback=False) or calibration.due(self.cfg) or variants.auto():
+            self.warm_up(config_path)
+
+    def model_variants(self):
+        return variants.overview()
+
+    def switch_variant(self, name):
+        return variants.request(name)
+
+    def warm_up(self, config_path=None):
+        """Loads the model and runs one crisis-checked ask on a background thread."""
+        self.warm_state = "waiting"
+        threading.Thread(target=self._warm_up, args=(config_path,), daemon=True, name="warm-up").start()
+
+    def _warm_up(self, config_path):
+        while not is_model_downloaded():
+            time.sleep(_WARMUP_POLL)
+        started = time.perf_counter()
+        if config_path and calibration.due(self.cfg):
+            self.warm_state = "calibrating"
+            try:
+                calibration.calibrate(self.cfg, config_path)
+            except Exception as e:
+                _logger.error(f"Calibration failed, keeping the current settings: {e}")
+        failures = 0
+        while True:
+            self.warm_state = "warming"
+            try:
+                self._warm_ask()
+                break
+            except Exception as e:
+                self.warm_state = "failed"
+                delay = _WARMUP_BACKOFF[min(failures, len(_WARMUP_BACKOFF) - 1)]
+                failures += 1
+                _logger.error(f"Warm-up failed: {e}, retrying in {delay}s")
+                time.sleep(delay)
+        self.warm_state = "ready"
+        _logger.warning(f"Model warmed up in {time.perf_counter() - started:.1f}s")
+
+        if variants.auto():
+            # Serves on the current variant meanwhile, a better one may take a download
+            try:
+                active = variants.active()
+                variants.settle()
+                if variants.active() != active:
+                    ensure_loaded()
+            except Exception as e:
+                _logger.error(f"Model variant choice failed: {e}")
+
+    def _warm_ask(self):
+        loader = ensure_loaded()
+        if loader is not None:
+            loader.join()
+        if model_status()["status"] == "error":
+            raise RuntimeError(model_status().get("error"))
+        events = self.ask(_WARMUP_QUESTION, [], True)
+        try:
+            for event in events:
+                if "error" in event:
+                    raise RuntimeError(event["error"])
+        finally:
+            events.close()
+
+    def readiness(self):
+        """Whether to route traffic here, from cached state only."""
+        status = model_status()["status"]
+        return {"ready": status == "ready" and self.warm_state in ("off", "ready"), "model": status, "warm_up": self.warm_state}
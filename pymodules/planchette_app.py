@@ -10,9 +10,13 @@ mimetypes.add_type("text/css", ".css")
 
 from vite_fusion import register_vite_assets
 
-from pymodules.auth import login_manager, load_user_from_hash
-from pymodules.config import has_credentials
-from pymodules.routes import auth_bp, main_bp, api_bp, static_bp
+from pymodules.auth import login_manager, import_legacy_account, configure as configure_auth
+from pymodules.quotas import configure as configure_quotas
+from pymodules.model_manager import configure as configure_inference
+from pymodules.pipeline import LocalInference
+from pymodules.inference_server import RemoteInference, socket_path
+from pymodules.routes import auth_bp, main_bp, api_bp, static_bp, STATIC_DIRS
+from pymodules.static_assets import assets, configure as configure_static
 
 
 def create_app(cfg: configparser.ConfigParser, config_path: str) -> Flask:
@@ -29,8 +33,22 @@ def create_app(cfg: configparser.ConfigParser, config_path: str) -> Flask:
     app.config["CONFIG_PATH"] = config_path
     app.config["CFG"] = cfg
 
+    if cfg.get("inference", "backend", fallback="local") == "socket":
+        app.config["INFERENCE"] = RemoteInference(socket_path(cfg, config_path))
+    else:
+        configure_inference(cfg)
+        app.config["INFERENCE"] = LocalInference(cfg)
+
+    app.config["SSE_FLUSH_MS"] = cfg.getint("server", "sse_flush_ms", fallback=25)
+    app.config["SSE_FLUSH_TOKENS"] = cfg.getint("server", "sse_flush_tokens", fallback=8)
+    app.config["SSE_COMPRESSION"] = cfg.get("server", "sse_compression", fallback="off")
+    app.config["COMPRESS_STREAMS"] = False  # flask-compress buffers the whole body before compressing
     Compress(app)
+    configure_static(cfg)
+    assets.warm(STATIC_DIRS.values())
     login_manager.init_app(app)
+    configure_auth(cfg, config_path)
+    configure_quotas(cfg)
 
     register_vite_assets(
         app,
@@ -49,8 +67,6 @@ def create_app(cfg: configparser.ConfigParser, config_path: str) -> Flask:
     app.register_blueprint(api_bp)
     app.register_blueprint(static_bp)
 
-    if has_credentials(cfg):
-        with app.app_context():
-            load_user_from_hash(cfg.get("auth", "user"), cfg.get("auth", "pw_hash"))
+    import_legacy_account(cfg)
 
     return app
@@ -0,0 +1,114 @@
+import math
+import time
+import threading
+from contextlib import aclosing
+
+from pymodules import metrics
+
+_REQUESTS_PER_MINUTE = 0  # per user, 0 for unmetered
+_TOKENS_PER_MINUTE = 0  # answer tokens decoded per user, 0 for unmetered
+
+
+class QuotaExceededError(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__("The spirit needs to rest, ask again shortly")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Quotas:
+    """Per-user token buckets for /api/ask requests and decoded answer tokens."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}  # username -> [requests, tokens, monotonic time]
+
+    @staticmethod
+    def limits(user):
+        rpm = _REQUESTS_PER_MINUTE if user.requests_per_minute is None else user.requests_per_minute
+        tpm = _TOKENS_PER_MINUTE if user.tokens_per_minute is None else user.tokens_per_minute
+        return rpm, tpm
+
+    def _refill(self, username, rpm, tpm, now):
+        bucket = self._buckets.get(username)
+        if bucket is None:
+            bucket = self._buckets[username] = [rpm, tpm, now]
+        elapsed = now - bucket[2]
+        bucket[0] = min(rpm, bucket[0] + elapsed * rpm / 60)
+        bucket[1] = min(tpm, bucket[1] + elapsed * tpm / 60)
+        bucket[2] = now
+        return bucket
+
+    def admit(self, user):
+        """Takes one request from user's allowance, or raises QuotaExceededError."""
+        rpm, tpm = self.limits(user)
+        if not rpm and not tpm:
+            return
+        with self._lock:
+            bucket = self._refill(user.username, rpm, tpm, time.monotonic())
+            if rpm and bucket[0] < 1:
+                metrics.quota_rejections.inc(reason="requests")
+                raise QuotaExceededError("requests", math.ceil((1 - bucket[0]) * 60 / rpm))
+            if tpm and bucket[1] <= 0:
+                metrics.quota_rejections.inc(reason="tokens")
+                raise QuotaExceededError("tokens", math.floor(-bucket[1] * 60 / tpm) + 1)  # past zero, not onto it
+            if rpm:
+                bucket[0] -= 1
+
+    def refund(self, user):
+        """Gives back the request admit() took, for asks that never started."""
+        rpm, tpm = self.limits(user)
+        if rpm:
+            with self._lock:
+                bucket = self._refill(user.username, rpm, tpm, time.monotonic())
+                bucket[0] = min(rpm, bucket[0] + 1)
+
+    def charge(self, user, tokens):
+        rpm, tpm = self.limits(user)
+        if tpm and tokens:
+            with self._lock:
+                self._refill(user.username, rpm, tpm, time.monotonic())[1] -= tokens
+
+    def metered(self, user, events):
+        """events, charging each answer token to user as it passes."""
+        rpm, tpm = self.limits(user)
+        if not tpm:
+            return events
+        return (_AsyncMetered if hasattr(events, "__aiter__") else _Metered)(events, lambda tokens: self.charge(user, tokens))
+
+
+def _token_count(event):
+    if "token" in event:
+        return 1
+    return len(event.get("tokens") or ())
+
+
+class _Metered:
+    def __init__(self, events, charge):
+        self._events = events
+        self._charge = charge
+
+    def __iter__(self):
+        for event in self._events:
+            self._charge(_token_count(event))
+            yield event
+
+    def close(self):
+        self._events.close()
+
+
+class _AsyncMetered(_Metered):
+    async def __aiter__(self):
+        async with aclosing(aiter(self._events)) as events:
+            async for event in events:
+                self._charge(_token_count(event))
+                yield event
+
+
+quotas = Quotas()
+
+
+def configure(cfg):
+    global _REQUESTS_PER_MINUTE, _TOKENS_PER_MINUTE
+    _REQUESTS_PER_MINUTE = max(0, cfg.getint("inference", "user_requests_per_minute", fallback=_REQUESTS_PER_MINUTE))
+    _TOKENS_PER_MINUTE = max(0, cfg.getint("inference", "user_tokens_per_minute", fallback=_TOKENS_PER_MINUTE))
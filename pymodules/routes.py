@@ -1,7 +1,5 @@
 import os
-import re
-import json
-import time
+import secrets
 from flask import (
     Blueprint,
     Response,
@@ -10,37 +8,23 @@ from flask import (
     redirect,
     url_for,
     flash,
-    send_from_directory,
     current_app,
     jsonify,
+    session,
 )
 from flask_login import login_user, logout_user, login_required, current_user
 
-from pymodules.auth import get_user_by_username, verify_password, register_user, has_users, change_password, change_username
-from pymodules.config import has_credentials, save_credentials, update_credentials
-from pymodules.model_manager import (
-    is_model_downloaded,
-    download_model,
-    download_state,
-    get_llm,
-    ensure_loaded,
-    classify_message,
-    build_messages,
-    adaptive_history_limit,
-    crisis_history_limit,
-    update_timing,
-)
+from pymodules.auth import get_user_by_username, verify_password, register_user, has_users, change_password, change_username, limiter, ThrottledError
+from pymodules.model_manager import QueueFullError, InferenceUnavailableError
+from pymodules.pipeline import coalesce, read_verdict, FrameEncoder
+from pymodules.asgi import STREAM_ENVIRON_KEY
+from pymodules.metrics import http_registry
+from pymodules.quotas import quotas, QuotaExceededError
+from pymodules.static_assets import send_asset, vite_outputs, IMMUTABLE, REVALIDATE, DAILY
 
 
 auth_bp = Blueprint("auth_bp", __name__)
 
-_recent_responses = {}  # Normalized + 120s timestampt
-_response_seen = {}  # Normalized + First Seen
-
-
-def _normalize_response(text):
-    return re.sub(r"[^A-Z]", "", text.upper())
-
 
 @auth_bp.route("/setup", methods=["GET", "POST"])
 def setup():
@@ -59,9 +43,6 @@ def setup():
         elif password != confirm:
             flash("Passwords do not match.", "error")
         else:
-            cfg = current_app.config["CFG"]
-            config_path = current_app.config["CONFIG_PATH"]
-            save_credentials(config_path, cfg, username, password)
             register_user(username, password)
             flash("Account created. Log in below.", "success")
             return redirect(url_for("auth_bp.login"))
@@ -80,9 +61,15 @@ def login():
     if request.method == "POST":
         username = request.form.get("username", "").strip()
         password = request.form.get("password", "")
-        user = get_user_by_username(username)
-
-        if user and verify_password(user, password):
+        try:
+            limiter.acquire(request.remote_addr, username)
+            user = get_user_by_username(username)
+            ok = user is not None and verify_password(user, password)
+        except ThrottledError as e:
+            flash("Too many attempts. Try again shortly.", "error")
+            return render_template("login.html"), 429, {"Retry-After": str(e.retry_after)}
+
+        if ok:
             login_user(user)
             next_page = request.args.get("next")
             return redirect(next_page or url_for("main_bp.index"))
@@ -107,35 +94,85 @@ def index():
     return render_template("index.html")
 
 
+@main_bp.route("/metrics")
+def metrics():
+    """Prometheus scrape target: loopback, or the metrics_token bearer."""
+    token = current_app.config["CFG"].get("server", "metrics_token", fallback="")
+    if token:
+        if not secrets.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+            return Response("Unauthorized\n", 401, {"WWW-Authenticate": "Bearer"}, mimetype="text/plain")
+    elif request.remote_addr not in ("127.0.0.1", "::1"):
+        return Response("Forbidden\n", 403, mimetype="text/plain")
+    try:
+        text = current_app.config["INFERENCE"].metrics() + http_registry.render()
+    except InferenceUnavailableError as e:
+        return Response(f"{e}\n", 503, mimetype="text/plain")
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
+
+@main_bp.route("/healthz")
+def healthz():
+    """Liveness of the web process only, never the model."""
+    return Response("ok\n", mimetype="text/plain", headers={"Cache-Control": "no-store"})
+
+
+@main_bp.route("/readyz")
+def readyz():
+    """Readiness: 200 once the model is loaded (and warmed up), else 503."""
+    try:
+        state = current_app.config["INFERENCE"].readiness()
+    except InferenceUnavailableError as e:
+        state = {"ready": False, "error": str(e)}
+    return jsonify(state), 200 if state["ready"] else 503, {"Cache-Control": "no-store"}
+
+
 api_bp = Blueprint("api_bp", __name__, url_prefix="/api")
 
 
+@api_bp.errorhandler(InferenceUnavailableError)
+def inference_unavailable(e):
+    return jsonify({"error": str(e)}), 503
+
+
+@api_bp.errorhandler(ThrottledError)
+def throttled(e):
+    return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
+
+
 @api_bp.route("/model/status")
 @login_required
 def model_status():
-    if download_state["status"] == "loading":
-        return jsonify({"status": "loading", "progress": 1.0})
-    if is_model_downloaded() and download_state["status"] != "error":
-        return jsonify({"status": "ready", "progress": 1.0})
-    return jsonify(download_state)
+    return jsonify(current_app.config["INFERENCE"].model_status())
 
 
 @api_bp.route("/model/download", methods=["POST"])
 @login_required
 def model_download():
-    if is_model_downloaded():
-        return jsonify({"status": "ready"})
-    download_model()
-    return jsonify({"status": "downloading"})
+    return jsonify(current_app.config["INFERENCE"].download())
 
 
 @api_bp.route("/model/load", methods=["POST"])
 @login_required
 def model_load():
-    if not is_model_downloaded():
-        return jsonify({"error": "Model not downloaded"}), 400
-    ensure_loaded()
-    return jsonify({"status": "loading"})
+    result = current_app.config["INFERENCE"].load()
+    if "error" in result:
+        return jsonify(result), 400
+    return jsonify(result)
+
+
+@api_bp.route("/model/variants")
+@login_required
+def model_variants():
+    return jsonify(current_app.config["INFERENCE"].model_variants())
+
+
+@api_bp.route("/model/variant", methods=["POST"])
+@login_required
+def model_variant():
+    result = current_app.config["INFERENCE"].switch_variant(str((request.get_json(silent=True) or {}).get("variant", "")))
+    if "error" in result:
+        return jsonify(result), 400
+    return jsonify(result)
 
 
 @api_bp.route("/ask", methods=["POST"])
@@ -146,95 +183,58 @@ def ask():
     if not question:
         return jsonify({"error": "Empty question"}), 400
 
-    llm = get_llm()
-    if llm is None:
-        return jsonify({"error": "Model not ready"}), 503
-
     history = (data or {}).get("history", [])
-
     check_crisis = (data or {}).get("checkCrisis", False)
-    t_crisis = time.perf_counter()
-    crisis_hist = history[-crisis_history_limit() :] if check_crisis else None
-    crisis_result = classify_message(llm, question, crisis_hist) if check_crisis else None
-    crisis = crisis_result["is_crisis"] if crisis_result else False
-    crisis_ms = (time.perf_counter() - t_crisis) * 1000
-
-    hist_limit = adaptive_history_limit()
-    history = history[-hist_limit:]
-
-    # Anti-repeat Cleanup Logic
-    now = time.time()
-    for cache in (_recent_responses, _response_seen):
-        expired = [k for k, t in cache.items() if now - t > 120]
-        for k in expired:
-            del cache[k]
-
-    if not crisis:
-        filtered = []
-        for msg in history:
-            if msg.get("role") == "assistant":
-                key = _normalize_response(msg.get("content", ""))
-                if key in _recent_responses:
-                    if filtered and filtered[-1].get("role") == "user":
-                        filtered.pop()
-                    continue
-            filtered.append(msg)
-        history = filtered
-    messages = build_messages(question, history, crisis)
-
-    max_tokens = 10 if crisis else 33
-    temperature = 0.3 if crisis else 0.8
+    if "sid" not in session:
+        session["sid"] = secrets.token_hex(16)
+
+    user = current_user._get_current_object()  # the stream outlives the request context
+    try:
+        quotas.admit(user)
+    except QuotaExceededError as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
+    try:
+        events = current_app.config["INFERENCE"].ask(question, history, check_crisis, session["sid"])
+    except QueueFullError as e:
+        quotas.refund(user)
+        return jsonify({"error": "The spirit is busy, try again shortly"}), 429, {"Retry-After": str(e.retry_after)}
+    except InferenceUnavailableError:
+        quotas.refund(user)
+        raise
+
+    return _event_stream(quotas.metered(user, events), current_app.config["SSE_COMPRESSION"], request.headers.get("X-Stream") != "events")
+
+
+def _event_stream(events, compression, legacy=False):
+    """SSE response for `events`; compression is "flush" or "off"."""
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Vary": "Accept-Encoding"}
+    gzip = compression == "flush" and request.accept_encodings["gzip"] > 0
+    if gzip:
+        headers["Content-Encoding"] = "gzip"  # also keeps flask-compress off this response
+    if legacy:
+        # Clients built before the crisis event: verdict in a header, one token per "data: " frame
+        crisis, events = read_verdict(events)
+        headers["X-Crisis"] = str(crisis).lower()
+
+    # Under the ASGI front end the event loop streams the body, not this worker thread
+    holder = request.environ.get(STREAM_ENVIRON_KEY)
+    if holder is not None:
+        holder["events"] = events
+        holder["gzip"] = gzip
+        holder["legacy"] = legacy
+        return Response(mimetype="text/event-stream", headers=headers)
+
+    flush_ms, flush_tokens = current_app.config["SSE_FLUSH_MS"], 1 if legacy else current_app.config["SSE_FLUSH_TOKENS"]
 
     def generate():
-        t_resp = time.perf_counter()
-        token_count = 0
-        full_response = []
-        llm.reset()
-        stream = llm.create_chat_completion(
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            top_p=0.9,
-            repeat_penalty=1.3,
-            frequency_penalty=0.0,
-            stream=True,
-        )
-        try:
-            for chunk in stream:
-                delta = chunk["choices"][0]["delta"]
-                token = delta.get("content", "")
-                if token:
-                    token_count += 1
-                    full_response.append(token)
-                    yield f"data: {json.dumps({'token': token})}\n\n"
-
-            # Anti-repeat Ban Logic
-            if not crisis:
-                full_text = "".join(full_response)
-                resp_key = _normalize_response(full_text)
-                if resp_key:
-                    if resp_key in _response_seen:
-                        _recent_responses[resp_key] = time.time()
-                    else:
-                        _response_seen[resp_key] = time.time()
-
-            resp_ms = (time.perf_counter() - t_resp) * 1000
-            total_ms = crisis_ms + resp_ms
-            update_timing(total_ms)
-            perf = {"crisis_ms": round(crisis_ms), "response_ms": round(resp_ms), "total_ms": round(total_ms), "tokens": token_count, "history_len": len(history), "history_limit": hist_limit}
-            if crisis_result:
-                perf["crisis_input"] = question
-                perf["crisis_llm_raw"] = crisis_result["llm_raw"]
-                perf["crisis_result"] = "CRISIS" if crisis_result["is_crisis"] else "SAFE"
-            yield f"data: {json.dumps({'done': True, 'perf': perf})}\n\n"
-        except GeneratorExit:
-            return
-
-    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
-    if crisis:
-        headers["X-Crisis"] = "true"
-
-    return Response(generate(), mimetype="text/event-stream", headers=headers)
+        encoder = FrameEncoder(gzip, legacy)
+        for frame in coalesce(events, flush_ms, flush_tokens):
+            yield encoder.encode([frame])
+        yield encoder.close()
+
+    response = Response(generate(), mimetype="text/event-stream", headers=headers)
+    response.call_on_close(events.close)
+    return response
 
 
 @api_bp.route("/account/me")
@@ -259,6 +259,7 @@ def account_settings():
         return jsonify({"error": "Nothing to change."}), 400
 
     if wants_password:
+        limiter.acquire(request.remote_addr, current_user.username)
         if not verify_password(current_user, current_pw):
             return jsonify({"error": "Current password is incorrect."}), 400
         if not new_pw:
@@ -268,6 +269,8 @@ def account_settings():
 
     user = current_user
     if wants_username:
+        if get_user_by_username(new_username) is not None:
+            return jsonify({"error": "That username is taken."}), 400
         user = change_username(current_user.username, new_username)
         if user is None:
             return jsonify({"error": "User not found."}), 400
@@ -275,26 +278,27 @@ def account_settings():
     if wants_password:
         change_password(user, new_pw)
 
-    cfg = current_app.config["CFG"]
-    config_path = current_app.config["CONFIG_PATH"]
-    update_credentials(config_path, cfg, user.username, user.pw_hash.decode())
     return jsonify({"ok": True})
 
 
 _PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_DIRS = {"static": os.path.join(_PROJECT_ROOT, "src", "static"), "dist": os.path.join(_PROJECT_ROOT, "src", "dist"), "data": os.path.join(_PROJECT_ROOT, "__data__")}
 static_bp = Blueprint("static_bp", __name__)
 
 
 @static_bp.route("/src/static/<path:path>")
 def serve_static(path):
-    return send_from_directory(os.path.join(_PROJECT_ROOT, "src", "static"), path)
+    return send_asset(STATIC_DIRS["static"], path, REVALIDATE)
 
 
 @static_bp.route("/src/dist/<path:path>")
 def serve_dist(path):
-    return send_from_directory(os.path.join(_PROJECT_ROOT, "src", "dist"), path)
+    # Only `npm run build` (vite build) may write under dist/: its file names are content hashes, which is what
+    # makes a year of immutable caching safe. Editing one in place would leave browsers on the old copy, so only
+    # files the current manifest lists get IMMUTABLE; anything else revalidates.
+    return send_asset(STATIC_DIRS["dist"], path, IMMUTABLE if path in vite_outputs(STATIC_DIRS["dist"]) else REVALIDATE)
 
 
 @static_bp.route("/__data__/<path:path>")
 def serve_data(path):
-    return send_from_directory(os.path.join(_PROJECT_ROOT, "__data__"), path)
+    return send_asset(STATIC_DIRS["data"], path, DAILY)
@@ -0,0 +1,211 @@
+import os
+import gzip
+import json
+import queue
+import hashlib
+import mimetypes
+import threading
+from collections import OrderedDict
+
+from flask import Response, abort, request, send_file
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # flask-compress brings it along, but only on CPython
+    brotli = None
+
+_CACHE_BUDGET = 64 * 1024 * 1024  # bytes of file bodies and compressed variants held in memory
+_CACHE_FILE_MAX = 2 * 1024 * 1024  # bodies of larger files are streamed from disk instead
+_PRECOMPRESS = True
+_MIN_COMPRESS = 500  # bytes, flask-compress's COMPRESS_MIN_SIZE
+_COMPRESSIBLE = {"text/html", "text/css", "text/plain", "text/xml", "text/javascript", "application/javascript", "application/json", "application/manifest+json", "application/xml", "image/svg+xml", "image/x-icon"}
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+DAILY = "public, max-age=86400"
+
+
+class _Asset:
+    """One file as last seen on disk, with its cached bodies."""
+
+    def __init__(self, path, stat, etag, body):
+        self.path = path
+        self.key = (stat.st_mtime_ns, stat.st_size)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.etag = etag
+        self.body = body
+        self.variants = {}  # content coding -> bytes, filled in by the compressor thread
+
+    @property
+    def compressible(self):
+        return self.mimetype in _COMPRESSIBLE and self.size >= _MIN_COMPRESS
+
+    @property
+    def nbytes(self):
+        return len(self.body or b"") + sum(len(v) for v in self.variants.values())
+
+
+class AssetCache:
+    """Content-hash ETags, hot file bodies and precompressed text assets."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._assets = OrderedDict()  # path -> _Asset, least recently served first
+        self._bytes = 0
+        self._queue = queue.Queue()
+        self._worker = None
+
+    def get(self, path):
+        """The _Asset for path, or None when it is not a regular file."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        with self._lock:
+            asset = self._assets.get(path)
+            if asset is not None and asset.key == (stat.st_mtime_ns, stat.st_size):
+                self._assets.move_to_end(path)
+                return asset
+
+        asset = self._load(path, stat)
+        with self._lock:
+            old = self._assets.pop(path, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._assets[path] = asset
+            self._bytes += asset.nbytes
+            self._evict()
+        if _PRECOMPRESS and asset.compressible:
+            self._enqueue(asset)
+        return asset
+
+    def warm(self, directories):
+        """Index every file under directories and queue text assets for compression."""
+        threading.Thread(target=self._warm, args=(directories,), daemon=True, name="static-warm").start()
+
+    def stats(self):
+        with self._lock:
+            return {"files": len(self._assets), "bytes": self._bytes, "compressed": sum(1 for a in self._assets.values() if a.variants)}
+
+    def _warm(self, directories):
+        for directory in directories:
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    self.get(os.path.join(root, name))
+
+    def _load(self, path, stat):
+        digest = hashlib.blake2b(digest_size=16)
+        chunks = []
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                digest.update(chunk)
+                if stat.st_size <= _CACHE_FILE_MAX:
+                    chunks.append(chunk)
+        return _Asset(path, stat, digest.hexdigest(), b"".join(chunks) if stat.st_size <= _CACHE_FILE_MAX else None)
+
+    def _evict(self):
+        while self._bytes > _CACHE_BUDGET and len(self._assets) > 1:
+            _, asset = self._assets.popitem(last=False)
+            self._bytes -= asset.nbytes
+
+    def _enqueue(self, asset):
+        self._queue.put(asset)
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._compress_loop, daemon=True, name="static-compress")
+                    self._worker.start()
+
+    def _compress_loop(self):
+        while True:
+            asset = self._queue.get()
+            with self._lock:
+                if self._assets.get(asset.path) is not asset or asset.variants:
+                    continue
+            data = asset.body
+            if data is None:
+                try:
+                    with open(asset.path, "rb") as f:
+                        data = f.read()
+                except OSError:
+                    continue
+            variants = {"gzip": gzip.compress(data, 9, mtime=0)}
+            if brotli is not None:
+                variants["br"] = brotli.compress(data, mode=brotli.MODE_TEXT, quality=11)
+            variants = {coding: v for coding, v in variants.items() if len(v) < len(data) * 0.9}
+            with self._lock:
+                if self._assets.get(asset.path) is asset:
+                    asset.variants = variants
+                    self._bytes += sum(len(v) for v in variants.values())
+                    self._evict()
+
+
+assets = AssetCache()
+
+
+def _coding(asset):
+    for coding in ("br", "gzip"):
+        if coding in asset.variants and request.accept_encodings[coding] > 0:
+            return coding
+    return None
+
+
+def send_asset(directory, path, cache_control):
+    """The file at path with a content-hash ETag and a precompressed body."""
+    full = safe_join(directory, path)
+    asset = assets.get(full) if full is not None else None
+    if asset is None:
+        abort(404)
+
+    coding = _coding(asset)
+    if coding is None and asset.body is None:
+        response = send_file(full, mimetype=asset.mimetype, etag=asset.etag, last_modified=asset.mtime, conditional=True)
+    else:
+        response = Response(asset.body if coding is None else asset.variants[coding], mimetype=asset.mimetype)
+        response.set_etag(asset.etag if coding is None else f"{asset.etag}-{coding}")
+        response.last_modified = asset.mtime
+        if coding is not None:
+            response.headers["Content-Encoding"] = coding  # also keeps flask-compress off this response
+        ranged = coding is None and not asset.compressible  # a ranged text body would still meet flask-compress
+        response.make_conditional(request, accept_ranges=ranged, complete_length=asset.size if ranged else None)
+    response.headers["Cache-Control"] = cache_control
+    if asset.compressible:
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+_built = {"key": None, "files": frozenset()}
+
+
+def vite_outputs(dist_dir):
+    """Files the last `vite build` wrote into dist_dir, per its manifest."""
+    path = os.path.join(dist_dir, ".vite", "manifest.json")
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return frozenset()
+    key = (stat.st_mtime_ns, stat.st_size)
+    if _built["key"] != key:
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        files = set()
+        for chunk in manifest.values():
+            files.add(chunk.get("file"))
+            files.update(chunk.get("css", ()))
+            files.update(chunk.get("assets", ()))
+        _built.update(key=key, files=frozenset(f for f in files if f))
+    return _built["files"]
+
+
+def configure(cfg):
+    global _CACHE_BUDGET, _PRECOMPRESS
+    _CACHE_BUDGET = cfg.getint("server", "static_cache_mb", fallback=_CACHE_BUDGET // 1048576) * 1048576
+    _PRECOMPRESS = cfg.getboolean("server", "static_precompress", fallback=True)
@@ -0,0 +1,89 @@
+import os
+import time
+import sqlite3
+import threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    pw_hash BLOB NOT NULL,
+    created REAL NOT NULL,
+    requests_per_minute INTEGER,
+    tokens_per_minute INTEGER
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def default_path(config_path: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(config_path)), "planchette-users.db")
+
+
+class UserStore:
+    """Accounts in SQLite, looked up by username."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def get(self, username: str) -> sqlite3.Row | None:
+        with self._lock:
+            return self._db.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+
+    def add(self, username: str, pw_hash: bytes) -> bool:
+        """False when the username is taken."""
+        try:
+            with self._lock:
+                self._db.execute("INSERT INTO users (username, pw_hash, created) VALUES (?, ?, ?)", (username, pw_hash, time.time()))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def remove(self, username: str) -> bool:
+        with self._lock:
+            return self._db.execute("DELETE FROM users WHERE username = ?", (username,)).rowcount > 0
+
+    def set_hash(self, username: str, pw_hash: bytes) -> None:
+        with self._lock:
+            self._db.execute("UPDATE users SET pw_hash = ? WHERE username = ?", (pw_hash, username))
+
+    def rename(self, old: str, new: str) -> bool:
+        """False when old does not exist or new is taken."""
+        try:
+            with self._lock:
+                return self._db.execute("UPDATE users SET username = ? WHERE username = ?", (new, old)).rowcount > 0
+        except sqlite3.IntegrityError:
+            return False
+
+    def set_quota(self, username: str, requests_per_minute: int | None, tokens_per_minute: int | None) -> bool:
+        with self._lock:
+            return self._db.execute("UPDATE users SET requests_per_minute = ?, tokens_per_minute = ? WHERE username = ?", (requests_per_minute, tokens_per_minute, username)).rowcount > 0
+
+    def usernames(self) -> list[str]:
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT username FROM users ORDER BY created")]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def get_meta(self, key: str) -> str | None:
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,210 @@
+import os
+import json
+import logging
+import threading
+
+from pymodules import model_manager, calibration
+from pymodules.model_manager import MODEL_VARIANTS, variant_path, variant_sha256, use_variant, switch_model, fetch_variant
+
+_logger = logging.getLogger("planchette.model")
+
+_AUTO = False  # [model] variant = auto
+_TARGET_MS = 60.0  # decode ms/token the auto choice has to meet
+_MEMORY_BUDGET = 0  # bytes for weights and instances, 0: half the memory limit
+_CONTEXT_MB = 256  # KV cache and compute buffers of one pooled instance at n_ctx 2048
+_STATE_FILE = "variants.json"  # in MODEL_DIR: measurements on this hardware and the auto choice
+
+fetch_state = {"variant": None, "progress": 0.0, "error": None}
+_busy = threading.Lock()  # one fetch or switch at a time
+
+
+# ── Measurements ─────────────────────────────────────────────
+
+
+def _state_path():
+    return os.path.join(model_manager.MODEL_DIR, _STATE_FILE)
+
+
+def _load():
+    try:
+        with open(_state_path()) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("hardware") != calibration.hardware_fingerprint():
+        return {"active": data.get("active")}  # measured on other hardware, only the choice carries over
+    return data
+
+
+def _save(**changes):
+    data = {**_load(), **changes, "hardware": calibration.hardware_fingerprint()}
+    tmp = _state_path() + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, _state_path())
+    except OSError as e:
+        _logger.error(f"Could not save {_STATE_FILE}: {e}")
+
+
+def measurements():
+    """{variant: decode ms/token} measured on this hardware."""
+    return dict(_load().get("ms_per_token", {}))
+
+
+def measure(name):
+    """Times one variant the way a pooled instance runs it and records it."""
+    n_threads, n_threads_batch = model_manager.scheduler.threads_per_instance()
+    with model_manager.scheduler.drained():
+        ms = calibration.measure(n_threads, n_threads_batch, model_manager._N_BATCH, variant_path(name))[1]
+    _save(ms_per_token={**measurements(), name: round(ms, 2)})
+    _logger.warning(f"Model variant {name}: {ms:.1f} ms/token")
+    return ms
+
+
+# ── Choice ───────────────────────────────────────────────────
+
+
+def on_disk(name):
+    return os.path.isfile(variant_path(name))
+
+
+def size(name):
+    try:
+        return os.path.getsize(variant_path(name))
+    except OSError:
+        return MODEL_VARIANTS[name]["size_mb"] * 1048576
+
+
+def footprint(name):
+    """Bytes for the weights plus every pooled instance's context."""
+    return size(name) + model_manager.scheduler.slots * _CONTEXT_MB * 1048576
+
+
+def memory_budget():
+    if _MEMORY_BUDGET:
+        return _MEMORY_BUDGET
+    total = model_manager.memory_total()
+    return total // 2 if total else None
+
+
+def choose(measured):
+    """The best variant within the memory budget and the ms/token target."""
+    if not measured:
+        return None
+    reference = model_manager.active_variant if model_manager.active_variant in measured else next(iter(measured))
+    budget = memory_budget()
+    fits = [name for name in MODEL_VARIANTS if budget is None or footprint(name) <= budget] or [next(iter(MODEL_VARIANTS))]
+
+    def speed(name):
+        return measured.get(name, measured[reference] * size(name) / size(reference))
+
+    meets = [name for name in fits if speed(name) <= _TARGET_MS]
+    return meets[-1] if meets else min(fits, key=speed)
+
+
+def auto():
+    return _AUTO
+
+
+def active():
+    return model_manager.active_variant
+
+
+def settle():
+    """Auto mode, blocking: measures variants until choose() stops moving."""
+    with _busy:
+        measured = measurements()
+        if model_manager.active_variant not in measured:
+            measured[model_manager.active_variant] = measure(model_manager.active_variant)
+        for _ in MODEL_VARIANTS:
+            choice = choose(measured)
+            if choice == model_manager.active_variant:
+                return
+            if choice in measured and on_disk(choice):
+                _switch(choice)
+                return
+            if not on_disk(choice):
+                _fetch(choice)
+            measured[choice] = measure(choice)
+
+
+# ── Switching ────────────────────────────────────────────────
+
+
+def _fetch(name):
+    def _progress(downloaded, total, speed, eta):
+        fetch_state["progress"] = downloaded / total if total else 0.0
+
+    fetch_state.update(variant=name, progress=0.0, error=None)
+    try:
+        fetch_variant(name, _progress)
+    except Exception as e:
+        fetch_state.update(error=str(e))
+        raise
+    finally:
+        fetch_state["variant"] = None
+
+
+def _switch(name):
+    switch_model(name)
+    _save(active=name)
+
+
+def request(name):
+    """Switches to variant name in the background, downloading it first."""
+    if name not in MODEL_VARIANTS:
+        return {"error": f"Unknown variant {name!r}"}
+    if name == model_manager.active_variant:
+        return {"status": "ready"}
+    if not _busy.acquire(blocking=False):
+        return {"error": "A variant change is already in progress"}
+    status = "switching" if on_disk(name) else "downloading"
+
+    def _run():
+        try:
+            if not on_disk(name):
+                _fetch(name)
+                measure(name)
+            _switch(name)
+        except Exception as e:
+            _logger.error(f"Could not switch to model variant {name}: {e}")
+        finally:
+            _busy.release()
+
+    threading.Thread(target=_run, daemon=True, name="variant-switch").start()
+    return {"status": status}
+
+
+def overview():
+    measured = measurements()
+    budget = memory_budget()
+    return {
+        "active": model_manager.active_variant,
+        "mode": "auto" if _AUTO else "pinned",
+        "target_ms_per_token": _TARGET_MS,
+        "memory_budget_mb": budget // 1048576 if budget else None,
+        "fetching": dict(fetch_state),
+        "variants": [
+            {"name": name, "size_mb": round(size(name) / 1048576), "sha256": variant_sha256(name), "on_disk": on_disk(name), "ms_per_token": measured.get(name), "fits": budget is None or footprint(name) <= budget}
+            for name in MODEL_VARIANTS
+        ],
+    }
+
+
+def configure(cfg):
+    """[model] variant: a registry name to pin it, or auto."""
+    global _AUTO, _TARGET_MS, _MEMORY_BUDGET
+    setting = cfg.get("model", "variant", fallback="Q4_K_M").strip()
+    _AUTO = setting.lower() == "auto"
+    _TARGET_MS = cfg.getfloat("model", "target_ms_per_token", fallback=_TARGET_MS)
+    budget = cfg.get("model", "memory_budget_mb", fallback="auto").strip().lower()
+    _MEMORY_BUDGET = 0 if budget in ("", "auto") else int(budget) * 1048576
+
+    name = _load().get("active") if _AUTO else setting.upper()
+    if name not in MODEL_VARIANTS:
+        if not _AUTO:
+            _logger.error(f"Unknown model variant {setting!r}, keeping {model_manager.active_variant}")
+        return
+    if name != model_manager.active_variant and (on_disk(name) or not _AUTO):
+        use_variant(name)  # a pinned variant not on disk yet is what the board's download button fetches
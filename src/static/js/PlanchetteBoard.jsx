@@ -68,7 +68,7 @@ function lettersOf(str) {
 async function streamQuestion(question, { onToken, onDone, onCrisis, signal, history }) {
   const resp = await fetch("/api/ask", {
     method: "POST",
-    headers: { "Content-Type": "application/json" },
+    headers: { "Content-Type": "application/json", "X-Stream": "events" },
     body: JSON.stringify({ question, history, checkCrisis: shouldCheckCrisis(question) }),
     signal,
   });
@@ -79,8 +79,6 @@ async function streamQuestion(question, { onToken, onDone, onCrisis, signal, his
     throw new Error(data.error || "Unknown error");
   }
 
-  if (resp.headers.get("X-Crisis") === "true") onCrisis();
-
   const reader = resp.body.getReader();
   const decoder = new TextDecoder();
   let buf = "";
@@ -93,19 +91,22 @@ async function streamQuestion(question, { onToken, onDone, onCrisis, signal, his
     const lines = buf.split("\n");
     buf = lines.pop() || "";
     for (const line of lines) {
-      if (!line.startsWith("data: ")) continue;
+      if (!line.startsWith("data:")) continue;
+      let data;
       try {
-        const data = JSON.parse(line.slice(6));
-        if (data.done) {
-          onDone(fullAnswer, data.perf || null);
-          return;
-        }
-        if (data.token) {
-          fullAnswer += data.token;
-          onToken(data.token, fullAnswer);
-        }
+        data = JSON.parse(line.slice(5));
       } catch {
-        /* skip */
+        continue;
+      }
+      if (data.error) throw new Error(data.error);
+      if (data.crisis) onCrisis();
+      if (data.done) {
+        onDone(fullAnswer, data.perf || null);
+        return;
+      }
+      for (const token of data.tokens || (data.token ? [data.token] : [])) {
+        fullAnswer += token;
+        onToken(token, fullAnswer);
       }
     }
   }
@@ -0,0 +1,63 @@
+import unittest
+from unittest import mock
+
+from pymodules import auth
+from pymodules.auth import AttemptLimiter, ThrottledError
+
+
+class AttemptLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch.object(auth, "time", mock.Mock(monotonic=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limiter = AttemptLimiter()
+
+    def _burst(self, ip, username):
+        for _ in range(auth._LOGIN_BURST):
+            self.limiter.acquire(ip, username)
+
+    def test_address_is_throttled_across_usernames(self):
+        for n in range(auth._LOGIN_BURST):
+            self.limiter.acquire("10.0.0.1", f"user{n}")
+        with self.assertRaises(ThrottledError) as caught:
+            self.limiter.acquire("10.0.0.1", "someone-else")
+        self.assertEqual(caught.exception.reason, "ip")
+        self.assertEqual(caught.exception.retry_after, 12)  # one token at 5 a minute
+        self.limiter.acquire("10.0.0.2", "someone-else")
+
+    def test_username_is_throttled_across_addresses(self):
+        for n in range(auth._LOGIN_BURST):
+            self.limiter.acquire(f"10.0.0.{n}", "Admin")
+        with self.assertRaises(ThrottledError) as caught:
+            self.limiter.acquire("10.0.1.1", "admin")
+        self.assertEqual(caught.exception.reason, "user")
+
+    def test_rejection_takes_no_token(self):
+        self._burst("10.0.0.1", "admin")
+        self.assertRaises(ThrottledError, self.limiter.acquire, "10.0.0.9", "admin")
+        self.limiter.acquire("10.0.0.9", "other")  # the address bucket was not charged for the rejection
+
+    def test_refill(self):
+        self._burst("10.0.0.1", "admin")
+        self.now += 11
+        self.assertRaises(ThrottledError, self.limiter.acquire, "10.0.0.1", "admin")
+        self.now += 1
+        self.limiter.acquire("10.0.0.1", "admin")
+
+    def test_buckets_are_bounded(self):
+        with mock.patch.object(auth, "_BUCKETS_MAX", 2):
+            self._burst("10.0.0.1", "admin")
+            self.limiter.acquire("10.0.0.2", "b")
+            self.limiter.acquire("10.0.0.3", "c")
+            self.limiter.acquire("10.0.0.1", "d")  # its spent bucket was forgotten
+        self.assertLessEqual(len(self.limiter._buckets["ip"]), 2)
+
+    def test_clear(self):
+        self._burst("10.0.0.1", "admin")
+        self.limiter.clear()
+        self.limiter.acquire("10.0.0.1", "admin")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+import configparser
+from unittest import mock
+
+from pymodules import calibration, model_manager
+from pymodules.model_manager import configure, scheduler
+
+
+def _timings(n_threads, n_threads_batch, n_batch, model_path=None):
+    """8 threads and n_batch 256 are fastest."""
+    return abs(n_threads_batch - 8) + 1 + abs(n_batch - 256) / 1000, abs(n_threads - 8) + 1
+
+
+class CalibrationSplitTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.config_path = os.path.join(self.dir.name, "planchette.ini")
+        self.cfg = configparser.ConfigParser()
+        self.cfg.read_dict({"inference": {"pool_size": "auto", "engine": "pool"}, "model": {"calibrate": "auto"}})
+        saved = {name: getattr(model_manager, name) for name in ("_N_THREADS", "_N_THREADS_BATCH", "_N_BATCH", "_ENGINE")}
+        self.addCleanup(lambda: [setattr(model_manager, name, value) for name, value in saved.items()])
+        self.addCleanup(setattr, scheduler, "slots", scheduler.slots)
+        self.addCleanup(setattr, scheduler, "engine", scheduler.engine)
+        for patcher in (
+            mock.patch.object(model_manager, "usable_cpus", return_value=16),
+            mock.patch.object(model_manager, "is_model_downloaded", return_value=True),
+            mock.patch.object(calibration, "measure", side_effect=_timings),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_auto_pool_is_resized_to_the_calibrated_threads(self):
+        configure(self.cfg)
+        self.assertEqual(scheduler.slots, 3)  # 15 of 16 cores at 4 threads per instance
+
+        calibration.calibrate(self.cfg, self.config_path, report=lambda line: None)
+
+        self.assertEqual((self.cfg.get("model", "n_threads"), self.cfg.get("model", "n_batch")), ("8", "256"))
+        self.assertEqual(scheduler.slots, 2)
+        self.assertEqual(scheduler.threads_per_instance(), (4, 4))
+
+    def test_pinned_pool_size_is_kept(self):
+        self.cfg.set("inference", "pool_size", "4")
+        configure(self.cfg)
+
+        calibration.calibrate(self.cfg, self.config_path, report=lambda line: None)
+
+        self.assertEqual(scheduler.slots, 4)
+        self.assertEqual(scheduler.threads_per_instance(), (2, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
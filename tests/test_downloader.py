@@ -0,0 +1,119 @@
+import os
+import hashlib
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from urllib.error import HTTPError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pymodules import downloader
+from pymodules.downloader import Download, ChecksumError
+
+_PAYLOAD = os.urandom(64 * 1024 + 123)
+_SHA256 = hashlib.sha256(_PAYLOAD).hexdigest()
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    """Serves _PAYLOAD with single byte-range support and counts the bytes it sends."""
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.path.endswith("/missing.gguf"):
+            self.send_error(404)
+            return
+        start, end = 0, len(_PAYLOAD) - 1
+        spec = self.headers.get("Range")
+        if spec:
+            first, _, last = spec.removeprefix("bytes=").partition("-")
+            start, end = int(first), int(last) if last else end
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(_PAYLOAD)}")
+        else:
+            self.send_response(200)
+        body = _PAYLOAD[start : end + 1]
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.sent += len(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+        self.server.sent = self.server.requests = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/model.gguf"
+        self.dir = tempfile.TemporaryDirectory()
+        self.dest = os.path.join(self.dir.name, "model.gguf")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.dir.cleanup()
+
+    def _fetched(self):
+        with open(self.dest, "rb") as f:
+            return f.read()
+
+    def _write_part(self, data):
+        with open(self.dest + ".part", "wb") as f:
+            f.write(data)
+
+    def test_fresh_segmented_download(self):
+        with mock.patch.object(downloader, "_MIN_SEGMENT", 16 * 1024):
+            Download(self.url, self.dest, segments=4, sha256=_SHA256).run()
+        self.assertEqual(self._fetched(), _PAYLOAD)
+        self.assertFalse(os.path.exists(self.dest + ".part.json"))
+
+    def test_metaless_prefix_resumes(self):
+        self._write_part(_PAYLOAD[:40000])
+        Download(self.url, self.dest, sha256=_SHA256).run()
+        self.assertEqual(self._fetched(), _PAYLOAD)
+        self.assertLess(self.server.sent, len(_PAYLOAD) - 40000 + 16)  # the probe's byte aside, only the rest
+
+    def test_metaless_full_size_part_starts_over(self):
+        # What an interrupted segmented download leaves once its meta is gone: preallocated, with holes
+        self._write_part(_PAYLOAD[:20000] + bytes(len(_PAYLOAD) - 20000))
+        Download(self.url, self.dest, sha256=_SHA256).run()
+        self.assertEqual(self._fetched(), _PAYLOAD)
+
+    def test_segment_meta_resumes(self):
+        with mock.patch.object(downloader, "_MIN_SEGMENT", 16 * 1024):
+            download = Download(self.url, self.dest, segments=4)
+            download._meta = download._plan(len(_PAYLOAD), True, '"v1"')
+            self._write_part(bytes(len(_PAYLOAD)))
+            for seg in download._meta["segments"]:
+                seg[2] = (seg[1] - seg[0] + 1) // 2
+                with open(download.part, "r+b") as f:
+                    f.seek(seg[0])
+                    f.write(_PAYLOAD[seg[0] : seg[0] + seg[2]])
+            download._save_meta()
+            Download(self.url, self.dest, segments=4, sha256=_SHA256).run()
+        self.assertEqual(self._fetched(), _PAYLOAD)
+
+    def test_checksum_mismatch_discards_the_part(self):
+        with self.assertRaises(ChecksumError):
+            Download(self.url, self.dest, sha256="0" * 64).run()
+        self.assertFalse(os.path.exists(self.dest))
+        self.assertFalse(os.path.exists(self.dest + ".part"))
+
+    def test_client_error_is_not_retried(self):
+        with mock.patch.object(downloader.time, "sleep") as sleep, self.assertRaises(HTTPError):
+            Download(self.url.replace("model.gguf", "missing.gguf"), self.dest).run()
+        self.assertEqual(self.server.requests, 1)
+        sleep.assert_not_called()
+
+    def test_unchecked_download_warns(self):
+        with self.assertLogs("planchette.model", "WARNING") as logs:
+            Download(self.url, self.dest).run()
+        self.assertEqual(self._fetched(), _PAYLOAD)
+        self.assertIn("unverified", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
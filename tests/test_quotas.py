@@ -0,0 +1,65 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from pymodules import quotas
+from pymodules.quotas import Quotas, QuotaExceededError
+
+
+def _user(rpm=None, tpm=None):
+    return SimpleNamespace(username="ada", requests_per_minute=rpm, tokens_per_minute=tpm)
+
+
+class QuotasTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch.object(quotas, "time", mock.Mock(monotonic=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.quotas = Quotas()
+
+    def test_unmetered(self):
+        user = _user()
+        for _ in range(100):
+            self.quotas.admit(user)
+        self.assertEqual(self.quotas.metered(user, [{"token": "A"}]), [{"token": "A"}])
+
+    def test_request_bucket(self):
+        user = _user(rpm=2)
+        self.quotas.admit(user)
+        self.quotas.admit(user)
+        with self.assertRaises(QuotaExceededError) as caught:
+            self.quotas.admit(user)
+        self.assertEqual((caught.exception.reason, caught.exception.retry_after), ("requests", 30))
+        self.now += 30
+        self.quotas.admit(user)
+
+    def test_refund(self):
+        user = _user(rpm=1)
+        self.quotas.admit(user)
+        self.quotas.refund(user)
+        self.quotas.admit(user)
+        self.assertRaises(QuotaExceededError, self.quotas.admit, user)
+
+    def test_token_bucket_charges_streamed_answers(self):
+        user = _user(tpm=10)
+        self.quotas.admit(user)
+        events = [{"queue": {"position": 1}}, {"tokens": ["Y", "E", "S"]}, {"token": " "}] * 3 + [{"done": True}]
+        self.assertEqual(list(self.quotas.metered(user, events)), events)  # 12 tokens against 10
+        with self.assertRaises(QuotaExceededError) as caught:
+            self.quotas.admit(user)
+        self.assertEqual((caught.exception.reason, caught.exception.retry_after), ("tokens", 13))
+        self.now += 13
+        self.quotas.admit(user)
+
+    def test_user_override(self):
+        with mock.patch.object(quotas, "_REQUESTS_PER_MINUTE", 1):
+            self.assertEqual(Quotas.limits(_user()), (1, 0))
+            self.assertEqual(Quotas.limits(_user(rpm=0)), (0, 0))
+            unlimited = _user(rpm=0)
+            for _ in range(5):
+                self.quotas.admit(unlimited)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+
+from pymodules import pipeline
+from pymodules.pipeline import RepeatStore
+
+
+class RepeatStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(pipeline, "time", mock.Mock(time=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = RepeatStore()
+
+    def test_second_sighting_is_banned(self):
+        self.store.record("a", "YES.")
+        self.assertEqual(self.store.banned("a"), [])
+        self.store.record("a", "yes")
+        self.assertEqual(self.store.banned("a"), ["yes"])
+        self.assertEqual(self.store.banned("b"), [])
+
+    def test_ban_expires(self):
+        self.store.record("a", "GOODBYE")
+        self.store.record("a", "GOODBYE")
+        self.now += pipeline._REPEAT_TTL - 1
+        self.assertEqual(self.store.banned("a"), ["GOODBYE"])
+        self.now += 1
+        self.assertEqual(self.store.banned("a"), [])
+        self.store.record("a", "GOODBYE")  # forgotten, so seen once again
+        self.assertEqual(self.store.banned("a"), [])
+
+    def test_rerecording_extends_the_ban(self):
+        self.store.record("a", "NO")
+        self.store.record("a", "NO")
+        self.now += pipeline._REPEAT_TTL - 1
+        self.store.record("a", "NO")
+        self.now += pipeline._REPEAT_TTL - 1
+        self.assertEqual(self.store.banned("a"), ["NO"])
+
+    def test_bounded_per_session(self):
+        with mock.patch.object(pipeline, "_REPEAT_PER_SESSION", 2):
+            for text in ("ONE", "ONE", "TWO", "THREE"):
+                self.now += 1
+                self.store.record("a", text)
+            self.store.record("a", "TWO")
+        self.assertEqual(self.store.banned("a"), ["TWO"])  # ONE, soonest to expire, was dropped
+
+    def test_least_recently_active_session_is_dropped(self):
+        with mock.patch.object(pipeline, "_REPEAT_SESSIONS", 2):
+            for sid in ("a", "b"):
+                self.store.record(sid, "YES")
+                self.store.record(sid, "YES")
+            self.store.banned("a")
+            self.store.record("c", "NO")
+            self.assertEqual(self.store.banned("a"), ["YES"])
+            self.assertEqual(self.store.banned("b"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import os
+import tempfile
+import unittest
+
+from bench.replay import load_sessions, parse_transcript, speaker_labels
+
+_GERMAN = """# Sitzung
+**Sie:** Ist hier jemand?
+**Geist:** JA.
+Sie: Wie heißt du?
+"""
+
+
+class TranscriptLabelsTest(unittest.TestCase):
+    def test_localized_exports_parse(self):
+        for text in (_GERMAN, "Vous : Qui es-tu ?\nEsprit : M\n", "您：你好\n灵体：是\n", "Вы: кто ты\nДух: ДА\n"):
+            with self.subTest(text=text.splitlines()[0]):
+                sessions = parse_transcript(text, "log")
+                self.assertTrue(sessions and sessions[0].turns)
+
+    def test_extra_labels(self):
+        self.assertFalse(parse_transcript("Du: Hallo\n", "log"))
+        self.assertEqual(len(parse_transcript("Du: Hallo\n", "log", speaker_labels([("Du", "Brett")]))), 1)
+
+    def test_file_without_sessions_is_an_error(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "notes.md")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("Ich: Hallo\n")
+            with self.assertRaisesRegex(ValueError, "--labels"):
+                load_sessions([path])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+from unittest import mock
+
+from pymodules import model_manager
+from pymodules.model_manager import InferenceScheduler, QueueFullError
+from pymodules.pipeline import _Stream, run_ask
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(model_manager, "is_model_downloaded", return_value=False)  # no instance checkout
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.scheduler = InferenceScheduler(max_depth=4, slots=1)
+
+    def test_grants_in_arrival_order(self):
+        first, second, third = (self.scheduler.submit() for _ in range(3))
+        self.assertTrue(first.wait(0))
+        self.assertEqual((second.position(), third.position()), (1, 2))
+
+        first.release()
+        self.assertTrue(second.granted)
+        self.assertFalse(third.granted)
+        self.assertEqual(third.position(), 1)
+
+        second.release()
+        self.assertTrue(third.granted)
+
+    def test_full_queue_is_turned_away(self):
+        self.scheduler.max_depth = 2
+        tickets = [self.scheduler.submit() for _ in range(3)]  # one granted, two waiting
+        with self.assertRaises(QueueFullError) as caught:
+            self.scheduler.submit()
+        self.assertGreaterEqual(caught.exception.retry_after, 1)
+
+        tickets[-1].release()
+        self.scheduler.submit()
+
+    def test_try_submit_never_jumps_the_queue(self):
+        first, second = self.scheduler.submit(), self.scheduler.submit()
+        self.assertIsNone(self.scheduler.try_submit())
+
+        first.release()
+        self.assertTrue(second.granted)
+        self.assertIsNone(self.scheduler.try_submit())
+
+        second.release()
+        helper = self.scheduler.try_submit()
+        self.assertTrue(helper.granted)
+        self.assertIsNone(self.scheduler.try_submit())
+
+    def test_queued_stream_closed_before_it_starts(self):
+        first, second = self.scheduler.submit(), self.scheduler.submit()
+        _Stream(second, run_ask(second, "Is anyone here?", [], False)).close()
+
+        self.assertTrue(second.released)
+        self.assertEqual(self.scheduler.stats()["waiting"], 0)
+        first.release()
+        self.assertEqual(self.scheduler.stats()["active"], 0)
+
+    def test_client_gone_while_queued(self):
+        first, second, third = (self.scheduler.submit() for _ in range(3))
+        stream = _Stream(second, run_ask(second, "Is anyone here?", [], False))
+        self.assertEqual(next(iter(stream))["queue"]["position"], 1)
+        stream.close()  # what the server does on a disconnect
+
+        self.assertEqual(third.position(), 1)
+        first.release()
+        self.assertTrue(third.granted)
+        self.assertFalse(second.granted)
+
+
+if __name__ == "__main__":
+    unittest.main()